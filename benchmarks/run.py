@@ -0,0 +1,145 @@
+"""
+Runs obyde's benchmark suite against a synthetic vault and writes the results as JSON.
+
+    python -m benchmarks.run --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import asdict
+
+from obyde import find_files, process_vault
+from obyde.assets import AssetDigestCache, write_asset_files
+from obyde.document import NoteDocument
+from obyde.linking import LinkResolver, rewrite_links
+from obyde.parsing import parse_content_blocks
+from obyde.rewriting import RewritingEngine, RewritingPipeline
+from obyde.rewriting.highlight import ObsidianHighlightRewritingTransformer
+from obyde.util import parse_obsidian_links, slugify_md_filename
+
+from .synthetic_vault import VaultSpec, generate_vault
+
+RESULTS_FORMAT_VERSION = 1
+
+
+def _obyde_version():
+    try:
+        from importlib.metadata import version
+        return version('obyde')
+    except Exception:
+        return 'unknown'
+
+
+def measure(function, repeat, setup=None):
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return {
+        'repeat': repeat,
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.mean(timings),
+        'max_s': max(timings),
+    }
+
+
+def run_suite(root, spec: VaultSpec, repeat=5):
+    config = generate_vault(root, spec)
+    md_files = find_files(config['vault']['path'], ext='.md')
+    asset_files = find_files(config['vault']['asset_path'])
+    documents = []
+    dated_files = {}
+    for name, path in md_files.items():
+        slug_name = slugify_md_filename(os.path.splitext(name)[0])
+        documents.append(NoteDocument.load(path))
+        dated_files[slug_name] = (
+            f'2021-01-01-{slug_name}', f'2021-01-01-{slug_name}.md', path)
+    bodies = [document.content for document in documents]
+    asset_output_path = config['output']['asset_output_path']
+    cache_dir = config['build']['cache_dir']
+
+    def clear_directory(path):
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+    first_digests = AssetDigestCache()
+    copied_asset_files = write_asset_files(
+        asset_files, asset_output_path, digest_cache=first_digests)
+    digest_cache = AssetDigestCache(first_digests.used)
+    engine = RewritingEngine(RewritingPipeline([ObsidianHighlightRewritingTransformer()]))
+    blocks = [parse_content_blocks(body) for body in bodies]
+    metadata_sections = [document.metadata_section() for document in documents]
+
+    def rewrite_all_links():
+        # A fresh resolver per run, as memoised resolutions would otherwise carry over
+        resolver = LinkResolver(dated_files, copied_asset_files, '/assets', 'jekyll')
+        for body in bodies:
+            rewrite_links(body, resolver)
+
+    def clear_outputs():
+        clear_directory(config['output']['post_output_path'])
+        clear_directory(cache_dir)
+
+    benchmarks = {
+        'parse_content_blocks': (lambda: [parse_content_blocks(body) for body in bodies], None),
+        'parse_obsidian_links': (lambda: [parse_obsidian_links(body) for body in bodies], None),
+        'rewrite_links': (rewrite_all_links, None),
+        'write_asset_files_cold': (lambda: write_asset_files(asset_files, asset_output_path),
+                                   lambda: clear_directory(asset_output_path)),
+        'write_asset_files_cached': (lambda: write_asset_files(asset_files, asset_output_path,
+                                                               digest_cache=digest_cache), None),
+        'rewriting_engine_rewrite': (lambda: [engine.rewrite(metadata, note_blocks)
+                                              for metadata, note_blocks in zip(metadata_sections, blocks)], None),
+        'process_vault_full': (lambda: process_vault(config, full=True), clear_outputs),
+        'process_vault_unchanged': (lambda: process_vault(config), None),
+    }
+
+    results = []
+    for name, (function, setup) in benchmarks.items():
+        result = measure(function, repeat, setup=setup)
+        result['name'] = name
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs the obyde benchmark suite')
+    parser.add_argument('--output', '-o', help='Path to write JSON results to, defaults to stdout')
+    parser.add_argument('--repeat', type=int, default=5)
+    for field, default in asdict(VaultSpec()).items():
+        parser.add_argument(f'--{field.replace("_", "-")}', type=type(default), default=default)
+    args = parser.parse_args()
+    spec = VaultSpec(**{field: getattr(args, field) for field in asdict(VaultSpec())})
+
+    with tempfile.TemporaryDirectory(prefix='obyde-bench-') as root:
+        results = run_suite(root, spec, repeat=args.repeat)
+
+    report = {
+        'format_version': RESULTS_FORMAT_VERSION,
+        'obyde_version': _obyde_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'spec': asdict(spec),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as fs:
+            fs.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
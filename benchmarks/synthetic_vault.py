@@ -0,0 +1,108 @@
+"""Generates synthetic Obsidian vaults for benchmarking obyde."""
+
+import argparse
+import json
+import os
+import random
+from dataclasses import asdict, dataclass
+
+WORDS = ('lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut '
+         'labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris '
+         'nisi aliquip ex ea commodo consequat').split()
+
+
+@dataclass
+class VaultSpec:
+    notes: int = 200
+    paragraphs_per_note: int = 20
+    words_per_paragraph: int = 60
+    links_per_note: int = 10
+    # Fraction of links pointing at attachments rather than other notes
+    attachment_link_ratio: float = 0.3
+    attachments: int = 100
+    attachment_size: int = 16 * 1024
+    # Fractions of paragraphs which are fenced code blocks or contain a highlight
+    code_block_density: float = 0.1
+    highlight_density: float = 0.2
+    # Fraction of notes with find/replace lists in their frontmatter
+    find_replace_ratio: float = 0.1
+    seed: int = 1337
+
+
+def _paragraph(rng, spec):
+    return ' '.join(rng.choice(WORDS) for _ in range(spec.words_per_paragraph))
+
+
+def _note_body(rng, spec, note_names, attachment_names):
+    paragraphs = []
+    for _ in range(spec.paragraphs_per_note):
+        roll = rng.random()
+        if roll < spec.code_block_density:
+            paragraphs.append(f'```python\nif a == b:\n    print("[[not a link]]")\n```')
+            continue
+        words = _paragraph(rng, spec).split()
+        if roll < spec.code_block_density + spec.highlight_density:
+            idx = rng.randrange(len(words))
+            words[idx] = f'=={words[idx]}=='
+        paragraphs.append(' '.join(words))
+
+    for _ in range(spec.links_per_note):
+        if attachment_names and rng.random() < spec.attachment_link_ratio:
+            link = f'![[{rng.choice(attachment_names)}]]'
+        else:
+            link = f'[[{rng.choice(note_names)}|a link]]'
+        idx = rng.randrange(len(paragraphs))
+        if paragraphs[idx].startswith('```'):
+            idx = (idx + 1) % len(paragraphs)
+        paragraphs[idx] += ' ' + link
+    return '\n\n'.join(paragraphs)
+
+
+def generate_vault(root, spec: VaultSpec):
+    """
+    Writes a vault and empty output directories under root, and returns an obyde
+    configuration for them.
+    """
+    rng = random.Random(spec.seed)
+    vault_path = os.path.join(root, 'vault')
+    asset_path = os.path.join(vault_path, 'attachments')
+    post_output_path = os.path.join(root, 'site', '_posts')
+    asset_output_path = os.path.join(root, 'site', 'assets')
+    for path in (asset_path, post_output_path, asset_output_path):
+        os.makedirs(path, exist_ok=True)
+
+    attachment_names = [f'attachment {i}.bin' for i in range(spec.attachments)]
+    for name in attachment_names:
+        with open(os.path.join(asset_path, name), 'wb') as fs:
+            fs.write(rng.getrandbits(8 * spec.attachment_size).to_bytes(spec.attachment_size, 'little')
+                     if spec.attachment_size else b'')
+
+    note_names = [f'Note {i}' for i in range(spec.notes)]
+    for i, name in enumerate(note_names):
+        frontmatter = [f'date: 2021-{i % 12 + 1:02d}-{i % 28 + 1:02d}', f'title: {name}']
+        if rng.random() < spec.find_replace_ratio:
+            frontmatter += ['find:', '  - lorem', '  - dolor(e)?', 'replace:', '  - LOREM', '  - pain']
+        body = _note_body(rng, spec, note_names, attachment_names)
+        with open(os.path.join(vault_path, f'{name}.md'), 'w', encoding='utf-8') as fs:
+            fs.write('---\n' + '\n'.join(frontmatter) + '\n---\n' + body + '\n')
+
+    return {
+        'vault': {'path': vault_path, 'asset_path': asset_path},
+        'output': {'post_output_path': post_output_path, 'asset_output_path': asset_output_path},
+        'build': {'cache_dir': os.path.join(root, 'cache')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates a synthetic Obsidian vault')
+    parser.add_argument('root', help='Directory to generate the vault and site directories in')
+    for field, default in asdict(VaultSpec()).items():
+        parser.add_argument(f'--{field.replace("_", "-")}', type=type(default), default=default)
+    args = parser.parse_args()
+    spec = VaultSpec(**{field: getattr(args, field) for field in asdict(VaultSpec())})
+    config = generate_vault(args.root, spec)
+    print(json.dumps(config, indent=2))
+
+
+if __name__ == '__main__':
+    main()
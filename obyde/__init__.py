@@ -1,20 +1,38 @@
 # -*- coding: utf-8 -*-
 
 import argparse
+import cProfile
 import os
-import re
-import string
 import sys
-from collections import defaultdict
-from hashlib import sha256
 
-import frontmatter
 import yaml
 
-from .parsing import parse_content_blocks
-from .rewriting import RewritingEngine, RewritingPipeline
+from .anchors import NoteAnchors, note_anchors
+from .asset_transforms import VARIANT_CACHE_DIRNAME, AssetTransforms
+from .assets import (ASSET_CACHE_FILENAME, ASSET_EXPORT_MODES,
+                     AssetDigestCache, ReferencedAssetIndex,
+                     collect_garbage_assets, write_asset_files)
+from .block_cache import (BLOCK_CACHE_FILENAME, DEFAULT_BLOCK_CACHE_SIZE_MB,
+                          BlockCache)
+from .check import check_problems_message, check_vault, validate_postdate
+from .discovery import dir_exists_or_raise, find_files, scan_vault
+from .document import NoteDocument, read_note_index
+from .graph import link_graph, write_link_graph
+from .linking import LinkResolver
+from .manifest import (BuildManifest, build_fingerprint, cache_dir_path,
+                       note_stat_key)
+from .rendering import (RenderContext, RenderTarget, RenderTask,
+                        prune_stale_posts, render_errors_message,
+                        render_notes)
+from .rewriting import RewritingPipeline
 from .rewriting.highlight import ObsidianHighlightRewritingTransformer
-from .util import parse_obsidian_links, slugify_md_filename
+from .search import (SEARCH_CACHE_FILENAME, SearchTermCache, SearchTokenizer,
+                     build_search_index, search_index_key, write_search_index)
+from .stats import NULL_STATS, BuildStats
+from .targets import build_targets, target_config
+from .transclusion import DEFAULT_MAX_EMBED_DEPTH, Transcluder
+from .watch import watch_vault
+from .util import slugify_md_filename
 
 __all__ = ['main']
 
@@ -24,6 +42,20 @@ def parse_args():
                                      description='Moves and process markdown vaults (mainly Obsidian) to a publishable format')
     parser.add_argument('-c', '--config', type=str, required=True,
                         help='Path to yaml config file. Check config.sample.yaml for an example.')
+    parser.add_argument('--full', action='store_true',
+                        help='Ignore the build manifest and rebuild every note.')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='Number of processes used to render notes, 0 uses one per CPU. Overrides build.jobs in the config.')
+    parser.add_argument('--check', action='store_true',
+                        help='Validate the vault without writing anything: note dates, filename collisions, unterminated code blocks and unresolved links.')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and rebuild whenever notes or attachments change.')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print the time spent in each build stage along with file, byte and link counters.')
+    parser.add_argument('--stats-json', type=str, default=None, metavar='PATH',
+                        help='Write the build stats to PATH as JSON.')
+    parser.add_argument('--profile', type=str, default=None, metavar='PATH',
+                        help='Run the build under cProfile and write the pstats output to PATH. Only the main process is profiled.')
     return parser.parse_args()
 
 
@@ -37,209 +69,405 @@ def load_config(config_path):
             'Failed to load configuration. Is the file path correct?')
 
 
-def dir_exists_or_raise(dirpath, dirpath_type):
-    if not os.path.exists(dirpath) or not os.path.isdir(dirpath):
-        raise ValueError(
-            f'{dirpath} - {dirpath_type} does not exist or is not a directory')
-    return dirpath
-
-
-def find_files(dirpath, ext='', exclusions=[]):
-    dirpath = os.path.abspath(dirpath)
-    dirpath = dir_exists_or_raise(dirpath, 'input files location')
-    index = defaultdict(set)
-
-    if exclusions:
-        exclusions = list(
-            map(lambda exc: os.path.join(dirpath, exc), exclusions))
-
-    def filefilter(f):
-        correct_extension = (ext and f.endswith(ext)) or (not ext)
-        return correct_extension
-
-    def excluded_dir(d):
-        return any(map(lambda exc: exc in os.path.commonpath([exc, d]), exclusions))
-
-    for root, _, files in os.walk(dirpath, followlinks=False):
-        filtered_files = filter(filefilter, files)
-
-        if excluded_dir(root):
-            continue
-
-        for f in filtered_files:
-            index[f].add(os.path.join(root, f))
-
-    for x, p in index.items():
-        if len(p) > 1:
-            filenames = ','.join(p)
-            raise ValueError(
-                f'Filename collision detected for {filenames}. This is currently not a supported operating mode.')
-
-    cleaned_index = {}
-
-    for x, p in index.items():
-        cleaned_index[x] = p.pop()
-
-    return cleaned_index
-
-
-def generate_post_link(dated_name, post_link_mode):
-    if post_link_mode == 'jekyll':
-        return f'{{% post_url {dated_name} %}}'
-    elif post_link_mode == 'hugo':
-        return f'{{{{< relref "{dated_name}" >}}}}'
+def links_still_resolve(links, resolver, source=None):
+    for link_target, recorded in links.items():
+        resolution = resolver.resolve(link_target, source)
+        if (list(resolution) if resolution else None) != recorded:
+            return False
+    return True
+
+
+def missing_fragment_messages(manifest):
+    """Describes the links recorded in a manifest which point to a heading or block that does not exist."""
+    messages = []
+    for slug_name, record in sorted(manifest.notes.items()):
+        for link_target, resolution in record['links'].items():
+            if resolution and resolution[3] is not None:
+                messages.append(f'{record["path"]}: Link [[{link_target}]] points to a heading or block '
+                                f'which does not exist in {resolution[1]}.')
+    return messages
+
+
+def embeds_unchanged(embeds, note_inputs):
+    for slug_name, digest in embeds.items():
+        inputs = note_inputs.get(slug_name)
+        if inputs is None or inputs[1] != digest:
+            return False
+    return True
+
+
+def resolve_jobs(jobs, build_config):
+    if jobs is None:
+        jobs = int(build_config.get('jobs', 1))
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    return jobs
+
+
+class BuildState(object):
+    """
+    The indexes kept in memory between consecutive builds of a long running process, so that
+    they do not have to be loaded from the cache directory or rediscovered every time.
+    """
+
+    def __init__(self):
+        self.scan = None
+        # Manifest path to the manifest of every target of the last build
+        self.manifests = {}
+        # The asset digest cache entries used by the last build
+        self.asset_digests = None
+        # The block cache of the last build, which keeps the blocks it looked up in memory
+        self.block_cache = None
+
+
+def process_vault(config, full=False, jobs=None, stats=NULL_STATS, state=None):
+    """
+    Builds every target of a vault. Returns summary lines about the posts pruned and the
+    assets exported and collected, which are also counted in stats.
+    """
+    with stats.stage('discover'):
+        if state is not None and state.scan is not None:
+            scan = state.scan
+            if scan.collisions:
+                raise ValueError('\n'.join(scan.collisions))
+        else:
+            scan = scan_vault(config['vault']['path'], config['vault']['asset_path'],
+                              exclusions=config['vault'].get('excluded_subdirectories', []),
+                              ignored_dirs=[cache_dir_path(config)])
+    md_files = scan.notes
+    asset_files = scan.assets
+    stats.count('notes_scanned', len(md_files))
+    stats.count('assets_scanned', len(asset_files))
+    build_config = config.get('build') or {}
+    cache_dir = cache_dir_path(config)
+    targets = build_targets(config, cache_dir)
+    asset_cache_path = os.path.join(cache_dir, ASSET_CACHE_FILENAME)
+    if state is not None and state.asset_digests is not None:
+        asset_digest_cache = AssetDigestCache(state.asset_digests)
     else:
-        raise ValueError(f'Unknown post link mode: {post_link_mode}')
-
-
-def find_replace(content, metadata):
-    find_list = metadata.get("find")
-    replace_list = metadata.get("replace")
-
-    if not (find_list and replace_list):
-        return content
-
-    if len(find_list) != len(replace_list):
+        asset_digest_cache = AssetDigestCache.load(asset_cache_path)
+    asset_copy_mode = build_config.get('asset_copy_mode', 'copy')
+    export_assets = build_config.get('export_assets', 'all')
+    if export_assets not in ASSET_EXPORT_MODES:
         raise ValueError(
-            f'Length of with list is not the same as the length of the replace list')
-
-    rewritten = content
-    for i in range(len(find_list)):
-        find_regex = re.compile(find_list[i])
-        replace_string = replace_list[i]
-        rewritten = re.sub(find_regex, replace_string, rewritten)
-
-    return rewritten
-
-
-def rewrite_links(content, dated_file_index, asset_index, relative_asset_path_prefix, post_link_mode):
-    obsidian_links = parse_obsidian_links(content)
-    rewritten = content
-    for link in obsidian_links:
-        link_text = link.replace('[[', '').replace(']]', '')
-        link_target = link_text
-        if '|' in link_text:
-            split_link = link_text.split('|')
-            link_target = split_link[0]
-            link_text = split_link[1] if len(split_link) > 1 else ''
-        written = False
-        for filename, filepaths in asset_index.items():
-            oldpath, newpath = filepaths
-            if link_target in filename or link_target in oldpath:
-                rewritten = rewritten.replace(
-                    link, f'[{link_text}]({relative_asset_path_prefix}/{newpath})')
-                written = True
-                break
-        if not written:
-            link_name_slug = slugify_md_filename(link_target)
-            dated_name, _, _ = dated_file_index.get(
-                link_name_slug, (None, None, None))
-            if dated_name:
-                rewritten = rewritten.replace(
-                    link, f'[{link_text}]({generate_post_link(dated_name, post_link_mode)})')
-    return rewritten
-
-
-def write_asset_files(asset_files, asset_output_path):
-    modified_file_paths = {}
-    for name, path in asset_files.items():
-        data = b''
-        extension = os.path.splitext(path)[1]
-        with open(path, 'rb') as fs:
-            data = fs.read()
-        hashed_fname = sha256(data).hexdigest() + extension
-        asset_path = os.path.join(asset_output_path, hashed_fname)
-        if not os.path.exists(asset_path):
-            with open(asset_path, 'wb') as out:
-                out.write(data)
-        modified_file_paths[name] = (path, hashed_fname)
-    return modified_file_paths
-
-
-def validate_postdate(path, postdate):
-    if not postdate:
-        raise ValueError(
-            f'Post at {path} does not have a date, please add a date to the frontmatter.')
-
-    components = tuple(postdate.split('-'))
-    try:
-        assert len(components) == 3
-        year, month, day = components
-        for comp in [year, month, day]:
-            assert all(map(lambda x: x in string.digits, comp))
-    except AssertionError:
-        raise ValueError(
-            'Invalid frontmatter date format! Expected format is YYYY-MM-DD')
-    return postdate
-
-
-def rewrite_post_with_engine(engine: RewritingEngine, post):
-    post_content = post.content
-    post.content = ""
-    post_metadata = frontmatter.dumps(post)
-    post_content_blocks = parse_content_blocks(post_content)
-
-    post_metadata, post_content = engine.rewrite(
-        post_metadata, post_content_blocks)
-    post_text = "\n".join([post_metadata, post_content])
-    post = frontmatter.loads(post_text)
-    return post
-
-
-def process_vault(config):
-    md_files = find_files(config['vault']['path'], ext='.md',
-                          exclusions=config['vault'].get('excluded_subdirectories', []))
-    asset_files = find_files(config['vault']['asset_path'])
-    post_output_path = dir_exists_or_raise(
-        config['output']['post_output_path'], 'post output path')
-    asset_output_path = dir_exists_or_raise(
-        config['output']['asset_output_path'], 'asset output path')
-    relative_asset_path_prefix = config['output'].get(
-        'relative_asset_path_prefix', '{{ site.assets_location }}')
-    post_link_mode = config['output'].get('post_link_mode', 'jekyll')
-    if not post_link_mode in ['jekyll', 'hugo']:
-        raise ValueError(
-            f'Unknown post link mode "{post_link_mode}". must be set to either "jekyll" or "hugo".')
-
-    copied_asset_files = write_asset_files(asset_files, asset_output_path)
-
-    dated_files = {}
-    post_map = {}
-    for name, path in md_files.items():
-        name, ext = os.path.splitext(name)
-        slug_name = slugify_md_filename(name)
-        post = frontmatter.load(path)
-        postdate = validate_postdate(path, str(post.metadata.get('date', '')))
-        dated_name = postdate + '-' + slug_name
-        dated_name_ext = dated_name + ext
-        dated_files[slug_name] = (dated_name, dated_name_ext, path)
-        post_map[slug_name] = post
+            f'Unknown asset export mode "{export_assets}". must be set to either "all" or "referenced".')
+    jobs = resolve_jobs(jobs, build_config)
+    asset_transforms = None
+    if build_config.get('asset_transforms'):
+        asset_transforms = AssetTransforms(build_config['asset_transforms'],
+                                           os.path.join(cache_dir, VARIANT_CACHE_DIRNAME), jobs=jobs)
+    # Assets are hashed once and the digests shared by every target
+    for target in targets:
+        if export_assets == 'all':
+            with stats.stage('assets'):
+                target.copied_asset_files = write_asset_files(
+                    asset_files, target.asset_output_path, digest_cache=asset_digest_cache,
+                    copy_mode=asset_copy_mode, stats=stats, stat=scan.stat, transforms=asset_transforms)
+        else:
+            # Assets are only hashed once a link resolves to them and exported after rendering
+            target.copied_asset_files = ReferencedAssetIndex(
+                asset_files, asset_digest_cache, stat=scan.stat, transforms=asset_transforms)
 
     rewriting_pipeline = RewritingPipeline([
         ObsidianHighlightRewritingTransformer()
     ])
-    rewrite_engine = RewritingEngine(transformer=rewriting_pipeline)
 
-    for slug_name, data in dated_files.items():
-        _, dated_name_ext, path = data
-        post = post_map[slug_name]
-
-        # Allow find_replace to run on metadata in addition to post content
-        post_text = find_replace(frontmatter.dumps(post), post.metadata)
-        post = frontmatter.loads(post_text)
-        post = rewrite_post_with_engine(rewrite_engine, post)
-
-        rewritten = rewrite_links(
-            post.content, dated_files, copied_asset_files, relative_asset_path_prefix, post_link_mode)
-        post.content = rewritten
-        with open(os.path.join(post_output_path, dated_name_ext),  'wb') as out:
-            frontmatter.dump(post, out)
+    for target in targets:
+        fingerprint = build_fingerprint(target_config(config, target.output), rewriting_pipeline)
+        previous_manifest = state.manifests.get(target.manifest_path) if state is not None else None
+        if full:
+            previous_manifest = BuildManifest(fingerprint)
+        elif previous_manifest is None or previous_manifest.fingerprint != fingerprint:
+            previous_manifest = BuildManifest.load(target.manifest_path, fingerprint)
+        target.previous_manifest = previous_manifest
+        target.manifest = BuildManifest(fingerprint)
+
+    # Phase one indexes the frontmatter, headings and block ids of every note which changed. The
+    # anchor index needs every changed body, so notes are read in full here, one at a time
+    dated_files = {}
+    # Note slug to the headings and block ids links can point to
+    anchor_index = {}
+    # The notes which changed since the last build of each target
+    changed_notes = [set() for _ in targets]
+    note_inputs = {}
+    with stats.stage('read'):
+        for name, path in md_files.items():
+            name, ext = os.path.splitext(name)
+            slug_name = slugify_md_filename(name)
+            stat = scan.stat(path)
+            record = next((record for record in (
+                target.previous_manifest.stat_unchanged_record(slug_name, path, stat) for target in targets)
+                if record), None)
+            if record:
+                digest = record['digest']
+                postdate = record['date']
+                anchors = NoteAnchors(record['headings'], record['blocks'])
+            else:
+                metadata, digest, body = read_note_index(path)
+                anchors = note_anchors(body)
+                del body
+                stats.count('bytes_read', stat.st_size)
+                stats.count('bytes_hashed', stat.st_size)
+                postdate = None
+            for target, target_changed_notes in zip(targets, changed_notes):
+                record = target.previous_manifest.unchanged_record(slug_name, path, digest)
+                if record:
+                    postdate = record['date']
+                else:
+                    target_changed_notes.add(slug_name)
+            if postdate is None:
+                postdate = validate_postdate(path, str(metadata.get('date', '')))
+            dated_name = postdate + '-' + slug_name
+            dated_name_ext = dated_name + ext
+            dated_files[slug_name] = (dated_name, dated_name_ext, path)
+            anchor_index[slug_name] = anchors
+            note_inputs[slug_name] = (stat, digest, postdate, anchors)
+
+    with stats.stage('plan'):
+        tasks = {}
+        for index, target in enumerate(targets):
+            target.link_resolver = LinkResolver(dated_files, target.copied_asset_files,
+                                                target.relative_asset_path_prefix, target.post_link_mode,
+                                                mode=build_config.get('link_resolution', 'indexed'),
+                                                asset_paths=asset_files, anchor_index=anchor_index)
+            for slug_name, data in dated_files.items():
+                _, dated_name_ext, path = data
+                output_file = os.path.join(target.post_output_path, dated_name_ext)
+
+                if slug_name not in changed_notes[index]:
+                    record = target.previous_manifest.notes[slug_name]
+                    # Skip notes whose content, link targets and embedded notes did not change since the
+                    # last build
+                    if record['output'] == dated_name_ext and os.path.exists(output_file) \
+                            and links_still_resolve(record['links'], target.link_resolver, slug_name) \
+                            and embeds_unchanged(record['embeds'], note_inputs):
+                        target.manifest.notes[slug_name] = dict(record, stat=note_stat_key(note_inputs[slug_name][0]))
+                        continue
+                # A note is rendered once for all the targets it changed for
+                task = tasks.get(slug_name)
+                if task is None:
+                    task = tasks[slug_name] = RenderTask(slug_name, path)
+                task.output_names[index] = dated_name_ext
+        tasks = list(tasks.values())
+    stats.count('notes_rendered', len(tasks))
+    stats.count('notes_skipped', len(dated_files) - len(tasks))
+
+    block_cache = None
+    if build_config.get('block_cache', False):
+        block_cache_path = os.path.join(cache_dir, BLOCK_CACHE_FILENAME)
+        if state is not None and state.block_cache is not None and state.block_cache.path == block_cache_path:
+            block_cache = state.block_cache
+        else:
+            block_cache = BlockCache(block_cache_path)
+        block_cache.max_bytes = build_config.get('block_cache_size_mb', DEFAULT_BLOCK_CACHE_SIZE_MB) * 1024 * 1024
+    find_replace_skip_preformatted = build_config.get('find_replace_skip_preformatted', False)
+    transcluder = Transcluder({slug_name: path for slug_name, (_, _, path) in dated_files.items()},
+                              rewriting_pipeline, find_replace_skip_preformatted=find_replace_skip_preformatted,
+                              block_cache=block_cache,
+                              max_depth=int(build_config.get('max_embed_depth', DEFAULT_MAX_EMBED_DEPTH)))
+    search_targets = [target for target in targets if target.search_index_path]
+    tokenizer = None
+    if search_targets:
+        tokenizer = SearchTokenizer(build_config.get('search'))
+        search_cache_path = os.path.join(cache_dir, SEARCH_CACHE_FILENAME)
+        search_cache = SearchTermCache.load(search_cache_path, tokenizer.fingerprint())
+    render_context = RenderContext(rewriting_pipeline,
+                                   [RenderTarget(target.link_resolver, target.post_output_path) for target in targets],
+                                   find_replace_skip_preformatted=find_replace_skip_preformatted,
+                                   collect_stats=stats.enabled, block_cache=block_cache, transcluder=transcluder,
+                                   tokenizer=tokenizer)
+    failed_results = []
+    with stats.stage('render'):
+        for result in render_notes(render_context, tasks, jobs=jobs):
+            if result.stats is not None:
+                stats.merge(result.stats)
+            if result.block_cache_updates is not None:
+                block_cache.merge(result.block_cache_updates)
+            if result.error is not None:
+                failed_results.append(result)
+                continue
+            stat, digest, postdate, anchors = note_inputs[result.slug_name]
+            if result.search_terms is not None:
+                search_cache.set(result.slug_name, digest, *result.search_terms)
+            for index, resolved_links in result.resolved_links.items():
+                targets[index].manifest.record(result.slug_name, result.path, stat, digest, postdate,
+                                               dated_files[result.slug_name][1], resolved_links, result.embeds,
+                                               anchors)
+
+    # Whether a heading or block exists does not depend on the target, and the manifest also
+    # covers the notes which were not rendered again
+    missing_fragments = missing_fragment_messages(targets[0].manifest)
+    stats.count('link_fragments_missing', len(missing_fragments))
+    for message in missing_fragments:
+        print(f'Warning: {message}', file=sys.stderr)
+
+    if tokenizer is not None:
+        with stats.stage('search'):
+            failed_notes = {result.slug_name for result in failed_results}
+            notes = [(slug_name, dated_files[slug_name][0], note_inputs[slug_name][1])
+                     for slug_name in sorted(dated_files) if slug_name not in failed_notes]
+            index_key = search_index_key(notes, tokenizer.max_index_bytes)
+            # Unchanged when no note was added, removed, renamed or edited, which the cache on disk still covers
+            if index_key != search_cache.index_key \
+                    or not all(os.path.exists(target.search_index_path) for target in search_targets):
+                index = _search_index(tokenizer, search_cache, notes, dated_files, stats)
+                for target in search_targets:
+                    write_search_index(target.search_index_path, index)
+                search_cache.index_key = index_key
+                search_cache.save(search_cache_path)
+
+    output_names = {dated_name_ext for _, dated_name_ext, _ in dated_files.values()}
+    summary = []
+    for target in targets:
+        summary.extend(_finish_target(target, build_config, dated_files, output_names, asset_files,
+                                      asset_digest_cache, scan, stats, asset_transforms))
+
+    if asset_transforms is not None:
+        stats.count('asset_variants_encoded', len(asset_transforms.encoded_sizes))
+        # Variants of the assets which failed notes link to must not be lost
+        if not failed_results:
+            asset_transforms.prune()
+
+    if block_cache is not None:
+        stats.count('block_cache_hits', block_cache.hits)
+        stats.count('block_cache_misses', block_cache.misses)
+        with stats.stage('block_cache'):
+            block_cache.save()
+        block_cache.take_updates()
+
+    asset_digest_cache.save(asset_cache_path)
+    # Assets hashed in render worker processes are not included
+    stats.count('bytes_hashed', sum(asset_digest_cache.hashed_sizes))
+
+    if state is not None:
+        state.scan = scan
+        state.manifests = {target.manifest_path: target.manifest for target in targets}
+        state.asset_digests = asset_digest_cache.used
+        state.block_cache = block_cache
+
+    if failed_results:
+        raise ValueError(render_errors_message(failed_results))
+    return summary
+
+
+def _search_index(tokenizer, search_cache, notes, dated_files, stats):
+    """Builds the search index of (slug, dated name, digest) notes, from the term cache where possible."""
+    documents = []
+    for slug_name, dated_name, digest in notes:
+        entry = search_cache.get(slug_name, digest)
+        if entry is None:
+            # Notes which were not rendered again but were never tokenised either, e.g. because
+            # search was only just configured
+            path = dated_files[slug_name][2]
+            entry = tokenizer.document_terms(NoteDocument.load(path), path)
+            search_cache.set(slug_name, digest, *entry)
+            stats.count('search_notes_read')
+        title, terms = entry
+        documents.append((slug_name, dated_name, title, terms))
+    index, pruned = build_search_index(documents, tokenizer.max_index_bytes)
+    stats.count('search_terms', len(index['terms']))
+    stats.count('search_terms_pruned', pruned)
+    return index
+
+
+def _finish_target(target, build_config, dated_files, output_names, asset_files, asset_digest_cache, scan, stats,
+                   asset_transforms=None):
+    """
+    Saves a target's manifest, writes its link graph and prunes, exports and collects its posts
+    and assets as configured. Returns summary lines about what was pruned, exported and collected.
+    """
+    summary = []
+    prune_posts = build_config.get('prune_posts', False)
+    if prune_posts:
+        # Read before the manifest is overwritten, a full build or a new configuration must not
+        # forget about posts written by the previous build
+        stale_posts = BuildManifest.recorded_outputs(target.manifest_path) - output_names
+
+    # Notes which failed to render are left out of the manifest so that they get retried
+    with stats.stage('manifest'):
+        target.manifest.save(target.manifest_path)
+
+    if target.link_graph_path:
+        # Built from the links recorded in the manifest, which covers the notes that were not
+        # rendered again
+        with stats.stage('link_graph'):
+            write_link_graph(target.link_graph_path,
+                             link_graph(target.manifest, dated_files, target.copied_asset_files))
+
+    if prune_posts:
+        with stats.stage('prune_posts'):
+            pruned_count = prune_stale_posts(target.post_output_path, stale_posts)
+        stats.count('posts_pruned', pruned_count)
+        summary.append(f'Pruned {pruned_count} stale posts from {target.post_output_path}.')
+
+    copied_asset_files = target.copied_asset_files
+    if build_config.get('export_assets', 'all') == 'referenced':
+        with stats.stage('assets'):
+            referenced_assets = target.manifest.referenced_assets()
+            copied_asset_files = write_asset_files({name: asset_files[name] for name in referenced_assets},
+                                                   target.asset_output_path, digest_cache=asset_digest_cache,
+                                                   copy_mode=build_config.get('asset_copy_mode', 'copy'),
+                                                   stats=stats, stat=scan.stat, transforms=asset_transforms)
+            skipped_bytes = sum(scan.stat(path).st_size for name, path in asset_files.items()
+                                if name not in referenced_assets)
+        stats.count('assets_skipped', len(asset_files) - len(referenced_assets))
+        stats.count('bytes_skipped', skipped_bytes)
+        summary.append(f'Exported {len(referenced_assets)} of {len(asset_files)} assets, '
+                       f'skipped {skipped_bytes} bytes of unreferenced assets.')
+
+    if build_config.get('gc_assets', False):
+        with stats.stage('gc_assets'):
+            deleted_count, deleted_bytes = collect_garbage_assets(
+                target.asset_output_path, {hashed_fname for _, hashed_fname in copied_asset_files.values()})
+        stats.count('assets_deleted', deleted_count)
+        stats.count('bytes_deleted', deleted_bytes)
+        summary.append(f'Deleted {deleted_count} unreferenced assets ({deleted_bytes} bytes) '
+                       f'from {target.asset_output_path}.')
+    return summary
+
+
+def watch(config, jobs=None):
+    state = BuildState()
+
+    def build(scan, initial):
+        state.scan = scan
+        # Rebuilds usually only render a few notes, not worth starting worker processes for
+        process_vault(config, jobs=jobs if initial else 1, state=state)
+
+    watch_vault(config, build)
 
 
 def main():
     try:
         args = parse_args()
         config = load_config(args.config)
-        process_vault(config)
+        if args.check:
+            problems = check_vault(config, jobs=resolve_jobs(args.jobs, config.get('build') or {}))
+            if problems:
+                raise ValueError(check_problems_message(problems))
+            print('No problems found.')
+            return
+        if args.watch:
+            watch(config, jobs=args.jobs)
+            return
+        stats = BuildStats() if args.stats or args.stats_json else NULL_STATS
+        profiler = cProfile.Profile() if args.profile else None
+        try:
+            with stats.stage('total'):
+                if profiler:
+                    summary = profiler.runcall(process_vault, config, full=args.full, jobs=args.jobs, stats=stats)
+                else:
+                    summary = process_vault(config, full=args.full, jobs=args.jobs, stats=stats)
+            for line in summary:
+                print(line)
+        finally:
+            # Also reported for failed builds, which are often the slow ones
+            if profiler:
+                profiler.dump_stats(args.profile)
+            if args.stats:
+                print(stats.format_report())
+            if args.stats_json:
+                stats.save_json(args.stats_json)
     except ValueError as e:
         print(f'Error: {e}', file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,66 @@
+import re
+from typing import List, NamedTuple
+
+from .parsing import iter_block_ids, iter_headings
+
+# Characters which Obsidian leaves out of links to headings
+_OBSIDIAN_HEADING_LINK_CHARS = re.compile(r'[#^\[\]|:%\\]')
+_JEKYLL_NON_ANCHOR_CHARS = re.compile(r'[^\w\- \t]')
+
+
+class NoteAnchors(NamedTuple):
+    """The headings and ^block ids of a note, which links can point into."""
+    headings: List[str]
+    blocks: List[str]
+
+
+def note_anchors(content):
+    return NoteAnchors([heading.text for heading in iter_headings(content)],
+                       [block_id.name for block_id in iter_block_ids(content)])
+
+
+def normalise_heading(text):
+    """Reduces heading text to what a link to the heading has to match, ignoring case and repeated whitespace."""
+    return ' '.join(_OBSIDIAN_HEADING_LINK_CHARS.sub(' ', text).split()).lower()
+
+
+def _jekyll_anchor(text, counts):
+    # kramdown's GFM parser, which Jekyll uses by default
+    anchor = _JEKYLL_NON_ANCHOR_CHARS.sub('', text.lower()).replace(' ', '-').replace('\t', '-')
+    count = counts.get(anchor, 0)
+    counts[anchor] = count + 1
+    return f'{anchor}-{count}' if count else anchor
+
+
+def _hugo_anchor(text, counts):
+    # Goldmark's github style ids, which Hugo uses by default
+    anchor = ''.join('-' if char.isspace() or char == '-' else char.lower()
+                     for char in text.strip() if char.isspace() or char in '-_' or char.isalnum()) or 'heading'
+    if anchor in counts:
+        suffix = 1
+        while f'{anchor}-{suffix}' in counts:
+            suffix += 1
+        anchor = f'{anchor}-{suffix}'
+    counts[anchor] = 1
+    return anchor
+
+
+_ANCHOR_GENERATORS = {
+    'jekyll': _jekyll_anchor,
+    'hugo': _hugo_anchor,
+}
+
+
+def heading_anchors(headings, post_link_mode):
+    """
+    Maps the normalised text of every heading to the id the site generator gives it. Links to
+    headings which appear more than once point to the first of them.
+    """
+    generate = _ANCHOR_GENERATORS[post_link_mode]
+    counts = {}
+    anchors = {}
+    for text in headings:
+        anchor = generate(text, counts)
+        if anchor:
+            anchors.setdefault(normalise_heading(text), anchor)
+    return anchors
@@ -0,0 +1,211 @@
+import json
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import sha256
+
+VARIANT_CACHE_DIRNAME = 'variants'
+ASSET_TRANSFORM_FORMATS = {
+    'webp': ('WEBP', '.webp'),
+    'avif': ('AVIF', '.avif'),
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+}
+ASSET_TRANSFORM_OPTIONS = ('max_width', 'max_height', 'format', 'quality')
+# Formats which can hold every frame of an animated image
+_ANIMATED_FORMATS = ('WEBP', 'PNG', 'GIF')
+
+
+def _load_pillow():
+    """Returns PIL.Image with every available encoder registered, or None if Pillow is not installed."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    try:
+        # Registers an AVIF encoder with Pillow versions which do not come with one
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    return Image
+
+
+def _available_formats():
+    Image = _load_pillow()
+    return None if Image is None else set(Image.SAVE)
+
+
+def parse_asset_transforms(config):
+    """
+    Validates the asset_transforms build option, which maps file extensions to transform
+    options. Returns the options of every extension, keyed by its lowercased extension.
+    """
+    if not isinstance(config, dict):
+        raise ValueError('asset_transforms must map file extensions to transform options.')
+    transforms = {}
+    for extension, options in config.items():
+        extension = '.' + str(extension).lower().lstrip('.')
+        options = options or {}
+        unknown = [key for key in options if key not in ASSET_TRANSFORM_OPTIONS]
+        if unknown:
+            raise ValueError(f'Unknown asset transform option "{unknown[0]}" for {extension} assets. '
+                             f'must be one of {", ".join(ASSET_TRANSFORM_OPTIONS)}.')
+        output_format = options.get('format')
+        if output_format is not None and str(output_format).lower() not in ASSET_TRANSFORM_FORMATS:
+            raise ValueError(f'Unknown asset transform format "{output_format}" for {extension} assets. '
+                             f'must be one of {", ".join(ASSET_TRANSFORM_FORMATS)}.')
+        params = {'format': str(output_format).lower() if output_format is not None else None}
+        for key in ('max_width', 'max_height', 'quality'):
+            value = options.get(key)
+            params[key] = int(value) if value is not None else None
+        transforms[extension] = params
+    return transforms
+
+
+def _encode_variant(source, destination, params):
+    """Writes the variant of an image described by params. Runs in worker processes."""
+    Image = _load_pillow()
+    from PIL import ImageOps
+    tmp_destination = f'{destination}.{os.getpid()}-{threading.get_ident()}.tmp'
+    try:
+        with Image.open(source) as image:
+            output_format = ASSET_TRANSFORM_FORMATS[params['format']][0] if params['format'] else image.format
+            animated = getattr(image, 'is_animated', False) and output_format in _ANIMATED_FORMATS
+            if animated:
+                # Frames are only re-encoded, resizing them one by one is not worth it
+                frames = image
+            else:
+                # Phone photos are often stored sideways with an orientation tag
+                frames = ImageOps.exif_transpose(image)
+                max_size = (params['max_width'] or frames.width, params['max_height'] or frames.height)
+                if frames.width > max_size[0] or frames.height > max_size[1]:
+                    frames.thumbnail(max_size, Image.LANCZOS)
+                if output_format == 'JPEG' and frames.mode not in ('RGB', 'L'):
+                    frames = frames.convert('RGB')
+            save_options = {'save_all': True} if animated else {}
+            if params['quality'] is not None:
+                save_options['quality'] = params['quality']
+            frames.save(tmp_destination, format=output_format, **save_options)
+        os.replace(tmp_destination, destination)
+    except BaseException:
+        if os.path.lexists(tmp_destination):
+            os.remove(tmp_destination)
+        raise
+    return os.path.getsize(destination)
+
+
+class AssetTransforms(object):
+    """
+    Resizes and re-encodes assets by extension. A variant is named after the digest of its
+    source and the transform parameters, and kept in the variant cache directory, so that
+    each variant is only produced once across runs and targets. Links can be pointed at the
+    variant before it exists, since its name does not depend on its content. Variants are
+    encoded in a process pool of up to jobs processes, in the calling thread with a single job.
+    The pool is started by start, from the main thread, before any variant is asked for.
+    """
+
+    def __init__(self, config, cache_path, jobs=1):
+        self.cache_path = cache_path
+        self.jobs = jobs
+        available_formats = _available_formats()
+        if available_formats is None:
+            raise ValueError('asset_transforms requires Pillow, install it with "pip install Pillow".')
+        self.params = {}
+        for extension, params in parse_asset_transforms(config).items():
+            output_format = params['format']
+            if output_format and ASSET_TRANSFORM_FORMATS[output_format][0] not in available_formats:
+                print(f'Warning: No {output_format} encoder is available, {extension} assets keep their format.',
+                      file=sys.stderr)
+                params = dict(params, format=None)
+            self.params[extension] = params
+        # Names of the variants used during this run
+        self.used = set()
+        self.encoded_sizes = []
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._executor = None
+
+    def __getstate__(self):
+        # Render workers only name variants
+        return dict(self.__dict__, used=set(), encoded_sizes=[], _lock=None, _pending={}, _executor=None)
+
+    def applies_to(self, extension):
+        return extension.lower() in self.params
+
+    def output_name(self, digest, extension):
+        """The filename an asset with the given digest and extension is exported under."""
+        params = self.params.get(extension.lower())
+        if params is None:
+            return digest + extension
+        key = sha256(f'{digest}\n{json.dumps(params, sort_keys=True)}'.encode('utf-8')).hexdigest()
+        output_format = params['format']
+        return key + (ASSET_TRANSFORM_FORMATS[output_format][1] if output_format else extension)
+
+    def variant_path(self, source, output_name):
+        """
+        The path of a variant in the cache, which is produced from source first unless it is
+        already there. Safe to call from several threads, each variant is only encoded once.
+        """
+        path = os.path.join(self.cache_path, output_name)
+        with self._lock:
+            self.used.add(output_name)
+            future = self._pending.get(output_name)
+            submitted = future is None and not os.path.exists(path)
+            if submitted:
+                future = self._pending[output_name] = self._submit(source, path)
+        if future is None:
+            return path
+        if submitted and self.jobs <= 1:
+            try:
+                future.set_result(_encode_variant(source, path, self.params[os.path.splitext(source)[1].lower()]))
+            except Exception as e:
+                future.set_exception(e)
+        try:
+            size = future.result()
+        except Exception as e:
+            with self._lock:
+                # Retried the next time the variant is needed
+                self._pending.pop(output_name, None)
+            raise ValueError(f'Failed to transform {source}: {e}') from e
+        if submitted:
+            self.encoded_sizes.append(size)
+        return path
+
+    def _submit(self, source, path):
+        os.makedirs(self.cache_path, exist_ok=True)
+        if self.jobs <= 1:
+            # Encoded by the thread which asked for the variant first
+            return Future()
+        if self._executor is None:
+            raise ValueError('Asset variants were requested before the encoding processes were started.')
+        return self._executor.submit(_encode_variant, source, path, self.params[os.path.splitext(source)[1].lower()])
+
+    def start(self):
+        """Starts the encoding processes, unless variants are encoded in the calling thread."""
+        if self.jobs > 1 and self._executor is None:
+            # Workers are only launched once variants are submitted, from the asset copying threads,
+            # and forking a process which is running threads can deadlock the child
+            self._executor = ProcessPoolExecutor(max_workers=self.jobs,
+                                                 mp_context=multiprocessing.get_context('spawn'))
+
+    def close(self):
+        """Stops the encoding processes, which are started again by start."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def prune(self):
+        """Deletes the cached variants which were not used during this run. Returns how many were deleted."""
+        try:
+            names = os.listdir(self.cache_path)
+        except OSError:
+            return 0
+        pruned = 0
+        for name in names:
+            if name not in self.used:
+                os.remove(os.path.join(self.cache_path, name))
+                pruned += 1
+        return pruned
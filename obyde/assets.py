@@ -0,0 +1,231 @@
+import json
+import os
+import re
+import shutil
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+from .stats import NULL_STATS
+
+ASSET_CACHE_FILENAME = 'assets.json'
+ASSET_COPY_MODES = ['copy', 'hardlink', 'reflink']
+ASSET_EXPORT_MODES = ['all', 'referenced']
+CHUNK_SIZE = 1024 * 1024
+
+# Matches the content addressed filenames that obyde writes to the asset output directory
+_HASHED_FILENAME = re.compile(r'[0-9a-f]{64}(\.[^.]*)?')
+
+# ioctl request to clone a file's extents, supported by btrfs, xfs and others on Linux
+_FICLONE = 0x40049409
+
+
+def hash_file(path):
+    digest = sha256()
+    buffer = bytearray(CHUNK_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb', buffering=0) as fs:
+        while True:
+            read = fs.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+class AssetDigestCache(object):
+    """
+    Persists the digest of every asset keyed by its path, size and modification time, so that
+    unchanged assets are not read again on subsequent runs. Only entries used during a run are
+    kept when it is saved.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}
+        self.used = {}
+        # Sizes of the assets that had to be hashed, appended to from several threads
+        self.hashed_sizes = []
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as fs:
+                entries = json.load(fs)
+        except (OSError, ValueError):
+            return cls()
+        return cls(entries if isinstance(entries, dict) else {})
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fs:
+            fs.write(json.dumps(self.used, separators=(',', ':')))
+        os.replace(tmp_path, path)
+
+    def digest(self, path, stat=None):
+        stat = stat or os.stat(path)
+        key = [stat.st_size, stat.st_mtime_ns]
+        # Assets exported to several targets are only hashed once per run
+        entry = self.used.get(path)
+        if not (entry and entry[:2] == key):
+            entry = self.entries.get(path)
+        if entry and entry[:2] == key:
+            digest = entry[2]
+        else:
+            digest = hash_file(path)
+            self.hashed_sizes.append(stat.st_size)
+        self.used[path] = key + [digest]
+        return digest
+
+
+def _clone_file(src, dst):
+    import fcntl
+    with open(src, 'rb') as in_fs, open(dst, 'wb') as out_fs:
+        fcntl.ioctl(out_fs.fileno(), _FICLONE, in_fs.fileno())
+
+
+def _copy_file_range(src, dst):
+    with open(src, 'rb') as in_fs, open(dst, 'wb') as out_fs:
+        remaining = os.fstat(in_fs.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(
+                in_fs.fileno(), out_fs.fileno(), min(remaining, 1 << 30))
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def copy_asset(src, dst, copy_mode='copy'):
+    """
+    Copies an asset to its output location. The copy goes to a temporary file first so that an
+    interrupted run never leaves a partial file behind under a content addressed name.
+    """
+    tmp_dst = os.path.join(os.path.dirname(dst),
+                           f'.{os.path.basename(dst)}.{os.getpid()}-{threading.get_ident()}.tmp')
+    try:
+        if copy_mode == 'hardlink':
+            try:
+                os.link(src, tmp_dst)
+            except OSError:
+                # e.g. the output is on a different filesystem
+                shutil.copyfile(src, tmp_dst)
+        elif copy_mode == 'reflink':
+            try:
+                _clone_file(src, tmp_dst)
+            except (ImportError, OSError):
+                try:
+                    _copy_file_range(src, tmp_dst)
+                except (AttributeError, OSError):
+                    shutil.copyfile(src, tmp_dst)
+        else:
+            # Uses the kernel's zero-copy primitives where available
+            shutil.copyfile(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    except BaseException:
+        if os.path.lexists(tmp_dst):
+            os.remove(tmp_dst)
+        raise
+
+
+def write_asset_files(asset_files, asset_output_path, digest_cache=None, copy_mode='copy', max_workers=None,
+                      stats=NULL_STATS, stat=os.stat, transforms=None):
+    """
+    Exports every asset under a content addressed filename, unless it is already there. Assets
+    which transforms applies to are exported as their variant, which is produced first if it is
+    not in the variant cache yet.
+    """
+    if copy_mode not in ASSET_COPY_MODES:
+        raise ValueError(
+            f'Unknown asset copy mode "{copy_mode}". must be set to one of {", ".join(ASSET_COPY_MODES)}.')
+    digest_cache = digest_cache if digest_cache is not None else AssetDigestCache()
+
+    def write_asset(name, path):
+        extension = os.path.splitext(path)[1]
+        digest = digest_cache.digest(path, stat(path))
+        transformed = transforms is not None and transforms.applies_to(extension)
+        hashed_fname = transforms.output_name(digest, extension) if transformed else digest + extension
+        asset_path = os.path.join(asset_output_path, hashed_fname)
+        copied_bytes = None
+        if not os.path.exists(asset_path):
+            source = transforms.variant_path(path, hashed_fname) if transformed else path
+            copy_asset(source, asset_path, copy_mode)
+            copied_bytes = os.path.getsize(asset_path)
+        elif transformed:
+            transforms.used.add(hashed_fname)
+        return name, (path, hashed_fname), copied_bytes
+
+    # Hashing and copying is I/O bound, so threads are enough to overlap it, variants are
+    # encoded in the transforms' own process pool
+    if transforms is not None:
+        transforms.start()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(write_asset, name, path)
+                       for name, path in asset_files.items()]
+            copied_asset_files = {}
+            for future in futures:
+                name, entry, copied_bytes = future.result()
+                copied_asset_files[name] = entry
+                if copied_bytes is not None:
+                    stats.count('assets_copied')
+                    stats.count('bytes_written', copied_bytes)
+            return copied_asset_files
+    finally:
+        if transforms is not None:
+            transforms.close()
+
+
+class ReferencedAssetIndex(Mapping):
+    """
+    Maps asset names to their path and hashed filename like the index returned by
+    write_asset_files, but only hashes an asset once a link resolves to it. The names
+    of all assets looked up this way are collected in referenced. Transformed assets are named
+    after their variant, which is only produced once they are exported.
+    """
+
+    def __init__(self, asset_files, digest_cache, stat=os.stat, transforms=None):
+        self.asset_files = asset_files
+        self.digest_cache = digest_cache
+        self.stat = stat
+        self.transforms = transforms
+        self.referenced = {}
+
+    def __getitem__(self, name):
+        try:
+            return self.referenced[name]
+        except KeyError:
+            pass
+        path = self.asset_files[name]
+        digest = self.digest_cache.digest(path, self.stat(path))
+        extension = os.path.splitext(path)[1]
+        hashed_fname = digest + extension if self.transforms is None else self.transforms.output_name(digest, extension)
+        entry = self.referenced[name] = (path, hashed_fname)
+        return entry
+
+    def __contains__(self, name):
+        return name in self.asset_files
+
+    def __iter__(self):
+        return iter(self.asset_files)
+
+    def __len__(self):
+        return len(self.asset_files)
+
+
+def collect_garbage_assets(asset_output_path, keep):
+    """
+    Deletes content addressed files in the asset output directory that are not in keep.
+    Returns the number of files and bytes that were deleted.
+    """
+    deleted_count = 0
+    deleted_bytes = 0
+    with os.scandir(asset_output_path) as entries:
+        for entry in entries:
+            if entry.name in keep or not _HASHED_FILENAME.fullmatch(entry.name) \
+                    or not entry.is_file(follow_symlinks=False):
+                continue
+            deleted_bytes += entry.stat(follow_symlinks=False).st_size
+            os.remove(entry.path)
+            deleted_count += 1
+    return deleted_count, deleted_bytes
@@ -0,0 +1,173 @@
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+BLOCK_CACHE_FILENAME = 'blocks.sqlite'
+DEFAULT_BLOCK_CACHE_SIZE_MB = 64
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS blocks (
+    digest BLOB NOT NULL,
+    kind TEXT NOT NULL,
+    pipeline BLOB NOT NULL,
+    output TEXT,
+    size INTEGER NOT NULL,
+    last_used INTEGER NOT NULL,
+    PRIMARY KEY (digest, kind, pipeline)
+) WITHOUT ROWID
+'''
+
+
+def _pipeline_key(fingerprint):
+    return sha256(fingerprint.encode('utf-8')).digest()
+
+
+class BlockCache(object):
+    """
+    Remembers what a transformer pipeline made of a block, keyed by the digest of the block
+    text, the kind of block and the pipeline fingerprint, in a SQLite file which persists across
+    runs. Lookups only ever read the file. Blocks looked up are also kept in memory, up to
+    max_bytes of the least recently used ones, serving later lookups without the file. Blocks
+    transformed during a run are only written by save, which then evicts the least recently
+    used blocks beyond max_bytes from the file. The cache can be handed to render worker
+    processes, each of which reopens the file, and their updates are merged back with merge.
+    """
+
+    def __init__(self, path, max_bytes=DEFAULT_BLOCK_CACHE_SIZE_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection = None
+        # Key to (output, size) of the blocks most recently looked up in this process, oldest first
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # Key to (output, size) of the blocks missing from the file
+        self.added = {}
+        # Keys of the blocks found in the file
+        self.touched = set()
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Connections cannot be pickled, workers open their own and report only their own updates
+        return dict(self.__dict__, _connection=None, _memory=OrderedDict(), _memory_bytes=0, added={},
+                    touched=set(), hits=0, misses=0)
+
+    def _lookup(self, key):
+        if self._connection is None:
+            if not os.path.exists(self.path):
+                return False, None
+            try:
+                self._connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            except sqlite3.Error:
+                return False, None
+        try:
+            row = self._connection.execute(
+                'SELECT output FROM blocks WHERE digest = ? AND kind = ? AND pipeline = ?', key).fetchone()
+        except sqlite3.Error:
+            # A cache that cannot be read is no different from an empty one
+            return False, None
+        if row is None:
+            return False, None
+        self.touched.add(key)
+        return True, row[0]
+
+    def cached(self, transform, kind, fingerprint):
+        """Wraps a block transform so that its output is looked up in and added to the cache."""
+        pipeline = _pipeline_key(fingerprint)
+        memory = self._memory
+
+        def cached_transform(block):
+            key = (sha256(block.encode('utf-8')).digest(), kind, pipeline)
+            try:
+                output, _ = memory[key]
+            except KeyError:
+                found, output = self._lookup(key)
+                if not found:
+                    self.misses += 1
+                    output = transform(block)
+                size = len(block) + (len(output) if output is not None else 0)
+                self._remember(key, output, size)
+                if not found:
+                    self.added[key] = (output, size)
+                    return output
+            else:
+                memory.move_to_end(key)
+                # Kept from an earlier build in watch mode, and just as recently used in the file
+                self.touched.add(key)
+            self.hits += 1
+            return output
+
+        return cached_transform
+
+    def _remember(self, key, output, size):
+        memory = self._memory
+        memory[key] = (output, size)
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_bytes:
+            _, (_, evicted_size) = memory.popitem(last=False)
+            self._memory_bytes -= evicted_size
+
+    def take_updates(self):
+        """Returns and forgets the blocks added and touched and the hits and misses since the last call."""
+        updates = (self.added, self.touched, self.hits, self.misses)
+        self.added = {}
+        self.touched = set()
+        self.hits = 0
+        self.misses = 0
+        return updates
+
+    def merge(self, updates):
+        added, touched, hits, misses = updates
+        self.added.update(added)
+        self.touched |= touched
+        self.hits += hits
+        self.misses += misses
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def save(self):
+        """Writes the added blocks, marks the touched ones as used and evicts the least recently used."""
+        self.close()
+        if not (self.added or self.touched):
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            self._save()
+        except sqlite3.DatabaseError:
+            # Start over rather than fail the build over a corrupted cache
+            os.remove(self.path)
+            self._save()
+        self.added = {}
+        self.touched = set()
+
+    def _save(self):
+        now = time.time_ns()
+        connection = sqlite3.connect(self.path)
+        try:
+            with connection:
+                connection.execute(_SCHEMA)
+                connection.executemany(
+                    'INSERT OR REPLACE INTO blocks VALUES (?, ?, ?, ?, ?, ?)',
+                    [key + (output, size, now) for key, (output, size) in self.added.items()])
+                connection.executemany(
+                    'UPDATE blocks SET last_used = ? WHERE digest = ? AND kind = ? AND pipeline = ?',
+                    [(now,) + key for key in self.touched])
+                total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM blocks').fetchone()[0]
+                excess = total - self.max_bytes
+                if excess > 0:
+                    evicted = []
+                    for row in connection.execute(
+                            'SELECT digest, kind, pipeline, size FROM blocks ORDER BY last_used'):
+                        evicted.append(row[:3])
+                        excess -= row[3]
+                        if excess <= 0:
+                            break
+                    connection.executemany(
+                        'DELETE FROM blocks WHERE digest = ? AND kind = ? AND pipeline = ?', evicted)
+        finally:
+            connection.close()
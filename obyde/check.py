@@ -0,0 +1,118 @@
+import os
+import string
+from concurrent.futures import ProcessPoolExecutor
+
+from .anchors import note_anchors
+from .discovery import scan_vault
+from .document import NoteDocument
+from .linking import POST_LINK_MODES, LinkResolver, split_link
+from .manifest import cache_dir_path
+from .parsing import lex_content
+from .targets import output_configs
+from .util import slugify_md_filename
+
+
+def validate_postdate(path, postdate):
+    if not postdate:
+        raise ValueError(
+            f'Post at {path} does not have a date, please add a date to the frontmatter.')
+
+    components = tuple(postdate.split('-'))
+    try:
+        assert len(components) == 3
+        year, month, day = components
+        for comp in [year, month, day]:
+            assert all(map(lambda x: x in string.digits, comp))
+    except AssertionError:
+        raise ValueError(
+            'Invalid frontmatter date format! Expected format is YYYY-MM-DD')
+    return postdate
+
+
+def check_note(path):
+    """
+    Checks a single note without rendering it. Returns its date, if valid, the problems found,
+    the targets of its links and its anchors.
+    """
+    try:
+        with open(path, 'rb') as fs:
+            document = NoteDocument.loads(fs.read())
+    except Exception as e:
+        return None, [f'Failed to read note: {e}'], [], None
+
+    problems = []
+    postdate = None
+    try:
+        postdate = validate_postdate(path, str(document.metadata.get('date', '')))
+    except ValueError as e:
+        problems.append(str(e))
+    lexed = lex_content(document.content)
+    for error in (lexed.block_error, lexed.link_error):
+        if error:
+            problems.append(error)
+    link_targets = [split_link(document.content[link.start:link.end])[0] for link in lexed.links]
+    return postdate, problems, link_targets, note_anchors(document.content)
+
+
+def check_vault(config, jobs=1):
+    """
+    Validates a vault without writing anything: filename collisions, frontmatter dates,
+    unterminated preformatted blocks, links which do not resolve to a note or an asset and links
+    to headings or blocks which do not exist.
+    Returns every problem found as a sorted list of (path, message) pairs.
+    """
+    problems = []
+    outputs = output_configs(config)
+    for output in outputs:
+        for key, description in (('post_output_path', 'post output path'), ('asset_output_path', 'asset output path')):
+            path = output[key]
+            if not os.path.isdir(path):
+                problems.append((path, f'{description} does not exist or is not a directory'))
+        post_link_mode = output.get('post_link_mode', 'jekyll')
+        if post_link_mode not in POST_LINK_MODES:
+            problems.append(('', f'Unknown post link mode "{post_link_mode}". must be set to either "jekyll" or "hugo".'))
+
+    scan = scan_vault(config['vault']['path'], config['vault']['asset_path'],
+                      exclusions=config['vault'].get('excluded_subdirectories', []),
+                      raise_collisions=False, ignored_dirs=[cache_dir_path(config)])
+    problems.extend(('', collision) for collision in scan.collisions)
+
+    paths = list(scan.notes.values())
+    if jobs <= 1 or len(paths) <= 1:
+        results = [check_note(path) for path in paths]
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(check_note, paths, chunksize=max(1, len(paths) // (jobs * 4))))
+
+    dated_files = {}
+    anchor_index = {}
+    note_links = []
+    for path, (postdate, note_problems, link_targets, anchors) in zip(paths, results):
+        problems.extend((path, problem) for problem in note_problems)
+        slug_name = slugify_md_filename(os.path.splitext(os.path.basename(path))[0])
+        # Notes without a valid date can still be linked to, they just fail the check
+        dated_files[slug_name] = (f'{postdate}-{slug_name}', None, path)
+        if anchors is not None:
+            anchor_index[slug_name] = anchors
+        note_links.append((path, slug_name, link_targets))
+
+    # Only whether a link resolves matters, which is the same for every target, so assets are
+    # not hashed and links are formatted for Jekyll
+    asset_index = {name: (path, name) for name, path in scan.assets.items()}
+    resolver = LinkResolver(dated_files, asset_index, '', 'jekyll',
+                            mode=(config.get('build') or {}).get('link_resolution', 'indexed'),
+                            asset_paths=scan.assets, anchor_index=anchor_index)
+    for path, slug_name, link_targets in note_links:
+        for link_target in dict.fromkeys(link_targets):
+            resolution = resolver.resolve(link_target, slug_name)
+            if resolution is None:
+                problems.append((path, f'Link [[{link_target}]] does not resolve to a note or an asset.'))
+            elif resolution.missing_fragment is not None:
+                problems.append((path, f'Link [[{link_target}]] points to a heading or block '
+                                       f'which does not exist in {resolution.name}.'))
+    return sorted(problems)
+
+
+def check_problems_message(problems):
+    lines = '\n'.join(f'  {path}: {problem}' if path else f'  {problem}' for path, problem in problems)
+    return f'Found {len(problems)} problem(s):\n{lines}'
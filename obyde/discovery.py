@@ -0,0 +1,155 @@
+import os
+from collections import defaultdict
+from fnmatch import fnmatchcase
+
+
+def dir_exists_or_raise(dirpath, dirpath_type):
+    if not os.path.exists(dirpath) or not os.path.isdir(dirpath):
+        raise ValueError(
+            f'{dirpath} - {dirpath_type} does not exist or is not a directory')
+    return dirpath
+
+
+def _is_within(path, directory):
+    return path == directory or path.startswith(directory.rstrip(os.sep) + os.sep)
+
+
+def _normalise_exclusions(exclusions):
+    return [exclusion.replace(os.sep, '/').strip('/') for exclusion in exclusions or ()]
+
+
+def _walk(root, exclusions, asset_path=None, notes_allowed=True, directories=None, ignored_dirs=()):
+    """
+    Yields (entry, is_note_candidate, is_asset) for every file below root. Directories matching
+    one of the exclusion globs are pruned before they are read, unless the asset directory is
+    below them, in which case only the asset directory is looked at. Directories in
+    ignored_dirs, given as absolute paths, are always pruned. Every directory read is appended
+    to directories, if given.
+    """
+    # (directory path, path relative to root, whether files in it can be notes)
+    stack = [(root, '', notes_allowed)]
+    while stack:
+        dirpath, rel_dirpath, notes_allowed = stack.pop()
+        in_assets = asset_path is not None and _is_within(dirpath, asset_path)
+        try:
+            entries = list(os.scandir(dirpath))
+        except OSError:
+            # Unreadable directories are skipped, like os.walk does
+            continue
+        if directories is not None:
+            directories.append(dirpath)
+        for entry in entries:
+            # Like os.walk, symlinked directories are not followed
+            if entry.is_dir():
+                if entry.is_symlink() or entry.path in ignored_dirs:
+                    continue
+                rel_path = f'{rel_dirpath}/{entry.name}' if rel_dirpath else entry.name
+                child_notes_allowed = notes_allowed and not any(
+                    fnmatchcase(rel_path, exclusion) for exclusion in exclusions)
+                if child_notes_allowed or in_assets or (
+                        asset_path is not None and _is_within(asset_path, entry.path)):
+                    stack.append((entry.path, rel_path, child_notes_allowed))
+            else:
+                yield entry, notes_allowed, in_assets
+
+
+def _collision_messages(index):
+    return sorted(
+        f'Filename collision detected for {",".join(sorted(paths))}. This is currently not a supported operating mode.'
+        for paths in index.values() if len(paths) > 1)
+
+
+def _index_or_raise(index):
+    collisions = _collision_messages(index)
+    if collisions:
+        raise ValueError('\n'.join(collisions))
+    return {name: paths[0] for name, paths in index.items()}
+
+
+class _StatEntry(object):
+    """Stands in for a DirEntry whose file was stat'ed again."""
+
+    def __init__(self, stat):
+        self._stat = stat
+
+    def stat(self):
+        return self._stat
+
+
+class VaultScan(object):
+    """
+    The notes and assets found in a single walk of the vault, keyed by filename. The directory
+    entries are kept so that their stat results can be reused, e.g. for the asset digest cache.
+    """
+
+    def __init__(self, notes, assets, entries, collisions=None, directories=None):
+        self.notes = notes
+        self.assets = assets
+        self.entries = entries
+        # Only set when collisions are collected rather than raised
+        self.collisions = collisions or []
+        # Every directory that was read during the scan
+        self.directories = directories or []
+
+    def stat(self, path):
+        entry = self.entries.get(path)
+        # DirEntry caches its stat result after the first call
+        return entry.stat() if entry is not None else os.stat(path)
+
+    def refresh(self, path):
+        """Updates the cached stat result of a file which was modified since the scan."""
+        self.entries[path] = _StatEntry(os.stat(path))
+
+    def __getstate__(self):
+        # Directory entries cannot be pickled, render workers stat files again instead
+        state = dict(self.__dict__)
+        state['entries'] = {}
+        return state
+
+
+def scan_vault(vault_path, asset_path, exclusions=(), note_ext='.md', raise_collisions=True, ignored_dirs=()):
+    """
+    Finds notes and assets in one traversal when the asset directory is inside the vault.
+    Exclusions are glob patterns matched against directory paths relative to the vault, using
+    forward slashes. Excluded directories are not descended into, and neither are ignored_dirs,
+    e.g. the cache directory, whatever the asset directory is. Unless raise_collisions is set,
+    colliding filenames are reported in the scan's collisions and the first path is kept.
+    """
+    vault_path = dir_exists_or_raise(os.path.abspath(vault_path), 'input files location')
+    asset_path = dir_exists_or_raise(os.path.abspath(asset_path), 'input files location')
+    exclusions = _normalise_exclusions(exclusions)
+    ignored_dirs = frozenset(os.path.abspath(path) for path in ignored_dirs)
+    notes = defaultdict(list)
+    assets = defaultdict(list)
+    entries = {}
+    directories = []
+
+    def collect(walk):
+        for entry, is_note_candidate, is_asset in walk:
+            if is_note_candidate and entry.name.endswith(note_ext):
+                notes[entry.name].append(entry.path)
+                entries[entry.path] = entry
+            if is_asset:
+                assets[entry.name].append(entry.path)
+                entries[entry.path] = entry
+
+    assets_in_vault = _is_within(asset_path, vault_path)
+    collect(_walk(vault_path, exclusions, asset_path if assets_in_vault else None, directories=directories,
+                  ignored_dirs=ignored_dirs))
+    if not assets_in_vault:
+        collect(_walk(asset_path, [], asset_path, notes_allowed=False, directories=directories,
+                      ignored_dirs=ignored_dirs))
+    if raise_collisions:
+        return VaultScan(_index_or_raise(notes), _index_or_raise(assets), entries, directories=directories)
+    return VaultScan({name: sorted(paths)[0] for name, paths in notes.items()},
+                     {name: sorted(paths)[0] for name, paths in assets.items()},
+                     entries, _collision_messages(notes) + _collision_messages(assets), directories)
+
+
+def find_files(dirpath, ext='', exclusions=[]):
+    dirpath = dir_exists_or_raise(os.path.abspath(dirpath), 'input files location')
+    index = defaultdict(list)
+    for entry, is_candidate, _ in _walk(dirpath, _normalise_exclusions(exclusions)):
+        if is_candidate and entry.name.endswith(ext):
+            index[entry.name].append(entry.path)
+    return _index_or_raise(index)
@@ -0,0 +1,139 @@
+from hashlib import sha256
+from itertools import chain
+
+import frontmatter
+from frontmatter.default_handlers import DEFAULT_POST_TEMPLATE, YAMLHandler
+from frontmatter.util import u
+
+
+class NoteDocument(object):
+    """
+    A note split into its parsed frontmatter metadata and its body. The metadata is parsed once
+    when the note is loaded and its text is emitted once, no matter how often the frontmatter
+    section is read afterwards. Output is identical to round tripping the note through
+    frontmatter.dumps and frontmatter.loads.
+    """
+
+    def __init__(self, metadata, content, handler=None):
+        self.metadata = metadata
+        self.content = content
+        # Notes without frontmatter are written out with YAML frontmatter
+        self.handler = handler or YAMLHandler()
+        self._metadata_text = None
+
+    @classmethod
+    def loads(cls, text):
+        text = u(text)
+        handler = frontmatter.detect_format(text, frontmatter.handlers)
+        metadata, content = frontmatter.parse(text, handler=handler)
+        return cls(metadata, content, handler)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as fs:
+            return cls.loads(fs.read())
+
+    def metadata_text(self):
+        if self._metadata_text is None:
+            self._metadata_text = self.handler.export(self.metadata)
+        return self._metadata_text
+
+    def metadata_section(self):
+        """The delimited frontmatter section, as it would be output for a note with no content."""
+        return self._format('')
+
+    def dumps(self):
+        return self._format(self.content)
+
+    def dump_iter(self, content_chunks):
+        """
+        Yields the post in pieces, as dumps would output it with the concatenation of
+        content_chunks as the stripped content, without ever joining the content.
+        """
+        head, _, tail = DEFAULT_POST_TEMPLATE.partition('{content}')
+        head = head.format(
+            metadata=self.metadata_text(),
+            start_delimiter=self.handler.START_DELIMITER,
+            end_delimiter=self.handler.END_DELIMITER,
+        )
+        return strip_chunks(chain((head,), strip_chunks(content_chunks), (tail.format(),)))
+
+    def _format(self, content):
+        return DEFAULT_POST_TEMPLATE.format(
+            metadata=self.metadata_text(),
+            content=content,
+            start_delimiter=self.handler.START_DELIMITER,
+            end_delimiter=self.handler.END_DELIMITER,
+        ).strip()
+
+
+def strip_chunks(chunks):
+    """Yields chunks with the leading and trailing whitespace of their concatenation removed."""
+    started = False
+    # Whitespace which is only output if more text follows it
+    pending = ''
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        stripped = chunk.rstrip()
+        if not stripped:
+            pending += chunk
+            continue
+        if pending:
+            yield pending
+        yield stripped
+        pending = chunk[len(stripped):]
+
+
+def read_note_index(path):
+    """
+    Reads a note for indexing, parsing only its frontmatter. Returns the metadata, as
+    NoteDocument.load would parse it, the sha256 hex digest of the whole file and the body of
+    the note, i.e. everything after its frontmatter.
+    """
+    digest = sha256()
+    with open(path, 'rb') as fs:
+        metadata, consumed = _read_header(fs, digest)
+        rest = fs.read()
+    digest.update(rest)
+    return metadata, digest.hexdigest(), u(consumed + rest)
+
+
+def _read_header(fs, digest):
+    """
+    Reads lines up to the end of the frontmatter, adding them to digest. Returns the metadata and
+    the lines read which are not part of the frontmatter.
+    """
+    lines = []
+    raw_lines = []
+    handler = None
+    closed = False
+    for line in fs:
+        digest.update(line)
+        raw_lines.append(line)
+        text = u(line)
+        if handler is None:
+            # Like frontmatter.parse, leading whitespace is ignored when detecting the format
+            if not text.strip():
+                continue
+            text = text.lstrip()
+            handler = frontmatter.detect_format(text, frontmatter.handlers)
+            if handler is None:
+                break
+        elif handler.FM_BOUNDARY.match(text):
+            lines.append(text)
+            closed = True
+            break
+        lines.append(text)
+
+    metadata = {}
+    if closed:
+        fm, _ = handler.split(''.join(lines))
+        fm = handler.load(fm)
+        if isinstance(fm, dict):
+            metadata = fm
+        return metadata, b''
+    return metadata, b''.join(raw_lines)
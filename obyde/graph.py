@@ -0,0 +1,52 @@
+import json
+import os
+
+from .rendering import write_if_changed
+
+
+def link_graph(manifest, dated_file_index, asset_index):
+    """
+    Builds the link graph of a target from the links recorded in its manifest, in one pass over
+    them. Notes are keyed by slug, which is also the slug Jekyll gives their posts, and assets
+    by their exported filename. Links from a note to itself are left out.
+    """
+    links = {}
+    backlinks = {}
+    assets = {}
+    unresolved = {}
+    for slug_name, record in manifest.notes.items():
+        note_links = set()
+        note_assets = set()
+        note_unresolved = set()
+        for link_target, resolution in record['links'].items():
+            if resolution is None:
+                note_unresolved.add(link_target)
+            elif resolution[0] == 'asset':
+                note_assets.add(asset_index[resolution[1]][1])
+            elif resolution[1] != slug_name:
+                note_links.add(resolution[1])
+        for target_slug in note_links:
+            backlinks.setdefault(target_slug, []).append(slug_name)
+        if note_links:
+            links[slug_name] = sorted(note_links)
+        if note_assets:
+            assets[slug_name] = sorted(note_assets)
+        if note_unresolved:
+            unresolved[slug_name] = sorted(note_unresolved)
+    return {
+        # Hugo knows posts by their filename, which includes the date
+        'posts': {slug_name: dated_file_index[slug_name][0] for slug_name in manifest.notes},
+        'links': links,
+        'backlinks': {slug_name: sorted(sources) for slug_name, sources in backlinks.items()},
+        'assets': assets,
+        'unresolved': unresolved,
+    }
+
+
+def write_link_graph(path, graph):
+    """Writes the link graph as JSON, unless the file already holds the same graph. Returns whether it was written."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    data = json.dumps(graph, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+    return write_if_changed(path, data.encode('utf-8'))
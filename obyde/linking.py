@@ -0,0 +1,236 @@
+import os
+from typing import NamedTuple, Optional
+
+from .anchors import heading_anchors, normalise_heading
+from .parsing import lex_content
+from .stats import NULL_STATS
+from .util import slugify_md_filename
+
+LINK_RESOLUTION_MODES = ['indexed', 'substring']
+POST_LINK_MODES = ['jekyll', 'hugo']
+
+
+class Resolution(NamedTuple):
+    # Either 'asset' or 'note'
+    kind: str
+    # The asset filename or the note slug that the link resolved to
+    name: str
+    url: str
+    # The #heading or #^block part of a link which does not exist in the note, the url then
+    # points to the note itself
+    missing_fragment: Optional[str] = None
+
+
+def generate_post_link(dated_name, post_link_mode, anchor=None):
+    fragment = f'#{anchor}' if anchor else ''
+    if post_link_mode == 'jekyll':
+        return f'{{% post_url {dated_name} %}}{fragment}'
+    elif post_link_mode == 'hugo':
+        return f'{{{{< relref "{dated_name}{fragment}" >}}}}'
+    else:
+        raise ValueError(f'Unknown post link mode: {post_link_mode}')
+
+
+class LinkResolver(object):
+    """
+    Resolves obsidian link targets to asset or post URLs. Built once per run from the dated
+    file index and the copied asset index, with every lookup memoised.
+
+    The default 'indexed' mode looks link targets up by exact asset filename, by asset path
+    suffix, by note slug and finally by asset filename without its extension. The 'substring'
+    mode keeps the original behaviour of picking the first asset whose filename or path
+    contains the link target.
+
+    Links to a #heading or a #^block of a note are resolved against the anchor index, which maps
+    note slugs to their NoteAnchors. The ids the site generator gives the headings of a note are
+    only worked out once a link points into it.
+    """
+
+    def __init__(self, dated_file_index, asset_index, relative_asset_path_prefix, post_link_mode, mode='indexed',
+                 asset_paths=None, anchor_index=None):
+        if mode not in LINK_RESOLUTION_MODES:
+            raise ValueError(
+                f'Unknown link resolution mode "{mode}". must be set to either "indexed" or "substring".')
+        self.dated_file_index = dated_file_index
+        self.asset_index = asset_index
+        # Asset source paths are used for matching, so that lazily hashed asset indexes
+        # only get hashed once a link actually resolves to an asset
+        self.asset_paths = asset_paths if asset_paths is not None else {
+            filename: filepaths[0] for filename, filepaths in asset_index.items()}
+        self.relative_asset_path_prefix = relative_asset_path_prefix
+        self.post_link_mode = post_link_mode
+        self.mode = mode
+        self.anchor_index = anchor_index if anchor_index is not None else {}
+        self.asset_stems = {}
+        for filename in sorted(self.asset_paths):
+            self.asset_stems.setdefault(
+                os.path.splitext(filename)[0], filename)
+        self._slugs = {}
+        self._resolutions = {}
+        # Note slug to (normalised heading to id, set of block ids)
+        self._anchors = {}
+
+    def slug(self, name):
+        slug_name = self._slugs.get(name)
+        if slug_name is None:
+            slug_name = self._slugs[name] = slugify_md_filename(name)
+        return slug_name
+
+    def resolve(self, link_target, source=None):
+        """
+        Resolves a link target, which may point to a heading or block of a note. Links to a
+        heading or block of the same note, like [[#heading]], are resolved against the note
+        with the source slug.
+        """
+        key = (source, link_target) if link_target.lstrip().startswith(('#', '^')) else link_target
+        try:
+            return self._resolutions[key]
+        except KeyError:
+            pass
+        name, fragment = split_fragment(link_target)
+        if fragment is None:
+            resolution = self._resolve_name(link_target)
+        elif not name:
+            resolution = self._resolve_fragment(None, source, fragment) if source in self.dated_file_index else None
+        else:
+            resolution = self._resolve_name(name)
+            if resolution is None:
+                # Filenames may contain the characters links use to point into notes
+                resolution = self._resolve_name(link_target)
+            elif resolution.kind == 'note':
+                resolution = self._resolve_fragment(resolution, resolution.name, fragment)
+            else:
+                # Such as #page=2 for PDFs, which is up to the browser
+                resolution = resolution._replace(url=f'{resolution.url}#{fragment}')
+        self._resolutions[key] = resolution
+        return resolution
+
+    def _resolve_name(self, name):
+        if self.mode == 'substring':
+            return self._resolve_substring(name)
+        return self._resolve_indexed(name)
+
+    def _resolve_fragment(self, resolution, slug_name, fragment):
+        """Resolves a fragment of the note with slug_name, or of the linking note if resolution is None."""
+        anchor = self.anchor(slug_name, fragment)
+        if anchor is None:
+            if resolution is None:
+                return Resolution('note', slug_name, '', fragment)
+            return resolution._replace(missing_fragment=fragment)
+        if resolution is None:
+            return Resolution('note', slug_name, f'#{anchor}')
+        dated_name, _, _ = self.dated_file_index[slug_name]
+        return resolution._replace(url=generate_post_link(dated_name, self.post_link_mode, anchor))
+
+    def anchor(self, slug_name, fragment):
+        """The id of the heading or block a fragment of a note points to, or None if there is none."""
+        anchors = self._anchors.get(slug_name)
+        if anchors is None:
+            note_anchors = self.anchor_index.get(slug_name)
+            if note_anchors is None:
+                anchors = ({}, set())
+            else:
+                anchors = (heading_anchors(note_anchors.headings, self.post_link_mode), set(note_anchors.blocks))
+            self._anchors[slug_name] = anchors
+        headings, blocks = anchors
+        if fragment.startswith('^'):
+            block = fragment[1:]
+            return block if block in blocks else None
+        # Obsidian links to subheadings as #heading#subheading
+        return headings.get(normalise_heading(fragment.rsplit('#', 1)[-1]))
+
+    def asset_resolution(self, filename):
+        _, newpath = self.asset_index[filename]
+        return Resolution('asset', filename, f'{self.relative_asset_path_prefix}/{newpath}')
+
+    def note_resolution(self, slug_name):
+        dated_name, _, _ = self.dated_file_index[slug_name]
+        return Resolution('note', slug_name, generate_post_link(dated_name, self.post_link_mode))
+
+    def _resolve_substring(self, link_target):
+        for filename, oldpath in self.asset_paths.items():
+            if link_target in filename or link_target in oldpath:
+                return self.asset_resolution(filename)
+        slug_name = self.slug(link_target)
+        if slug_name in self.dated_file_index:
+            return self.note_resolution(slug_name)
+        return None
+
+    def _resolve_indexed(self, link_target):
+        if link_target in self.asset_paths:
+            return self.asset_resolution(link_target)
+
+        # Obsidian uses vault relative paths for links whenever filenames alone are ambiguous
+        if '/' in link_target:
+            suffix = '/' + link_target.strip('/')
+            basename = suffix.rsplit('/', 1)[1]
+            if basename in self.asset_paths:
+                if _posix_path(self.asset_paths[basename]).endswith(suffix):
+                    return self.asset_resolution(basename)
+            slug_name = self.slug(basename)
+            if slug_name in self.dated_file_index:
+                _, _, note_path = self.dated_file_index[slug_name]
+                if os.path.splitext(_posix_path(note_path))[0].endswith(suffix):
+                    return self.note_resolution(slug_name)
+
+        slug_name = self.slug(link_target)
+        if slug_name in self.dated_file_index:
+            return self.note_resolution(slug_name)
+
+        filename = self.asset_stems.get(link_target)
+        if filename is not None:
+            return self.asset_resolution(filename)
+        return None
+
+
+def _posix_path(path):
+    return path.replace(os.sep, '/')
+
+
+def split_fragment(link_target):
+    """
+    Splits a link target into the name of the note or asset it links to and the #heading or
+    #^block it points to, which is None if there is none. Block fragments keep their ^, and
+    Obsidian's [[note#^block]] and the shorter [[note^block]] are both understood.
+    """
+    name, separator, fragment = link_target.partition('#')
+    if not separator:
+        name, separator, block = link_target.partition('^')
+        if not separator:
+            return link_target, None
+        fragment = '^' + block
+    fragment = fragment.strip()
+    return name.strip(), fragment if fragment.strip('^') else None
+
+
+def split_link(link):
+    """Splits an obsidian link into its target and its text."""
+    link_text = link.replace('[[', '').replace(']]', '')
+    link_target = link_text
+    if '|' in link_text:
+        split_link = link_text.split('|')
+        link_target = split_link[0]
+        link_text = split_link[1] if len(split_link) > 1 else ''
+    return link_target, link_text
+
+
+def rewrite_links(content, resolver, resolved_links=None, stats=NULL_STATS, final=True, source=None):
+    lexed = lex_content(content, final)
+    if lexed.link_error:
+        raise ValueError(lexed.link_error)
+
+    pieces = []
+    idx = 0
+    for link_span in lexed.links:
+        link_target, link_text = split_link(content[link_span.start:link_span.end])
+        resolution = resolver.resolve(link_target, source)
+        if resolved_links is not None:
+            resolved_links[link_target] = resolution
+        stats.count('links_resolved' if resolution else 'links_unresolved')
+        # Same note links to headings which do not exist have nowhere to point to
+        if resolution and resolution.url:
+            pieces.append(content[idx:link_span.start])
+            pieces.append(f'[{link_text}]({resolution.url})')
+            idx = link_span.end
+    pieces.append(content[idx:])
+    return ''.join(pieces)
@@ -0,0 +1,122 @@
+import json
+import os
+from hashlib import sha256
+
+MANIFEST_VERSION = 5
+MANIFEST_FILENAME = 'manifest.json'
+
+# Build options which only affect how a build runs, not what it outputs.
+# Changing them must not invalidate a previous manifest.
+NON_OUTPUT_BUILD_KEYS = ('cache_dir', 'jobs', 'asset_copy_mode', 'gc_assets', 'prune_posts', 'block_cache',
+                         'block_cache_size_mb', 'search')
+# Likewise for the output target options which do not affect posts
+NON_OUTPUT_TARGET_KEYS = ('link_graph_path', 'search_index_path')
+
+
+def cache_dir_path(config):
+    build_config = config.get('build') or {}
+    return build_config.get('cache_dir') or os.path.join(config['vault']['path'], '.obyde')
+
+
+def build_fingerprint(config, transformer):
+    """Hashes the configuration and transformer pipeline a build was produced with."""
+    fingerprint_config = dict(config)
+    build_config = dict(fingerprint_config.get('build') or {})
+    for key in NON_OUTPUT_BUILD_KEYS:
+        build_config.pop(key, None)
+    fingerprint_config['build'] = build_config
+    output = fingerprint_config.get('output')
+    if isinstance(output, dict):
+        fingerprint_config['output'] = {key: value for key, value in output.items()
+                                        if key not in NON_OUTPUT_TARGET_KEYS}
+    serialized = json.dumps(fingerprint_config, sort_keys=True, default=str)
+    return sha256(f'{serialized}\n{transformer.fingerprint()}'.encode('utf-8')).hexdigest()
+
+
+def _read_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as fs:
+            data = json.load(fs)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != MANIFEST_VERSION:
+        return None
+    return data
+
+
+def note_stat_key(stat):
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class BuildManifest(object):
+    """
+    Records what every note was rendered from during the last build: its path, size and
+    modification time, content digest, frontmatter date, output filename, what each of its
+    links resolved to, the digests of the notes it embeds and its headings and block ids.
+    """
+
+    def __init__(self, fingerprint, notes=None):
+        self.fingerprint = fingerprint
+        self.notes = notes if notes is not None else {}
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        # A missing, unreadable or stale manifest simply means everything gets rebuilt
+        data = _read_manifest(path)
+        if data is None or data.get('fingerprint') != fingerprint:
+            return cls(fingerprint)
+        return cls(fingerprint, data.get('notes', {}))
+
+    @staticmethod
+    def recorded_outputs(path):
+        """The output filenames of the last build, even if it was made with another configuration."""
+        data = _read_manifest(path)
+        if data is None:
+            return set()
+        return {record['output'] for record in data.get('notes', {}).values()}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        # json.dump streams through the pure Python encoder, json.dumps uses the C one
+        data = json.dumps({
+            'version': MANIFEST_VERSION,
+            'fingerprint': self.fingerprint,
+            'notes': self.notes,
+        }, sort_keys=True, separators=(',', ':'))
+        with open(tmp_path, 'w', encoding='utf-8') as fs:
+            fs.write(data)
+        os.replace(tmp_path, path)
+
+    def record(self, slug_name, path, stat, digest, postdate, output_name, links, embeds=None, anchors=None):
+        self.notes[slug_name] = {
+            'path': path,
+            'stat': note_stat_key(stat),
+            'digest': digest,
+            'date': postdate,
+            'output': output_name,
+            'links': {target: list(resolution) if resolution else None
+                      for target, resolution in links.items()},
+            # The digests of the notes inlined into the note
+            'embeds': dict(embeds or {}),
+            # So that notes which are not read again can still be linked into
+            'headings': list(anchors.headings) if anchors else [],
+            'blocks': list(anchors.blocks) if anchors else [],
+        }
+
+    def stat_unchanged_record(self, slug_name, path, stat):
+        # Notes whose size and modification time did not change are not read again
+        record = self.notes.get(slug_name)
+        if record and record['path'] == path and record['stat'] == note_stat_key(stat):
+            return record
+        return None
+
+    def unchanged_record(self, slug_name, path, digest):
+        record = self.notes.get(slug_name)
+        if record and record['path'] == path and record['digest'] == digest:
+            return record
+        return None
+
+    def referenced_assets(self):
+        return {link[1] for record in self.notes.values() for link in record['links'].values()
+                if link and link[0] == 'asset'}
@@ -1,84 +1,234 @@
-from dataclasses import dataclass
-from typing import List
-from io import StringIO
+import re
+from bisect import bisect_right
+from typing import Iterator, List, NamedTuple, Optional
 
+NORMAL_SPAN = 'normal'
+PREFORMATTED_SPAN = 'preformatted'
 
-@dataclass(frozen=True)
-class ContentBlock:
-    content: str
+_TICK_RUN = re.compile(r'`+')
+_LINK_START = re.compile(r'\[\[+')
+_LINK_END = re.compile(r'\]+')
+
+_HEADING = re.compile(r'^(#{1,6})[ \t]+(.*?)(?:[ \t]+#+)?[ \t]*$', re.MULTILINE)
+# Obsidian block ids end the line of the block they name, or stand on the line after it
+_BLOCK_ID = re.compile(r'(?:^|[ \t])\^([A-Za-z0-9-]+)[ \t]*$', re.MULTILINE)
+
+UNTERMINATED_BLOCK_ERROR = 'Unterminated preformatted content block.'
+
+
+class ContentBlock(object):
+    """
+    A block of note content, stored as offsets into its source text. The text is only copied out
+    of the source when content is read, so blocks that are never looked at cost no copies.
+    """
+    __slots__ = ('source', 'start', 'end')
+
+    def __init__(self, content: str, start: int = 0, end: Optional[int] = None):
+        self.source = content
+        self.start = start
+        self.end = len(content) if end is None else end
+
+    @property
+    def content(self) -> str:
+        return self.source[self.start:self.end]
+
+    @property
+    def outer_start(self) -> int:
+        # Offset of the block in its source, including any wrapping ticks
+        return self.start
+
+    @property
+    def outer_end(self) -> int:
+        return self.end
+
+    def _key(self):
+        return (self.content,)
+
+    def __eq__(self, other):
+        if type(self) is not type(other):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self), self._key()))
+
+    def __repr__(self):
+        return f'{type(self).__name__}(content={self.content!r})'
 
 
-@dataclass(frozen=True)
 class PreformattedContentBlock(ContentBlock):
-    wrapping_tick_count: int
+    __slots__ = ('wrapping_tick_count',)
 
+    def __init__(self, content: str, wrapping_tick_count: int, start: int = 0, end: Optional[int] = None):
+        super().__init__(content, start, end)
+        self.wrapping_tick_count = wrapping_tick_count
 
-def parse_content_blocks(content: str) -> List[ContentBlock]:
+    @property
+    def outer_start(self) -> int:
+        return self.start - self.wrapping_tick_count
+
+    @property
+    def outer_end(self) -> int:
+        return self.end + self.wrapping_tick_count
+
+    def _key(self):
+        return (self.content, self.wrapping_tick_count)
+
+    def __repr__(self):
+        return f'{type(self).__name__}(content={self.content!r}, wrapping_tick_count={self.wrapping_tick_count})'
+
+
+class BlockSpan(NamedTuple):
+    kind: str
+    # Offsets of the block content, excluding wrapping ticks
+    start: int
+    end: int
+    tick_count: int
+
+
+class LinkSpan(NamedTuple):
+    # Offsets of the whole link, including the square brackets
+    start: int
+    end: int
+
+
+class Heading(NamedTuple):
+    level: int
+    text: str
+    # Offsets of the heading line, excluding its line break
+    start: int
+    end: int
+
+
+class BlockId(NamedTuple):
+    name: str
+    # Offsets of the ^name marker, including the whitespace in front of it
+    start: int
+    end: int
+
+
+class LexedContent(NamedTuple):
+    blocks: List[BlockSpan]
+    links: List[LinkSpan]
+    # Errors are recorded rather than raised, since a malformed link should only
+    # fail link extraction and vice versa
+    block_error: Optional[str] = None
+    link_error: Optional[str] = None
+
+
+def lex_content(content: str, final: bool = True) -> LexedContent:
+    """
+    Splits content into normal and preformatted block spans, and finds the obsidian link spans
+    inside normal blocks, in a single pass over the content. Content which is not final is a
+    chunk of a longer text that continues with a preformatted block, so a link running into its
+    end is not an error.
+    """
     blocks = []
-    state = 'open'
-    quotemult = 0
+    links = []
+    link_error = None
+    for span in _iter_block_spans(content):
+        if span is None:
+            return LexedContent(blocks, links, UNTERMINATED_BLOCK_ERROR, link_error)
+        blocks.append(span)
+        if span.kind is NORMAL_SPAN and link_error is None:
+            link_error = _lex_links(content, span.start, span.end, links, final)
+    return LexedContent(blocks, links, None, link_error)
+
+
+def _iter_block_spans(content):
+    """Yields the block spans of content, followed by None if it ends in an unterminated block."""
+    content_length = len(content)
     idx = 0
-    buffer = StringIO()
-
-    while idx < len(content):
-        c = content[idx]
-        incr = 1
-        if c == '`':
-            if state == 'open':
-                tick_mult = _substr_cond(content, idx, lambda _, y: y == '`')
-                quotemult = len(tick_mult)
-                state = 'codestart'
-                incr = quotemult
-                if buffer.tell() > 0:
-                    blocks.append(ContentBlock(content=buffer.getvalue()))
-                    buffer = StringIO()
-            elif state == 'code':
-                tick_mult = _substr_cond(content, idx, lambda _, y: y == '`')
-                ltick = len(tick_mult)
-                # If the number of ticks in a row is equal to or larger than the initial
-                # number of ticks. Assume that the open block is now closed
-                # with the initial number of ticks, and if there are any
-                # more ticks remaining, they will get handled in the next
-                # loop iteration.
-                incr = ltick if ltick < quotemult else quotemult
-                if incr >= quotemult:
-                    state = 'open'
-                    # Preformatted content blocks can never be empty
-                    # this would otherwise be an unterminated block
-                    blocks.append(PreformattedContentBlock(
-                        content=buffer.getvalue(), wrapping_tick_count=quotemult))
-                    buffer = StringIO()
-                    quotemult = 0
-                else:
-                    buffer.write(c)
-        else:
-            if state == 'codestart':
-                state = 'code'
-            buffer.write(c)
-
-        idx += incr
-
-    if state == 'code' or state == 'codestart':
-            raise ValueError('Unterminated preformatted content block.')
-
-    final_block = buffer.getvalue()
-    if final_block:
-        blocks.append(ContentBlock(content=final_block))
-    return blocks
-
-
-def _substr_cond(s, idx, cond):
-    res = ''
-    count = 0
-    if idx < 0:
-        raise ValueError('Invalid index')
-    if not cond:
-        raise ValueError('Condition must be provided')
-    while (idx + count) < len(s):
-        c = s[idx + count]
-        if cond(count, c):
-            res += c
+
+    while idx < content_length:
+        tick_start = content.find('`', idx)
+        normal_end = content_length if tick_start < 0 else tick_start
+        if normal_end > idx:
+            yield BlockSpan(NORMAL_SPAN, idx, normal_end, 0)
+        if tick_start < 0:
+            return
+
+        code_start = _TICK_RUN.match(content, tick_start).end()
+        tick_count = code_start - tick_start
+        # The block is closed by the first run of at least as many ticks as it was opened with,
+        # any ticks beyond that are treated as the start of the next block.
+        code_end = content.find('`' * tick_count, code_start)
+        if code_start == content_length or code_end < 0:
+            yield None
+            return
+        # Preformatted content blocks can never be empty
+        # this would otherwise be an unterminated block
+        yield BlockSpan(PREFORMATTED_SPAN, code_start, code_end, tick_count)
+        idx = code_end + tick_count
+
+
+def _lex_links(content, idx, end, links, final=True):
+    while True:
+        start_match = _LINK_START.search(content, idx, end)
+        if not start_match:
+            return None
+        start = start_match.start()
+        text_start = start_match.end()
+        text_end = content.find(']', text_start, end)
+        if text_end < 0:
+            if final and end == len(content):
+                return f'Hit EOF while parsing obsidian URL at index {start}'
+            # The link text runs into a preformatted block, so there are no more links here
+            return None
+        if text_end == text_start:
+            return f'Hit EOF while parsing obsidian URL at index {start}'
+        link_end = _LINK_END.match(content, text_end).end()
+        if link_end - text_end >= 2:
+            links.append(LinkSpan(start, link_end))
+        idx = link_end
+
+
+def iter_content_blocks(content: str) -> Iterator[ContentBlock]:
+    """
+    Yields the content blocks one at a time, as they are lexed, so that they never all exist at
+    once. Raises once an unterminated preformatted block is reached.
+    """
+    for span in _iter_block_spans(content):
+        if span is None:
+            raise ValueError(UNTERMINATED_BLOCK_ERROR)
+        if span.kind is PREFORMATTED_SPAN:
+            yield PreformattedContentBlock(content, span.tick_count, span.start, span.end)
         else:
+            yield ContentBlock(content, span.start, span.end)
+
+
+def parse_content_blocks(content: str) -> List[ContentBlock]:
+    lexed = lex_content(content)
+    if lexed.block_error:
+        raise ValueError(lexed.block_error)
+    return [PreformattedContentBlock(content, span.tick_count, span.start, span.end)
+            if span.kind == PREFORMATTED_SPAN else ContentBlock(content, span.start, span.end)
+            for span in lexed.blocks]
+
+
+def _iter_outside_preformatted(content, pattern):
+    """Yields the matches of a multiline pattern which do not start inside a preformatted block."""
+    preformatted_ends = {}
+    for span in _iter_block_spans(content):
+        if span is None:
             break
-        count += 1
-    return res
+        if span.kind is PREFORMATTED_SPAN:
+            preformatted_ends[span.start - span.tick_count] = span.end + span.tick_count
+    starts = sorted(preformatted_ends)
+    for match in pattern.finditer(content):
+        index = bisect_right(starts, match.start()) - 1
+        if index >= 0 and match.start() < preformatted_ends[starts[index]]:
+            continue
+        yield match
+
+
+def iter_headings(content: str) -> Iterator[Heading]:
+    """Yields the ATX headings of content, leaving out lines inside preformatted blocks."""
+    for match in _iter_outside_preformatted(content, _HEADING):
+        yield Heading(len(match.group(1)), match.group(2), match.start(), match.end())
+
+
+def iter_block_ids(content: str) -> Iterator[BlockId]:
+    """Yields the ^block ids of content, leaving out lines inside preformatted blocks."""
+    for match in _iter_outside_preformatted(content, _BLOCK_ID):
+        yield BlockId(match.group(1), match.start(), match.end())
@@ -0,0 +1,383 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import chain, tee, zip_longest
+
+from .document import NoteDocument
+from .linking import rewrite_links
+from .parsing import iter_content_blocks
+from .rewriting import (RewritingEngine, RewritingPipeline,
+                        RewritingTransformer)
+from .rewriting.find_replace import FindReplaceRewritingTransformer
+from .stats import NULL_STATS, BuildStats, counting_transformer
+
+# Unchanged content is streamed in chunks of about this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+def document_transformer(transformer: RewritingTransformer, document: NoteDocument, skip_preformatted=False):
+    """Adds the find/replace lists from a note's frontmatter in front of the shared transformer."""
+    find_list = document.metadata.get("find")
+    replace_list = document.metadata.get("replace")
+    if not (find_list and replace_list):
+        return transformer
+    return RewritingPipeline([
+        FindReplaceRewritingTransformer(
+            find_list, replace_list, skip_preformatted=skip_preformatted),
+        transformer
+    ])
+
+
+def _counted(items, stats, name):
+    for item in items:
+        stats.count(name)
+        yield item
+
+
+def _staged(chunks, stats, name):
+    """Yields from chunks, adding the time spent producing them to the stage."""
+    chunks = iter(chunks)
+    while True:
+        with stats.stage(name, calls=0):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _rewrite_chunk_links(chunks, resolver, resolved_links, stats, source=None):
+    # Every chunk but the last is followed by a preformatted block or by the rest of a run of
+    # unchanged blocks, so only the last chunk can end in the middle of a link
+    previous = None
+    for chunk in chunks:
+        if previous is not None:
+            with stats.stage('render.rewrite_links', calls=0):
+                rewritten = rewrite_links(previous, resolver, resolved_links, stats, final=False, source=source)
+            yield rewritten
+        previous = chunk
+    if previous is not None:
+        with stats.stage('render.rewrite_links', calls=0):
+            rewritten = rewrite_links(previous, resolver, resolved_links, stats, source=source)
+        yield rewritten
+
+
+def stream_posts(engine: RewritingEngine, document: NoteDocument, outputs, stats=NULL_STATS, expand=None,
+                 source=None):
+    """
+    Rewrites a note and its links for several (write, resolver, resolved_links) outputs, passing
+    each post to its write in pieces. The content is rewritten chunk by chunk, so a rewritten
+    post is never held in memory as a whole. The note is only parsed and transformed once, and
+    the chunks are handed to every output in turn, so that only links are rewritten for each
+    output. expand, if given, is applied to the transformed chunks before that, e.g. to inline
+    embedded notes. source is the slug of the note, which links to its own headings are
+    resolved against.
+    """
+    with stats.stage('render.yaml'):
+        metadata_section = document.metadata_section()
+    with stats.stage('render.transform', calls=0):
+        rewritten_metadata = engine.rewrite_metadata(metadata_section)
+    # Blocks are parsed as they are rewritten, which is timed as part of the transform stage
+    post_content_blocks = iter_content_blocks(document.content)
+    if stats.enabled:
+        post_content_blocks = _counted(post_content_blocks, stats, 'content_blocks')
+    chunks = engine.rewrite_iter(post_content_blocks, STREAM_CHUNK_SIZE)
+    if stats.enabled:
+        chunks = _staged(chunks, stats, 'render.transform')
+    if rewritten_metadata != metadata_section:
+        # Only a rewritten frontmatter section has to be parsed again, any part of it which no
+        # longer parses as frontmatter goes in front of the content
+        document = NoteDocument.loads(rewritten_metadata)
+        if document.content:
+            chunks = chain((document.content, '\n'), chunks)
+    if expand is not None:
+        chunks = expand(chunks)
+
+    # The outputs are written in lockstep, so only a few chunks are ever buffered for them
+    chunk_streams = tee(chunks, len(outputs)) if len(outputs) > 1 else [chunks]
+    piece_streams = [document.dump_iter(_rewrite_chunk_links(chunk_stream, resolver, resolved_links, stats, source))
+                     for chunk_stream, (_, resolver, resolved_links) in zip(chunk_streams, outputs)]
+    for pieces in zip_longest(*piece_streams):
+        for (write, _, _), piece in zip(outputs, pieces):
+            if piece is not None:
+                with stats.stage('render.write', calls=0):
+                    write(piece)
+    # The stages were timed chunk by chunk, but count as one call per note
+    for name in ('render.transform', 'render.rewrite_links', 'render.write'):
+        stats.add_stage_time(name, 0.0, 0.0)
+
+
+def write_if_changed(path, data):
+    """
+    Writes data to path unless the file already holds exactly that data, so that unchanged
+    outputs keep their modification time. Returns whether the file was written. Writes go to a
+    temporary file which is then renamed, so readers never see a partially written file.
+    """
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as fs:
+                if fs.read() == data:
+                    return False
+    except OSError:
+        pass
+    tmp_path = _tmp_path(path)
+    try:
+        with open(tmp_path, 'wb') as fs:
+            fs.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def _tmp_path(path):
+    return os.path.join(os.path.dirname(path), f'.{os.path.basename(path)}.{os.getpid()}.tmp')
+
+
+class PostWriter(object):
+    """
+    Writes a post in pieces, with the same outcome as write_if_changed. The pieces are compared
+    with the existing post as they come in, and a temporary file is only started once they
+    differ from it, so that unchanged posts are never written. Use as a context manager and
+    call close once the whole post was written, which returns whether the post was written.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = _tmp_path(path)
+        self.bytes_written = 0
+        self._fs = None
+        try:
+            self._existing = open(path, 'rb')
+        except OSError:
+            self._existing = None
+            self._start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if self._fs is None and self._existing.read(len(data)) != data:
+            self._start()
+        if self._fs is not None:
+            self._fs.write(data)
+        self.bytes_written += len(data)
+
+    def _start(self):
+        self._fs = open(self.tmp_path, 'wb')
+        if self._existing is None:
+            return
+        # Everything written so far matched the existing post
+        self._existing.seek(0)
+        remaining = self.bytes_written
+        while remaining:
+            chunk = self._existing.read(min(remaining, COPY_CHUNK_SIZE))
+            if not chunk:
+                raise ValueError(f'{self.path} changed while it was being rewritten.')
+            self._fs.write(chunk)
+            remaining -= len(chunk)
+        self._existing.close()
+        self._existing = None
+
+    def close(self):
+        if self._fs is None:
+            if not self._existing.read(1):
+                self._existing.close()
+                self._existing = None
+                return False
+            # The existing post is longer
+            self._start()
+        self._fs.close()
+        self._fs = None
+        os.replace(self.tmp_path, self.path)
+        return True
+
+    def abort(self):
+        if self._existing is not None:
+            self._existing.close()
+            self._existing = None
+        if self._fs is not None:
+            self._fs.close()
+            self._fs = None
+            if os.path.lexists(self.tmp_path):
+                os.remove(self.tmp_path)
+
+
+def prune_stale_posts(post_output_path, output_names):
+    """Deletes previously written posts by name. Returns the number of posts deleted."""
+    pruned = 0
+    for name in output_names:
+        path = os.path.join(post_output_path, name)
+        # Names come from the manifest, never delete anything outside the output directory
+        if os.path.basename(name) != name or not os.path.isfile(path):
+            continue
+        os.remove(path)
+        pruned += 1
+    return pruned
+
+
+class RenderTarget(object):
+    """Where the posts of one output target go, and how their links are resolved."""
+
+    def __init__(self, link_resolver, post_output_path):
+        self.link_resolver = link_resolver
+        self.post_output_path = post_output_path
+
+
+class RenderContext(object):
+    """The read-only state shared by every note rendered during a run."""
+
+    def __init__(self, transformer: RewritingTransformer, targets,
+                 find_replace_skip_preformatted=False, collect_stats=False, block_cache=None, transcluder=None,
+                 tokenizer=None):
+        self.transformer = transformer
+        self.targets = targets
+        self.find_replace_skip_preformatted = find_replace_skip_preformatted
+        self.collect_stats = collect_stats
+        self.block_cache = block_cache
+        # Inlines embedded notes, if set
+        self.transcluder = transcluder
+        # Collects the search terms of every note, if set
+        self.tokenizer = tokenizer
+
+
+class RenderTask(object):
+    def __init__(self, slug_name, path, output_names=None):
+        self.slug_name = slug_name
+        self.path = path
+        # Target index to output filename, for every target the note is rendered for
+        self.output_names = output_names if output_names is not None else {}
+
+
+class RenderResult(object):
+    def __init__(self, slug_name, path, resolved_links=None, error=None, stats=None, block_cache_updates=None,
+                 embeds=None, search_terms=None):
+        self.slug_name = slug_name
+        self.path = path
+        # Target index to the resolutions of the note's links for that target
+        self.resolved_links = resolved_links
+        # Slug to digest of every note inlined into the note
+        self.embeds = embeds
+        # The title and term frequencies of the note, if the context has a tokenizer
+        self.search_terms = search_terms
+        self.error = error
+        # The stats collected while rendering the note, if requested
+        self.stats = stats
+        # The blocks added to the context's block cache while rendering the note, if it has one
+        self.block_cache_updates = block_cache_updates
+
+
+def render_note(context: RenderContext, task: RenderTask, stats=NULL_STATS):
+    with stats.stage('render.read'):
+        with open(task.path, 'rb') as fs:
+            data = fs.read()
+    stats.count('bytes_read', len(data))
+    with stats.stage('render.yaml'):
+        document = NoteDocument.loads(data)
+    # Only the parsed content is kept while the post is streamed out
+    del data
+
+    search_terms = None
+    if context.tokenizer is not None:
+        # Tokenised from the source text while the note is in memory anyway, like notes which are
+        # not rendered again are tokenised from their source
+        with stats.stage('render.search'):
+            search_terms = context.tokenizer.document_terms(document, task.path)
+
+    transformer = document_transformer(
+        context.transformer, document, skip_preformatted=context.find_replace_skip_preformatted)
+    if stats.enabled:
+        transformer = counting_transformer(transformer, stats)
+
+    resolved_links = {}
+    embeds = {}
+    expand = None
+    if context.transcluder is not None:
+        # Which notes an embed resolves to does not depend on the target
+        resolver = context.targets[next(iter(task.output_names))].link_resolver
+
+        def expand(chunks):
+            return context.transcluder.expand_chunks(chunks, resolver, task.slug_name, embeds)
+
+    writers = []
+    outputs = []
+    with ExitStack() as stack:
+        for index, output_name in task.output_names.items():
+            target = context.targets[index]
+            writer = stack.enter_context(PostWriter(os.path.join(target.post_output_path, output_name)))
+            resolved_links[index] = {}
+            writers.append(writer)
+            outputs.append((writer.write, target.link_resolver, resolved_links[index]))
+        stream_posts(RewritingEngine(transformer, cache=context.block_cache), document, outputs, stats,
+                     expand=expand, source=task.slug_name)
+        for writer in writers:
+            with stats.stage('render.write', calls=0):
+                written = writer.close()
+            if written:
+                stats.count('posts_written')
+                stats.count('bytes_written', writer.bytes_written)
+            else:
+                stats.count('posts_unchanged')
+    return resolved_links, embeds, search_terms
+
+
+def _render_task(context, task):
+    stats = BuildStats() if context.collect_stats else NULL_STATS
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    # Failures are reported per note instead of aborting the whole run
+    try:
+        resolved_links, embeds, search_terms = render_note(context, task, stats)
+        result = RenderResult(task.slug_name, task.path, resolved_links=resolved_links, embeds=embeds,
+                              search_terms=search_terms)
+    except Exception as e:
+        # Only the message is kept, not every exception type survives pickling
+        result = RenderResult(task.slug_name, task.path, error=str(e) or repr(e))
+    if context.collect_stats:
+        stats.note_time(task.path, time.perf_counter() - wall, time.process_time() - cpu)
+        result.stats = stats
+    if context.block_cache is not None:
+        result.block_cache_updates = context.block_cache.take_updates()
+    return result
+
+
+_worker_context = None
+
+
+def _init_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _render_task_in_worker(task):
+    return _render_task(_worker_context, task)
+
+
+def render_notes(context: RenderContext, tasks, jobs=1):
+    """
+    Renders every task, in a process pool when more than one job is requested. The context is
+    handed to each worker once when it starts rather than with every task. Notes are loaded
+    one at a time as they are rendered, so only the notes in flight are held in memory.
+    """
+    if jobs <= 1 or len(tasks) <= 1:
+        for task in tasks:
+            yield _render_task(context, task)
+        return
+
+    chunksize = max(1, len(tasks) // (jobs * 4))
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(context,)) as executor:
+        yield from executor.map(_render_task_in_worker, tasks, chunksize=chunksize)
+
+
+def render_errors_message(failed_results):
+    failures = '\n'.join(
+        f'  {result.path}: {result.error}' for result in failed_results)
+    return f'Failed to render {len(failed_results)} note(s):\n{failures}'
@@ -0,0 +1,100 @@
+import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from .model import RewritingTransformer
+
+_REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+
+def _is_literal_pair(find: str, replace: str) -> bool:
+    return bool(find) and not any(c in _REGEX_METACHARACTERS for c in find) and '\\' not in replace
+
+
+def _literals_overlap(first: str, second: str) -> bool:
+    if first in second or second in first:
+        return True
+    for length in range(1, min(len(first), len(second))):
+        if first.endswith(second[:length]) or second.endswith(first[:length]):
+            return True
+    return False
+
+
+def _can_merge_literal(group: List[Tuple[str, str]], find: str) -> bool:
+    # A single alternation pass gives the same result as applying the literals one after
+    # the other, as long as no two literals can overlap and no literal can match text that
+    # an earlier replacement produced. A match which includes none of the characters of a
+    # non-empty replacement cannot span it, while an empty replacement joins the text on
+    # either side of it into new matches.
+    for group_find, group_replace in group:
+        if _literals_overlap(group_find, find) or not group_replace or any(c in group_replace for c in find):
+            return False
+    return True
+
+
+def _compile_literal_group(group: List[Tuple[str, str]]):
+    if len(group) == 1:
+        find, replace = group[0]
+        return re.compile(re.escape(find)), replace
+    replacements = dict(group)
+    pattern = re.compile('|'.join(re.escape(find) for find, _ in group))
+    return pattern, lambda match: replacements[match.group(0)]
+
+
+@lru_cache(maxsize=256)
+def compile_find_replace(pairs: Tuple[Tuple[str, str], ...]):
+    """
+    Compiles (find, replace) pairs into substitution steps, shared by every note that uses the
+    same pairs. Consecutive literal pairs are merged into a single alternation where that does
+    not change the result.
+    """
+    steps = []
+    literal_group = []
+    for find, replace in pairs:
+        if _is_literal_pair(find, replace):
+            if _can_merge_literal(literal_group, find):
+                literal_group.append((find, replace))
+                continue
+            steps.append(_compile_literal_group(literal_group))
+            literal_group = [(find, replace)]
+            continue
+        if literal_group:
+            steps.append(_compile_literal_group(literal_group))
+            literal_group = []
+        steps.append((re.compile(find), replace))
+    if literal_group:
+        steps.append(_compile_literal_group(literal_group))
+    return tuple(steps)
+
+
+class FindReplaceRewritingTransformer(RewritingTransformer):
+    def __init__(self, find_list, replace_list, skip_preformatted=False):
+        if len(find_list) != len(replace_list):
+            raise ValueError(
+                f'Length of with list is not the same as the length of the replace list')
+        self.pairs = tuple((str(find), str(replace))
+                           for find, replace in zip(find_list, replace_list))
+        self.skip_preformatted = skip_preformatted
+        self.transforms_preformatted_blocks = not skip_preformatted
+        self.steps = compile_find_replace(self.pairs)
+
+    def _find_replace(self, text: str) -> Optional[str]:
+        rewritten = text
+        for pattern, replace in self.steps:
+            rewritten = pattern.sub(replace, rewritten)
+        return rewritten if rewritten != text else None
+
+    def transform_normal_block(self, block: str) -> Optional[str]:
+        return self._find_replace(block)
+
+    def transform_preformatted_block(self, block: str) -> Optional[str]:
+        if self.skip_preformatted:
+            return None
+        return self._find_replace(block)
+
+    def transform_metadata_section(self, metadata: str) -> Optional[str]:
+        # Allow find/replace to run on metadata in addition to post content
+        return self._find_replace(metadata)
+
+    def fingerprint(self) -> str:
+        return f"{super().fingerprint()}({self.pairs!r},{self.skip_preformatted})"
@@ -1,20 +1,11 @@
 import re
-from typing import Optional
 
-from .model import RewritingTransformer
+from .model import RegexRewritingTransformer
 
 
-class ObsidianHighlightRewritingTransformer(RewritingTransformer):
+class ObsidianHighlightRewritingTransformer(RegexRewritingTransformer):
     HIGHLIGHT_REGEX = re.compile(r"==(.*?)==", flags=re.DOTALL)
 
-    def transform_normal_block(self, block: str) -> Optional[str]:
-        transformed, count = self.HIGHLIGHT_REGEX.subn(r"<mark>\1</mark>", block)
-        return transformed if count != 0 else None
-
-    def transform_preformatted_block(self, block: str) -> Optional[str]:
-        # Does not modify preformatted blocks
-        return None
-
-    def transform_metadata_section(self, metadata: str) -> Optional[str]:
-        # Does not modify metadata section
-        return None
+    pattern = HIGHLIGHT_REGEX
+    replacement = r"<mark>\1</mark>"
+    normal_block_markers = ("==",)
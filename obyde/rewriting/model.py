@@ -1,11 +1,19 @@
+import re
 from abc import ABC, abstractmethod
-from io import StringIO
-from typing import Callable, List, Optional, Tuple
+from typing import Callable, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 
-from ..parsing import ContentBlock, PreformattedContentBlock
+from ..parsing import (NORMAL_SPAN, PREFORMATTED_SPAN, ContentBlock,
+                       PreformattedContentBlock)
 
 
 class RewritingTransformer(ABC):
+    # Cheap prefilter for normal blocks: when set, transform_normal_block is only called for
+    # blocks containing at least one of these substrings, as it cannot change any other block.
+    normal_block_markers: Tuple[str, ...] = ()
+    # Whether transform_preformatted_block can ever change a block. When it cannot, the engine
+    # does not call it, so preformatted blocks are never copied out of their source.
+    transforms_preformatted_blocks: bool = True
+
     @abstractmethod
     def transform_normal_block(self, block: str) -> Optional[str]:
         pass
@@ -18,53 +26,149 @@ class RewritingTransformer(ABC):
     def transform_metadata_section(self, metadata: str) -> Optional[str]:
         pass
 
+    def fingerprint(self) -> str:
+        # Identifies the transformation for build caching, override if the output
+        # also depends on instance configuration.
+        return f"{type(self).__module__}.{type(self).__qualname__}"
+
+
+class RegexRewritingTransformer(RewritingTransformer):
+    """A transformer which substitutes a single regex in normal blocks."""
+    pattern: Pattern
+    # Either a template for Match.expand or a function of the match
+    replacement: Union[str, Callable[[re.Match], str]]
+    transforms_preformatted_blocks = False
+
+    def transform_normal_block(self, block: str) -> Optional[str]:
+        transformed, count = self.pattern.subn(self.replacement, block)
+        return transformed if count != 0 else None
+
+    def transform_preformatted_block(self, block: str) -> Optional[str]:
+        return None
+
+    def transform_metadata_section(self, metadata: str) -> Optional[str]:
+        return None
+
 
 class RewritingPipeline(RewritingTransformer):
+    """
+    Applies its phases one after the other, each phase working on the output of the previous
+    one. Phases declaring normal block markers are skipped for blocks without any of them.
+    """
+
     def __init__(self, phases: List[RewritingTransformer]):
         self.phases = phases
+        self.transforms_preformatted_blocks = any(
+            phase.transforms_preformatted_blocks for phase in phases)
+        markers = [phase.normal_block_markers for phase in phases]
+        if phases and all(markers):
+            self.normal_block_markers = tuple(
+                m for phase_markers in markers for m in phase_markers)
 
     def transform_normal_block(self, block: str) -> Optional[str]:
-        return self.__process_str_transform_iterated(lambda x, y: x.transform_normal_block(y), block)
+        current_block = block
+        transformed_any = False
+        for phase in self.phases:
+            markers = phase.normal_block_markers
+            if markers and not any(marker in current_block for marker in markers):
+                continue
+            transformed = phase.transform_normal_block(current_block)
+            if transformed is not None:
+                current_block = transformed
+                transformed_any = True
+        return current_block if transformed_any else None
 
     def transform_preformatted_block(self, block: str) -> Optional[str]:
-        return self.__process_str_transform_iterated(lambda x, y: x.transform_preformatted_block(y), block)
+        return self.__process_str_transform_iterated(
+            lambda x, y: x.transform_preformatted_block(y) if x.transforms_preformatted_blocks else None, block)
 
     def transform_metadata_section(self, metadata: str) -> Optional[str]:
         return self.__process_str_transform_iterated(lambda x, y: x.transform_metadata_section(y), metadata)
 
+    def fingerprint(self) -> str:
+        phases = ",".join(phase.fingerprint() for phase in self.phases)
+        return f"[{phases}]"
+
     def __process_str_transform_iterated(self, transformation_function: Callable[[RewritingTransformer, str], Optional[str]], block: str):
         current_block = block
+        transformed_any = False
         for phase in self.phases:
-            transformed = transformation_function(phase, block)
+            transformed = transformation_function(phase, current_block)
             if transformed is not None:
                 current_block = transformed
-        return current_block
+                transformed_any = True
+        return current_block if transformed_any else None
 
 
 class RewritingEngine(object):
-    def __init__(self, transformer: RewritingTransformer):
+    def __init__(self, transformer: RewritingTransformer, cache=None):
         self.transformer = transformer
+        # An optional BlockCache which block transforms are looked up in
+        self.cache = cache
 
     def rewrite(self, metadata, content_blocks: List[ContentBlock]) -> Tuple[str, str]:
-        metadata = self.transformer.transform_metadata_section(
-            metadata) or metadata
-        rewritten_content = StringIO()
+        """
+        Rewrites the metadata section and content blocks, joining the rewritten content once.
+        When nothing changes the source of the blocks is returned as it is.
+        """
+        return (self.rewrite_metadata(metadata), "".join(self.rewrite_iter(content_blocks)))
+
+    def rewrite_metadata(self, metadata: str) -> str:
+        transformed_metadata = self.transformer.transform_metadata_section(
+            metadata)
+        return transformed_metadata if transformed_metadata is not None else metadata
+
+    def rewrite_iter(self, content_blocks: Iterable[ContentBlock], chunk_size: Optional[int] = None) -> Iterator[str]:
+        """
+        Yields the rewritten content blocks as chunks, each made of whole blocks. Text is only
+        copied out of a block when the transformer may change it, and runs of consecutive
+        unchanged blocks are emitted from their source as a single slice, which is cut at the
+        first block boundary past chunk_size characters, if given. Empty chunks are skipped.
+        """
+        transformer = self.transformer
+        markers = transformer.normal_block_markers
+        transforms_preformatted_blocks = transformer.transforms_preformatted_blocks
+        transform_normal_block = transformer.transform_normal_block
+        transform_preformatted_block = transformer.transform_preformatted_block
+        if self.cache is not None:
+            fingerprint = transformer.fingerprint()
+            transform_normal_block = self.cache.cached(transform_normal_block, NORMAL_SPAN, fingerprint)
+            transform_preformatted_block = self.cache.cached(
+                transform_preformatted_block, PREFORMATTED_SPAN, fingerprint)
+        # The source and offsets of the current run of unchanged blocks
+        run_source = None
+        run_start = run_end = 0
         for block in content_blocks:
             if isinstance(block, PreformattedContentBlock):
-                transformed = self.transformer.transform_preformatted_block(
-                    block.content)
-                transformed = transformed or block.content
-                ticks = "`" * block.wrapping_tick_count
-                rewritten_content.write(ticks)
-                rewritten_content.write(transformed)
-                rewritten_content.write(ticks)
+                transformed = transform_preformatted_block(
+                    block.content) if transforms_preformatted_blocks else None
             elif isinstance(block, ContentBlock):
-                transformed = self.transformer.transform_normal_block(
-                    block.content)
-                transformed = transformed or block.content
-                rewritten_content.write(transformed)
+                if markers and not any(block.source.find(marker, block.start, block.end) >= 0 for marker in markers):
+                    transformed = None
+                else:
+                    transformed = transform_normal_block(
+                        block.content)
             else:
                 raise ValueError(
                     f"Unexpected object {repr(block)} encountered while rewriting content.")
 
-        return (metadata, rewritten_content.getvalue())
+            if transformed is None:
+                if block.source is run_source and block.outer_start == run_end and (
+                        chunk_size is None or run_end - run_start < chunk_size):
+                    run_end = block.outer_end
+                    continue
+                if run_source is not None and run_end > run_start:
+                    yield run_source[run_start:run_end]
+                run_source, run_start, run_end = block.source, block.outer_start, block.outer_end
+                continue
+
+            if run_source is not None and run_end > run_start:
+                yield run_source[run_start:run_end]
+            run_source = None
+            if isinstance(block, PreformattedContentBlock):
+                ticks = "`" * block.wrapping_tick_count
+                yield ticks + transformed + ticks
+            elif transformed:
+                yield transformed
+        if run_source is not None and run_end > run_start:
+            yield run_source[run_start:run_end]
@@ -0,0 +1,242 @@
+import json
+import os
+import re
+from collections import Counter
+from hashlib import sha256
+
+from .linking import split_link
+from .parsing import NORMAL_SPAN, lex_content
+from .rendering import write_if_changed
+
+SEARCH_CACHE_FILENAME = 'search.json'
+# Changes whenever notes are tokenised differently, which invalidates the cached terms
+SEARCH_TOKENIZER_VERSION = 2
+SEARCH_OPTIONS = ('stemming', 'stopwords', 'min_term_length', 'max_index_kb')
+
+_WORD = re.compile(r'\w+')
+# Link targets are not worth searching for
+_URL = re.compile(r'\]\([^)]*\)|https?://\S+')
+
+# The stopwords lunr.js leaves out, so that queries tokenised by it match
+ENGLISH_STOPWORDS = frozenset('''
+a able about across after all almost also am among an and any are as at be because been but by can
+cannot could dear did do does either else ever every for from get got had has have he her hers him his
+how however i if in into is it its just least let like likely may me might most must my neither no nor
+not of off often on only or other our own rather said say says she should since so some than that the
+their them then there these they this tis to too twas us wants was we were what when where which while
+who whom why will with would yet you your
+'''.split())
+
+
+def _iter_normal_text(content):
+    """
+    Yields the text of the normal blocks of content, with every [[target|alias]] link reduced
+    to the text it is shown with, i.e. its alias or else its target.
+    """
+    # Malformed blocks and links are left for rendering to report
+    lexed = lex_content(content)
+    links = iter(lexed.links)
+    link = next(links, None)
+    for block in lexed.blocks:
+        if block.kind is not NORMAL_SPAN:
+            continue
+        idx = block.start
+        while link is not None and link.end <= block.end:
+            yield content[idx:link.start]
+            yield ' '
+            yield split_link(content[link.start:link.end])[1]
+            yield ' '
+            idx = link.end
+            link = next(links, None)
+        yield content[idx:block.end]
+        yield '\n'
+
+
+def _load_stemmer(language):
+    try:
+        import snowballstemmer
+    except ImportError:
+        raise ValueError('search stemming requires snowballstemmer, install it with "pip install obyde[search]".')
+    try:
+        return snowballstemmer.stemmer(language)
+    except KeyError:
+        raise ValueError(f'Unknown search stemming language "{language}". must be one of '
+                         f'{", ".join(snowballstemmer.algorithms())}.')
+
+
+class SearchTokenizer(object):
+    """
+    Turns the normal blocks of a note into term frequencies, leaving out preformatted blocks,
+    the targets of links, stopwords and short terms. Terms are stemmed with a Snowball stemmer when
+    stemming names a language.
+    """
+
+    def __init__(self, config=None):
+        config = config or {}
+        unknown = [key for key in config if key not in SEARCH_OPTIONS]
+        if unknown:
+            raise ValueError(f'Unknown search option "{unknown[0]}". must be one of {", ".join(SEARCH_OPTIONS)}.')
+        self.stemming = config.get('stemming') or None
+        stopwords = config.get('stopwords', 'english')
+        if stopwords == 'english':
+            self.stopwords = ENGLISH_STOPWORDS
+        elif isinstance(stopwords, list):
+            self.stopwords = frozenset(str(word).lower() for word in stopwords)
+        elif not stopwords:
+            self.stopwords = frozenset()
+        else:
+            raise ValueError(f'Unknown search stopwords "{stopwords}". must be "english" or a list of words.')
+        self.min_term_length = int(config.get('min_term_length', 2))
+        self.max_index_bytes = int(config['max_index_kb']) * 1024 if config.get('max_index_kb') else None
+        self._stemmer = _load_stemmer(self.stemming) if self.stemming else None
+        # Word to term, or None for words which are left out
+        self._terms = {}
+
+    def __getstate__(self):
+        # Stemmers are rebuilt by each render worker
+        return dict(self.__dict__, _stemmer=None, _terms={})
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.stemming:
+            self._stemmer = _load_stemmer(self.stemming)
+
+    def fingerprint(self):
+        return json.dumps([SEARCH_TOKENIZER_VERSION, self.stemming, sorted(self.stopwords), self.min_term_length])
+
+    def _term(self, word):
+        try:
+            return self._terms[word]
+        except KeyError:
+            pass
+        term = None
+        if len(word) >= self.min_term_length and word not in self.stopwords:
+            term = self._stemmer.stemWord(word) if self._stemmer else word
+        self._terms[word] = term
+        return term
+
+    def note_terms(self, title, content):
+        """The frequency of every term in a note's title and the normal blocks of its content."""
+        words = Counter(_WORD.findall(_URL.sub(' ', title).lower()))
+        words.update(_WORD.findall(_URL.sub(' ', ''.join(_iter_normal_text(content))).lower()))
+        # Words are counted first, so that each distinct word is only looked up once
+        counts = {}
+        for word, count in words.items():
+            term = self._term(word)
+            if term is not None:
+                counts[term] = counts.get(term, 0) + count
+        return counts
+
+    def document_terms(self, document, path):
+        """The title of a note, from its frontmatter or its filename, and its term frequencies."""
+        title = str(document.metadata.get('title') or os.path.splitext(os.path.basename(path))[0])
+        return title, self.note_terms(title, document.content)
+
+
+class SearchTermCache(object):
+    """
+    Keeps the title and term frequencies of every note keyed by its slug and content digest,
+    so that only notes which changed are tokenised again, along with the key of the documents
+    the last index was built from. The notes are only loaded once an entry is looked up, so
+    that builds which find the index unchanged only read the first line of the cache. Only
+    entries used during a run are kept when it is saved, and a cache made by another
+    tokenizer configuration is ignored.
+    """
+
+    def __init__(self, fingerprint, index_key=None, path=None):
+        self.fingerprint = fingerprint
+        self.index_key = index_key
+        self.used = {}
+        # Loaded from path on first use
+        self._path = path
+        self._entries = None if path else {}
+
+    @classmethod
+    def load(cls, path, fingerprint):
+        try:
+            with open(path, 'r', encoding='utf-8') as fs:
+                header = json.loads(fs.readline())
+        except (OSError, ValueError):
+            return cls(fingerprint)
+        if not isinstance(header, dict) or header.get('fingerprint') != fingerprint:
+            return cls(fingerprint)
+        return cls(fingerprint, header.get('index'), path)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        header = json.dumps({'fingerprint': self.fingerprint, 'index': self.index_key})
+        notes = json.dumps(self.used, separators=(',', ':'), ensure_ascii=False)
+        with open(tmp_path, 'w', encoding='utf-8') as fs:
+            fs.write(f'{header}\n{notes}')
+        os.replace(tmp_path, path)
+
+    def _load_entries(self):
+        try:
+            with open(self._path, 'r', encoding='utf-8') as fs:
+                fs.readline()
+                entries = json.loads(fs.read())
+        except (OSError, ValueError):
+            entries = {}
+        self._entries = entries if isinstance(entries, dict) else {}
+
+    def get(self, slug_name, digest):
+        """Returns the (title, terms) of a note, or None if the note changed since it was tokenised."""
+        entry = self.used.get(slug_name)
+        if entry is None:
+            if self._entries is None:
+                self._load_entries()
+            entry = self._entries.get(slug_name)
+        if not entry or entry[0] != digest:
+            return None
+        self.used[slug_name] = entry
+        return entry[1], entry[2]
+
+    def set(self, slug_name, digest, title, terms):
+        self.used[slug_name] = [digest, title, terms]
+
+
+def search_index_key(notes, max_bytes):
+    """Identifies the index of (slug, dated name, digest) notes, which is the same as long as they are."""
+    return sha256(json.dumps([notes, max_bytes]).encode('utf-8')).hexdigest()
+
+
+def build_search_index(documents, max_bytes=None):
+    """
+    Builds an inverted index from (slug, dated name, title, terms) documents. Documents are
+    numbered in the order given, and every term maps to a flat posting list of document
+    number and term frequency pairs. When the serialised index would be larger than max_bytes,
+    the terms found in the fewest documents are left out first. Returns the index and the
+    number of terms left out.
+    """
+    postings = {}
+    for number, (_, _, _, terms) in enumerate(documents):
+        for term, frequency in terms.items():
+            postings.setdefault(term, []).extend((number, frequency))
+    docs = [[slug_name, dated_name, title] for slug_name, dated_name, title, _ in documents]
+    pruned = 0
+    if max_bytes is not None:
+        sizes = {term: _size(term) + _size(posting) + 2 for term, posting in postings.items()}
+        excess = _size({'docs': docs, 'terms': {}}) + sum(sizes.values()) - max_bytes
+        if excess > 0:
+            # Rare terms first, and of those the ones which occur least often overall
+            for term in sorted(postings, key=lambda term: (len(postings[term]), sum(postings[term][1::2]), term)):
+                excess -= sizes[term]
+                del postings[term]
+                pruned += 1
+                if excess <= 0:
+                    break
+    return {'docs': docs, 'terms': postings}, pruned
+
+
+def _size(value):
+    return len(json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+
+def write_search_index(path, index):
+    """Writes the search index as JSON, unless the file already holds the same index. Returns whether it was written."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    return write_if_changed(path, json.dumps(index, sort_keys=True, separators=(',', ':'),
+                                             ensure_ascii=False).encode('utf-8'))
@@ -0,0 +1,161 @@
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from typing import Optional
+
+from .rewriting.model import RewritingPipeline, RewritingTransformer
+
+SLOWEST_NOTES_COUNT = 10
+STATS_FORMAT_VERSION = 1
+
+
+class BuildStats(object):
+    """
+    Collects wall and CPU time per build stage, counters such as bytes read or links resolved,
+    and the time spent rendering each note. Stats collected in worker processes are merged
+    into the stats of the run with merge.
+    """
+    enabled = True
+
+    def __init__(self):
+        # Stage name to [wall seconds, CPU seconds, calls]
+        self.stages = {}
+        self.counters = Counter()
+        # Note path to [wall seconds, CPU seconds]
+        self.note_times = {}
+
+    @contextmanager
+    def stage(self, name, calls=1):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - wall,
+                                time.process_time() - cpu, calls)
+
+    def add_stage_time(self, name, wall, cpu, calls=1):
+        timing = self.stages.setdefault(name, [0.0, 0.0, 0])
+        timing[0] += wall
+        timing[1] += cpu
+        timing[2] += calls
+
+    def count(self, name, amount=1):
+        self.counters[name] += amount
+
+    def note_time(self, path, wall, cpu):
+        self.note_times[path] = [wall, cpu]
+
+    def merge(self, other: 'BuildStats'):
+        for name, (wall, cpu, calls) in other.stages.items():
+            self.add_stage_time(name, wall, cpu, calls)
+        self.counters.update(other.counters)
+        self.note_times.update(other.note_times)
+
+    def slowest_notes(self, count=SLOWEST_NOTES_COUNT):
+        return sorted(self.note_times.items(), key=lambda item: item[1][0], reverse=True)[:count]
+
+    def to_dict(self):
+        return {
+            'format_version': STATS_FORMAT_VERSION,
+            'stages': {name: {'wall_s': wall, 'cpu_s': cpu, 'calls': calls}
+                       for name, (wall, cpu, calls) in self.stages.items()},
+            'counters': dict(sorted(self.counters.items())),
+            'slowest_notes': [{'path': path, 'wall_s': wall, 'cpu_s': cpu}
+                              for path, (wall, cpu) in self.slowest_notes()],
+        }
+
+    def save_json(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as fs:
+            json.dump(self.to_dict(), fs, indent=2)
+            fs.write('\n')
+
+    def format_report(self):
+        width = max([32] + [len(name) for name in self.counters])
+        lines = ['Stages:', f'  {"stage":<{width}} {"wall (s)":>10} {"cpu (s)":>10} {"calls":>8}']
+        for name, (wall, cpu, calls) in self.stages.items():
+            lines.append(f'  {name:<{width}} {wall:>10.4f} {cpu:>10.4f} {calls:>8}')
+        lines.append('Counters:')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'  {name:<{width}} {value:>10}')
+        slowest = self.slowest_notes()
+        if slowest:
+            lines.append('Slowest notes:')
+            for path, (wall, _) in slowest:
+                lines.append(f'  {wall:>10.4f}s  {path}')
+        return '\n'.join(lines)
+
+
+class NullBuildStats(BuildStats):
+    """Stats that record nothing, used when stats are not requested."""
+    enabled = False
+
+    def stage(self, name, calls=1):
+        return nullcontext()
+
+    def add_stage_time(self, name, wall, cpu, calls=1):
+        pass
+
+    def count(self, name, amount=1):
+        pass
+
+    def note_time(self, path, wall, cpu):
+        pass
+
+    def merge(self, other):
+        pass
+
+
+NULL_STATS = NullBuildStats()
+
+
+class CountingRewritingTransformer(RewritingTransformer):
+    """Forwards to a transformer and counts the blocks it changed."""
+
+    def __init__(self, transformer: RewritingTransformer, stats: BuildStats):
+        self.transformer = transformer
+        self.stats = stats
+        self.normal_block_markers = transformer.normal_block_markers
+        self.transforms_preformatted_blocks = transformer.transforms_preformatted_blocks
+        self.name = type(transformer).__name__
+
+    def _counted(self, transformed: Optional[str], kind):
+        if transformed is not None:
+            self.stats.count(f'transformed_{kind}.{self.name}')
+        return transformed
+
+    def transform_normal_block(self, block: str) -> Optional[str]:
+        return self._counted(self.transformer.transform_normal_block(block), 'blocks')
+
+    def transform_preformatted_block(self, block: str) -> Optional[str]:
+        return self._counted(self.transformer.transform_preformatted_block(block), 'preformatted_blocks')
+
+    def transform_metadata_section(self, metadata: str) -> Optional[str]:
+        return self._counted(self.transformer.transform_metadata_section(metadata), 'metadata')
+
+    def fingerprint(self) -> str:
+        return self.transformer.fingerprint()
+
+
+class CountingRewritingPipeline(RewritingPipeline):
+    """Applies the phases of a pipeline, each wrapped to count its changes."""
+
+    def __init__(self, pipeline: RewritingPipeline, stats: BuildStats):
+        super().__init__([counting_transformer(phase, stats) for phase in pipeline.phases])
+        self.pipeline = pipeline
+
+    def fingerprint(self) -> str:
+        # Counting does not change the output, so blocks cached without stats are reused with them
+        return self.pipeline.fingerprint()
+
+
+def counting_transformer(transformer: RewritingTransformer, stats: BuildStats) -> RewritingTransformer:
+    """Wraps every phase of a transformer, including those of nested pipelines, to count its changes."""
+    if isinstance(transformer, RewritingPipeline):
+        return CountingRewritingPipeline(transformer, stats)
+    return CountingRewritingTransformer(transformer, stats)
@@ -0,0 +1,63 @@
+import os
+from hashlib import sha256
+
+from .discovery import dir_exists_or_raise
+from .linking import POST_LINK_MODES
+from .manifest import MANIFEST_FILENAME
+
+DEFAULT_RELATIVE_ASSET_PATH_PREFIX = '{{ site.assets_location }}'
+
+
+def output_configs(config):
+    """The output sections of a configuration, whose output is either a single target or a list of them."""
+    output = config['output']
+    outputs = list(output) if isinstance(output, list) else [output]
+    if not outputs:
+        raise ValueError('At least one output target must be configured.')
+    return outputs
+
+
+def target_config(config, output):
+    """The configuration of a single target, which its build fingerprint is computed from."""
+    return dict(config, output=output)
+
+
+def manifest_filename(config, output):
+    # A single target keeps the manifest of builds made before there could be several
+    if not isinstance(config['output'], list):
+        return MANIFEST_FILENAME
+    key = sha256(os.path.abspath(output['post_output_path']).encode('utf-8')).hexdigest()[:16]
+    return f'manifest-{key}.json'
+
+
+class BuildTarget(object):
+    """
+    A site the vault is published to, with its own output directories, link formatting and
+    build manifest. The manifests, asset index and link resolver are set up by the build.
+    """
+
+    def __init__(self, config, output, cache_dir):
+        self.output = output
+        self.post_output_path = dir_exists_or_raise(output['post_output_path'], 'post output path')
+        self.asset_output_path = dir_exists_or_raise(output['asset_output_path'], 'asset output path')
+        self.relative_asset_path_prefix = output.get(
+            'relative_asset_path_prefix', DEFAULT_RELATIVE_ASSET_PATH_PREFIX)
+        self.post_link_mode = output.get('post_link_mode', 'jekyll')
+        self.link_graph_path = output.get('link_graph_path')
+        self.search_index_path = output.get('search_index_path')
+        if self.post_link_mode not in POST_LINK_MODES:
+            raise ValueError(
+                f'Unknown post link mode "{self.post_link_mode}". must be set to either "jekyll" or "hugo".')
+        self.manifest_path = os.path.join(cache_dir, manifest_filename(config, output))
+        self.previous_manifest = None
+        self.manifest = None
+        self.copied_asset_files = None
+        self.link_resolver = None
+
+
+def build_targets(config, cache_dir):
+    targets = [BuildTarget(config, output, cache_dir) for output in output_configs(config)]
+    post_output_paths = [os.path.abspath(target.post_output_path) for target in targets]
+    if len(set(post_output_paths)) != len(post_output_paths):
+        raise ValueError('Output targets must not share a post output path.')
+    return targets
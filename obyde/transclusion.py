@@ -0,0 +1,161 @@
+import re
+from hashlib import sha256
+
+from .anchors import normalise_heading
+from .document import NoteDocument
+from .linking import split_fragment, split_link
+from .parsing import (iter_block_ids, iter_content_blocks, iter_headings,
+                      lex_content)
+from .rendering import document_transformer
+from .rewriting import RewritingEngine
+
+DEFAULT_MAX_EMBED_DEPTH = 8
+
+# What separates the block an id marks from the content above it
+_BLOCK_SEPARATOR = re.compile(r'\n[ \t]*\n|^#{1,6}[ \t].*\n', re.MULTILINE)
+# Lines which are blocks of their own when an id marks them
+_LINE_BLOCK = re.compile(r'[ \t]*(?:[-*+]|\d+[.)]|#{1,6})[ \t]')
+
+
+def heading_section(content, heading):
+    """
+    The section of content under a heading, from the heading line up to the next heading of the
+    same or a higher level, or None if there is no such heading. Headings are matched like
+    links to them are.
+    """
+    headings = list(iter_headings(content))
+    wanted = normalise_heading(heading)
+    for index, found in enumerate(headings):
+        if normalise_heading(found.text) == wanted:
+            end = next((following.start for following in headings[index + 1:] if following.level <= found.level),
+                       len(content))
+            return content[found.start:end].strip()
+    return None
+
+
+def block_section(content, block_id):
+    """
+    The block of content marked with ^block_id, without the marker, or None if there is no such
+    block. Ids at the end of a list item or a heading mark just that line, and an id on a line
+    of its own marks the block above it, e.g. a whole list or a table.
+    """
+    for found in iter_block_ids(content):
+        if found.name != block_id:
+            continue
+        line = content[content.rfind('\n', 0, found.start) + 1:found.start]
+        if _LINE_BLOCK.match(line):
+            return line.strip()
+        before = content[:found.start].rstrip()
+        start = 0
+        for separator in _BLOCK_SEPARATOR.finditer(before):
+            start = separator.end()
+        return before[start:].strip()
+    return None
+
+
+def _embed_name(key):
+    slug_name, fragment = key
+    return f'{slug_name}#{fragment}' if fragment else slug_name
+
+
+class Transcluder(object):
+    """
+    Inlines the notes which ![[note]], ![[note#heading]] and ![[note#^block]] embeds resolve to,
+    or the part of them the embed points to. An embedded note
+    is read, transformed and has its own embeds inlined once per process, however many notes
+    embed it. Links in the inlined text are left for link rewriting, which resolves them for
+    each target. Embedding notes which embed themselves, directly or not, and embeds nested more
+    than max_depth levels deep fail the note.
+    """
+
+    def __init__(self, note_paths, transformer, find_replace_skip_preformatted=False, block_cache=None,
+                 max_depth=DEFAULT_MAX_EMBED_DEPTH):
+        # Note slug to the path of the note
+        self.note_paths = note_paths
+        self.transformer = transformer
+        self.find_replace_skip_preformatted = find_replace_skip_preformatted
+        self.block_cache = block_cache
+        self.max_depth = max_depth
+        # (slug, fragment) to the inlined text and the digests of the notes it was made from
+        self._bodies = {}
+
+    def __getstate__(self):
+        # Every worker memoises the embeds it renders itself
+        return dict(self.__dict__, _bodies={})
+
+    def expand_chunks(self, chunks, resolver, slug_name, embeds):
+        """
+        Inlines the embeds in a note's content chunks, as yielded by RewritingEngine.rewrite_iter.
+        The digest of every note inlined is added to embeds.
+        """
+        stack = [(slug_name, None)]
+        for chunk in chunks:
+            yield self.expand(chunk, resolver, stack, embeds)[0] if '![[' in chunk else chunk
+
+    def expand(self, content, resolver, stack, embeds):
+        """Returns content with its embeds inlined, and how many levels of embeds were nested in it."""
+        # Link errors are left for link rewriting to report
+        lexed = lex_content(content, final=False)
+        pieces = []
+        idx = 0
+        height = 0
+        for link_span in lexed.links:
+            if content[link_span.start - 1:link_span.start] != '!':
+                continue
+            link_target, _ = split_link(content[link_span.start:link_span.end])
+            name, fragment = split_fragment(link_target)
+            resolution = resolver.resolve(name)
+            if resolution is None or resolution.kind != 'note':
+                continue
+            text, body_height = self.body(resolution.name, fragment, resolver, stack, embeds)
+            pieces.append(content[idx:link_span.start - 1])
+            pieces.append(text)
+            idx = link_span.end
+            height = max(height, body_height)
+        if not pieces:
+            return content, height
+        pieces.append(content[idx:])
+        return ''.join(pieces), height
+
+    def body(self, slug_name, fragment, resolver, stack, embeds):
+        """Returns the inlined text of an embed, and how many levels of embeds it is made of."""
+        key = (slug_name, fragment)
+        if key in stack:
+            cycle = ' -> '.join(_embed_name(embed) for embed in stack[stack.index(key):] + [key])
+            raise ValueError(f'Embed cycle detected: {cycle}')
+        # The root note is not an embed, so the stack holds one entry more than the embeds above
+        if len(stack) > self.max_depth:
+            raise ValueError(f'Embeds are nested more than {self.max_depth} levels deep in {_embed_name(key)}.')
+        try:
+            text, height, body_embeds = self._bodies[key]
+        except KeyError:
+            body_embeds = {}
+            text, height = self._render(slug_name, fragment, resolver, stack + [key], body_embeds)
+            height += 1
+            self._bodies[key] = (text, height, body_embeds)
+        # A memoised embed may be nested deeper than where it was first rendered
+        if len(stack) - 1 + height > self.max_depth:
+            raise ValueError(f'Embeds are nested more than {self.max_depth} levels deep in {_embed_name(key)}.')
+        embeds.update(body_embeds)
+        return text, height
+
+    def _render(self, slug_name, fragment, resolver, stack, embeds):
+        path = self.note_paths[slug_name]
+        with open(path, 'rb') as fs:
+            data = fs.read()
+        embeds[slug_name] = sha256(data).hexdigest()
+        document = NoteDocument.loads(data)
+        content = document.content
+        if fragment is not None and fragment.startswith('^'):
+            content = block_section(content, fragment[1:])
+            if content is None:
+                raise ValueError(f'Embedded block "{fragment}" does not exist in {path}.')
+        elif fragment is not None:
+            content = heading_section(content, fragment.rsplit('#', 1)[-1])
+            if content is None:
+                raise ValueError(f'Embedded heading "{fragment}" does not exist in {path}.')
+        transformer = document_transformer(
+            self.transformer, document, skip_preformatted=self.find_replace_skip_preformatted)
+        engine = RewritingEngine(transformer, cache=self.block_cache)
+        text = ''.join(engine.rewrite_iter(iter_content_blocks(content))).strip()
+        return self.expand(text, resolver, stack, embeds)
@@ -0,0 +1,194 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from .discovery import scan_vault
+from .manifest import cache_dir_path
+from .targets import output_configs
+
+DEBOUNCE_SECONDS = 0.1
+POLL_INTERVAL_SECONDS = 1.0
+
+# Returned among the changed paths when the changes are unknown and the vault must be scanned again
+RESCAN = '*'
+
+# From linux/inotify.h
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_CLOEXEC = 0o2000000
+_WATCH_MASK = (_IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+               | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher(object):
+    """Reports changed paths in a set of directories using Linux inotify, through ctypes."""
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(_IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.watched = set()
+        self.sync(directories)
+
+    def sync(self, directories):
+        """Starts watching directories which are not watched yet."""
+        for directory in directories:
+            if directory in self.watched:
+                continue
+            wd = self._add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+            # The directory might already be gone again
+            if wd >= 0:
+                self.watches[wd] = directory
+                self.watched.add(directory)
+
+    def changes(self, timeout):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                changed.add(RESCAN)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None:
+                continue
+            if mask & _IN_IGNORED:
+                del self.watches[wd]
+                self.watched.discard(directory)
+                continue
+            changed.add(os.path.join(directory, name) if name else directory)
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Reports changed paths by comparing the size and modification time of every scanned file."""
+
+    def __init__(self, scan, interval=POLL_INTERVAL_SECONDS):
+        self.scan = scan
+        self.interval = interval
+        self.snapshot = self._snapshot()
+
+    def _snapshot(self):
+        scan = self.scan()
+        return {path: (stat.st_size, stat.st_mtime_ns)
+                for path, stat in ((path, scan.stat(path)) for path in scan.entries)}
+
+    def sync(self, directories):
+        pass
+
+    def changes(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self._snapshot()
+        changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                   if snapshot.get(path) != self.snapshot.get(path)}
+        self.snapshot = snapshot
+        return changed
+
+
+def _needs_rescan(scan, path, asset_path, note_ext='.md'):
+    """Whether a change to a path can add, remove or rename a note or an asset."""
+    if path in scan.entries:
+        return not os.path.isfile(path)
+    if path == RESCAN or path in scan.directories or os.path.isdir(path):
+        return True
+    return path.endswith(note_ext) or path.startswith(asset_path + os.sep)
+
+
+def watch_vault(config, build, debounce=DEBOUNCE_SECONDS, polling=False, poll_interval=POLL_INTERVAL_SECONDS,
+                should_stop=None):
+    """
+    Builds the vault, then builds it again whenever notes or assets change, until interrupted
+    or should_stop returns true. build is called with an up to date scan of the vault and
+    whether this is the initial build. The scan is only redone when files are added, removed
+    or renamed; modified files just have their stat results refreshed.
+    """
+    vault_path = os.path.abspath(config['vault']['path'])
+    asset_path = os.path.abspath(config['vault']['asset_path'])
+    exclusions = config['vault'].get('excluded_subdirectories', [])
+    cache_dir = cache_dir_path(config)
+    # Changes caused by the build itself are not interesting
+    ignored = tuple(os.path.abspath(path) + os.sep for path in [cache_dir] + [
+        output[key] for output in output_configs(config) for key in ('post_output_path', 'asset_output_path')])
+
+    def rescan():
+        return scan_vault(vault_path, asset_path, exclusions=exclusions, raise_collisions=False,
+                          ignored_dirs=[cache_dir])
+
+    def run_build(scan, initial):
+        start = time.perf_counter()
+        try:
+            build(scan, initial)
+        except ValueError as e:
+            print(f'Error: {e}', file=sys.stderr)
+            return
+        print(f'Built in {(time.perf_counter() - start) * 1000:.0f} ms.')
+
+    scan = rescan()
+    # Watching starts before the initial build so that no change made during it is missed
+    watcher = None
+    if not polling:
+        try:
+            watcher = InotifyWatcher(scan.directories)
+        except (AttributeError, OSError):
+            # Not on Linux, or out of inotify instances
+            pass
+    if watcher is None:
+        watcher = PollingWatcher(rescan, poll_interval)
+    run_build(scan, True)
+    print(f'Watching {vault_path} for changes, press Ctrl+C to stop.')
+
+    try:
+        while not (should_stop and should_stop()):
+            changed = watcher.changes(poll_interval)
+            if not changed:
+                continue
+            # Editors often save a file in several steps, wait for the burst to end
+            while True:
+                more = watcher.changes(debounce)
+                if not more:
+                    break
+                changed |= more
+
+            changed = {path for path in changed if not (path + os.sep).startswith(ignored)}
+            if any(_needs_rescan(scan, path, asset_path) for path in changed):
+                scan = rescan()
+                watcher.sync(scan.directories)
+            elif any(path in scan.entries for path in changed):
+                for path in changed:
+                    if path in scan.entries:
+                        scan.refresh(path)
+            else:
+                continue
+            run_build(scan, False)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if isinstance(watcher, InotifyWatcher):
+            watcher.close()
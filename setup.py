@@ -21,9 +21,10 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/khalednassar/obyde",
     author="Khaled Nassar",
-    packages=find_packages(exclude=["contrib", "docs", "tests"]),
+    packages=find_packages(exclude=["contrib", "docs", "tests", "benchmarks"]),
     python_requires=">=3.8",
     install_requires=["python-frontmatter==1.0.0", "pyyaml==6.0"],
+    extras_require={"images": ["Pillow"], "search": ["snowballstemmer"]},
     dependency_links=[],
     entry_points={"console_scripts": ["obyde=obyde:main"]},
 )
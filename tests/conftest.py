@@ -0,0 +1,76 @@
+import pytest
+from obyde.anchors import NoteAnchors
+from obyde.linking import LinkResolver
+
+NOTES = [
+    "---\ndate: 2021-08-21\n---\nPlain ==highlighted== body.\n",
+    "---\ndate: 2021-08-21\ntitle: \"A: title\"\ntags: [a, b]\n---\n\n\n  Leading and trailing space  \n\n",
+    "---\ndate: 2021-08-21\n---\n",
+    "\n\n---\r\ndate: 2021-08-21\r\nnested:\r\n  key: value\r\n---\r\nWindows line endings\r\n---\r\nand a rule\r\n",
+    "---\ndate: 2021-08-21\nfind:\n  - foo\n  - ba(r|k)\nreplace:\n  - baz\n  - qux\n---\nfoo bar bak `foo`\n",
+    "---\ndate: 2021-08-21\nfind:\n  - '2021'\nreplace:\n  - 'yes'\n---\nRewrites the frontmatter too.\n",
+    "No frontmatter ==at all==",
+]
+
+DATED_FILES = {
+    'first-note': ('2021-08-21-first-note', '2021-08-21-first-note.md', '/vault/First Note.md'),
+    'nested': ('2021-08-22-nested', '2021-08-22-nested.md', '/vault/folder/Nested.md'),
+}
+ASSETS = {
+    'image.png': ('/vault/attachments/image.png', 'aaaa.png'),
+    'diagram.svg': ('/vault/attachments/drawings/diagram.svg', 'bbbb.svg'),
+    'image of first note.png': ('/vault/attachments/image of first note.png', 'cccc.png'),
+}
+ANCHORS = {
+    'first-note': NoteAnchors(['Setup', 'Step 1: Install', 'Setup'], ['summary']),
+}
+
+
+def _write_note(vault, name, body, date="2021-08-21"):
+    path = vault / f"{name}.md"
+    path.write_text(f"---\ndate: {date}\n---\n{body}\n", encoding="utf-8")
+    return path
+
+
+def _read_post(posts, name):
+    return (posts / name).read_text(encoding="utf-8")
+
+
+def _make_resolver(mode='indexed', post_link_mode='jekyll'):
+    return LinkResolver(DATED_FILES, ASSETS, '/assets', post_link_mode, mode=mode, anchor_index=ANCHORS)
+
+
+@pytest.fixture(params=NOTES)
+def note_text(request):
+    return request.param
+
+
+@pytest.fixture
+def write_note():
+    return _write_note
+
+
+@pytest.fixture
+def read_post():
+    return _read_post
+
+
+@pytest.fixture
+def make_resolver():
+    return _make_resolver
+
+
+@pytest.fixture
+def site(tmp_path):
+    vault = tmp_path / "vault"
+    assets = vault / "attachments"
+    posts = tmp_path / "site" / "_posts"
+    asset_output = tmp_path / "site" / "assets"
+    for d in (assets, posts, asset_output):
+        d.mkdir(parents=True)
+    config = {
+        "vault": {"path": str(vault), "asset_path": str(assets)},
+        "output": {"post_output_path": str(posts), "asset_output_path": str(asset_output)},
+        "build": {"cache_dir": str(tmp_path / "cache")},
+    }
+    return vault, posts, config
@@ -0,0 +1,81 @@
+from io import StringIO
+
+import pytest
+from obyde.parsing import (ContentBlock, PreformattedContentBlock,
+                           parse_content_blocks)
+from obyde.rewriting import RewritingEngine, RewritingPipeline
+from obyde.rewriting.find_replace import FindReplaceRewritingTransformer
+from obyde.rewriting.highlight import ObsidianHighlightRewritingTransformer
+
+CONTENTS = [
+    "",
+    "plain text only",
+    "==a== `==b==` ``c ` d`` ==e==",
+    "```\n==code==\nfoo\n```\nfoo ==bar== `x`",
+    "`a``b``c`==d==",
+]
+
+
+def legacy_rewrite(transformer, metadata, content_blocks):
+    transformed_metadata = transformer.transform_metadata_section(metadata)
+    metadata = transformed_metadata if transformed_metadata is not None else metadata
+    rewritten_content = StringIO()
+    for block in content_blocks:
+        if isinstance(block, PreformattedContentBlock):
+            transformed = transformer.transform_preformatted_block(block.content)
+            transformed = transformed if transformed is not None else block.content
+            ticks = "`" * block.wrapping_tick_count
+            rewritten_content.write(ticks + transformed + ticks)
+        else:
+            transformed = transformer.transform_normal_block(block.content)
+            rewritten_content.write(transformed if transformed is not None else block.content)
+    return metadata, rewritten_content.getvalue()
+
+
+@pytest.mark.parametrize("content", CONTENTS)
+@pytest.mark.parametrize("skip_preformatted", [False, True])
+def test_engine_matches_legacy_engine(content, skip_preformatted):
+    transformer = RewritingPipeline([
+        FindReplaceRewritingTransformer(["foo"], ["baz"], skip_preformatted=skip_preformatted),
+        ObsidianHighlightRewritingTransformer(),
+    ])
+    blocks = parse_content_blocks(content)
+    assert RewritingEngine(transformer).rewrite("---\nfoo\n---", blocks) == legacy_rewrite(
+        transformer, "---\nfoo\n---", blocks)
+
+
+def test_untouched_blocks_are_not_copied():
+    transformer = RewritingPipeline([ObsidianHighlightRewritingTransformer()])
+    content = "no marks `==code==` here"
+    preformatted_calls = []
+    transformer.transform_preformatted_block = lambda block: preformatted_calls.append(block)
+
+    _, rewritten = RewritingEngine(transformer).rewrite("", parse_content_blocks(content))
+
+    assert rewritten is content
+    assert preformatted_calls == []
+
+
+def test_blocks_keep_offsets_into_their_source():
+    content = "abc ``def`` ghi"
+    blocks = parse_content_blocks(content)
+    assert [(block.start, block.end) for block in blocks] == [(0, 4), (6, 9), (11, 15)]
+    assert all(block.source is content for block in blocks)
+    assert blocks[1] == PreformattedContentBlock("def", wrapping_tick_count=2)
+    assert blocks[1] != ContentBlock("def")
+    assert not hasattr(blocks[0], "__dict__")
+
+
+@pytest.mark.parametrize("content", CONTENTS)
+@pytest.mark.parametrize("chunk_size", [None, 1, 8])
+def test_rewrite_iter_yields_whole_blocks(content, chunk_size):
+    transformer = RewritingPipeline([ObsidianHighlightRewritingTransformer()])
+    blocks = parse_content_blocks(content)
+    engine = RewritingEngine(transformer)
+
+    chunks = list(engine.rewrite_iter(blocks, chunk_size))
+
+    assert "".join(chunks) == engine.rewrite("", blocks)[1]
+    assert "" not in chunks
+    # Every chunk can be parsed on its own into the blocks it was made of
+    assert sum(len(parse_content_blocks(chunk)) for chunk in chunks) == len(blocks)
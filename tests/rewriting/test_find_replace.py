@@ -0,0 +1,82 @@
+import random
+import re
+
+import pytest
+from obyde.rewriting.find_replace import (FindReplaceRewritingTransformer,
+                                          compile_find_replace)
+
+
+def sequential_find_replace(pairs, text):
+    for find, replace in pairs:
+        text = re.sub(find, replace, text)
+    return text
+
+
+def find_replace(transformer, text):
+    rewritten = transformer.transform_normal_block(text)
+    return text if rewritten is None else rewritten
+
+
+def test_find_replace_rewrites_blocks_and_metadata():
+    transformer = FindReplaceRewritingTransformer(["foo", "ba(r|k)"], ["baz", "qux"])
+    assert transformer.transform_normal_block("foo bar bak") == "baz qux qux"
+    assert transformer.transform_preformatted_block("foo") == "baz"
+    assert transformer.transform_metadata_section("---\ntitle: foo\n---") == "---\ntitle: baz\n---"
+
+
+def test_find_replace_returns_none_without_matches():
+    transformer = FindReplaceRewritingTransformer(["foo"], ["bar"])
+    assert transformer.transform_normal_block("nothing to see") is None
+
+
+def test_find_replace_can_skip_preformatted_blocks():
+    transformer = FindReplaceRewritingTransformer(["foo"], ["bar"], skip_preformatted=True)
+    assert transformer.transform_preformatted_block("foo") is None
+    assert transformer.transform_normal_block("foo") == "bar"
+
+
+def test_find_replace_mismatched_lists_raise():
+    with pytest.raises(ValueError):
+        FindReplaceRewritingTransformer(["a", "b"], ["c"])
+
+
+def test_compiled_patterns_are_cached():
+    pairs = (("cached", "pattern"),)
+    assert compile_find_replace(pairs) is compile_find_replace(pairs)
+
+
+def test_independent_literals_are_merged_into_one_pass():
+    steps = compile_find_replace((("cat", "puss"), ("red", "blu"), ("x+", "y")))
+    assert len(steps) == 2
+
+
+@pytest.mark.parametrize("pairs", [
+    # Later literals match text produced by earlier replacements
+    (("a", "b"), ("b", "c")),
+    # Overlapping literals
+    (("ab", "1"), ("bc", "2")),
+    (("abc", "1"), ("b", "2")),
+    (("aa", "b"), ("a", "c")),
+    # Earlier replacements join the text around them into later matches
+    (("c", ""), ("ab", "")),
+    # Independent literals and regexes mixed
+    (("cat", "dog"), ("red", "blue"), ("d.g", "pup"), ("pup", "cub"), ("blue", "green")),
+])
+def test_merged_literals_match_sequential_substitution(pairs):
+    transformer = FindReplaceRewritingTransformer(*zip(*pairs))
+    for text in ["abcabc aab bca", "the red cat and the dog", "aaaa bbbb cccc", "abc"]:
+        expected = sequential_find_replace(pairs, text)
+        assert find_replace(transformer, text) == expected
+
+
+def test_merged_literals_match_sequential_substitution_on_random_inputs():
+    rng = random.Random(8)
+
+    def word(min_length, max_length):
+        return "".join(rng.choice("abc") for _ in range(rng.randint(min_length, max_length)))
+
+    for _ in range(5000):
+        pairs = tuple((word(1, 3), word(0, 2)) for _ in range(rng.randint(2, 4)))
+        transformer = FindReplaceRewritingTransformer(*zip(*pairs))
+        text = word(0, 12)
+        assert find_replace(transformer, text) == sequential_find_replace(pairs, text), pairs
@@ -0,0 +1,63 @@
+import re
+
+from obyde.rewriting.highlight import ObsidianHighlightRewritingTransformer
+from obyde.rewriting.model import (RegexRewritingTransformer,
+                                   RewritingPipeline)
+
+
+class StrikethroughTransformer(RegexRewritingTransformer):
+    pattern = re.compile(r"~~(.+?)~~")
+    replacement = r"<del>\1</del>"
+    normal_block_markers = ("~~",)
+
+
+class UppercaseTagTransformer(RegexRewritingTransformer):
+    pattern = re.compile(r"#(?P<tag>[a-z]+)\b", flags=re.IGNORECASE)
+
+    def replacement(self, match):
+        return "#" + match.group("tag").upper()
+
+
+class CountingTransformer(RegexRewritingTransformer):
+    pattern = re.compile(r"!!")
+    replacement = "!"
+    normal_block_markers = ("!!",)
+
+    def __init__(self):
+        self.calls = 0
+
+    def transform_normal_block(self, block):
+        self.calls += 1
+        return super().transform_normal_block(block)
+
+
+def test_pipeline_chains_phases():
+    class AddHighlight(RegexRewritingTransformer):
+        pattern = re.compile(r"important")
+        replacement = "==important=="
+
+    pipeline = RewritingPipeline([AddHighlight(), ObsidianHighlightRewritingTransformer()])
+    assert pipeline.transform_normal_block("this is important") == "this is <mark>important</mark>"
+
+
+def test_pipeline_returns_none_when_nothing_changed():
+    pipeline = RewritingPipeline([ObsidianHighlightRewritingTransformer()])
+    assert pipeline.transform_normal_block("plain") is None
+    assert pipeline.transform_preformatted_block("a == b") is None
+    assert pipeline.transform_metadata_section("---\ntitle: == x ==\n---") is None
+
+
+def test_pipeline_skips_blocks_without_markers():
+    counting = CountingTransformer()
+    pipeline = RewritingPipeline([counting])
+    assert pipeline.transform_normal_block("no markers here") is None
+    assert counting.calls == 0
+    assert pipeline.transform_normal_block("wow!!") == "wow!"
+    assert counting.calls == 1
+    assert pipeline.normal_block_markers == ("!!",)
+
+
+def test_pipeline_applies_nested_phases_and_replacement_functions():
+    pipeline = RewritingPipeline([
+        ObsidianHighlightRewritingTransformer(), StrikethroughTransformer(), UppercaseTagTransformer()])
+    assert pipeline.transform_normal_block("==~~x~~== #tag") == "<mark><del>x</del></mark> #TAG"
@@ -0,0 +1,24 @@
+import pytest
+from obyde.anchors import NoteAnchors, heading_anchors, normalise_heading, note_anchors
+
+
+def test_note_anchors_leave_out_preformatted_blocks():
+    content = "# Intro\nText ^first\n```\n# Not a heading ^nope\n```\n## Next Step #\n- item\n\n^list-id\n"
+    assert note_anchors(content) == NoteAnchors(["Intro", "Next Step"], ["first", "list-id"])
+
+
+@pytest.mark.parametrize("mode", ["jekyll", "hugo"])
+def test_heading_anchors_follow_the_site_generator(mode):
+    assert heading_anchors(["What's new?", "A_b - c", "Émigré", "Intro"], mode) == {
+        "what's new?": "whats-new", "a_b - c": "a_b---c", "émigré": "émigré", "intro": "intro"}
+
+
+def test_heading_anchors_differ_for_empty_and_repeated_ids():
+    headings = ["!!", "Intro", "Intro", "Intro-1"]
+    assert heading_anchors(headings, "hugo") == {"!!": "heading", "intro": "intro", "intro-1": "intro-1-1"}
+    # kramdown counts repeats of each id without checking for clashes with other ids
+    assert heading_anchors(headings, "jekyll") == {"intro": "intro", "intro-1": "intro-1"}
+
+
+def test_normalise_heading_matches_obsidian_links():
+    assert normalise_heading("Step 1: Install  the [[Tool]]") == normalise_heading("step 1 install the tool")
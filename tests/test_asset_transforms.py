@@ -0,0 +1,138 @@
+import os
+import threading
+from concurrent.futures import Future
+
+import pytest
+from obyde import asset_transforms, process_vault
+from obyde.asset_transforms import AssetTransforms, parse_asset_transforms
+from obyde.stats import BuildStats
+
+
+@pytest.fixture
+def encoder(monkeypatch):
+    """Stands in for Pillow, variants are their source prefixed with their parameters."""
+    encoded = []
+
+    def encode_variant(source, destination, params):
+        encoded.append(source)
+        with open(source, 'rb') as fs:
+            data = repr(sorted(params.items())).encode('utf-8') + fs.read()
+        with open(destination, 'wb') as fs:
+            fs.write(data)
+        return len(data)
+
+    monkeypatch.setattr(asset_transforms, '_available_formats', lambda: {'PNG', 'JPEG', 'WEBP'})
+    monkeypatch.setattr(asset_transforms, '_encode_variant', encode_variant)
+    return encoded
+
+
+@pytest.fixture
+def photo_site(site, tmp_path, write_note):
+    vault, posts, config = site
+    (vault / "attachments" / "photo.png").write_bytes(b"png")
+    (vault / "attachments" / "other.png").write_bytes(b"png")
+    (vault / "attachments" / "notes.txt").write_bytes(b"txt")
+    write_note(vault, "Note", "![[photo.png]] ![[notes.txt]]")
+    config["build"]["asset_transforms"] = {"png": {"max_width": 800, "format": "webp"}}
+    return vault, posts, config, tmp_path / "site" / "assets"
+
+
+def test_parse_asset_transforms():
+    assert parse_asset_transforms({"PNG": {"max_width": "800", "format": "WebP"}, ".jpg": None}) == {
+        ".png": {"format": "webp", "max_width": 800, "max_height": None, "quality": None},
+        ".jpg": {"format": None, "max_width": None, "max_height": None, "quality": None},
+    }
+    with pytest.raises(ValueError, match='Unknown asset transform option "width"'):
+        parse_asset_transforms({"png": {"width": 800}})
+    with pytest.raises(ValueError, match='Unknown asset transform format "heic"'):
+        parse_asset_transforms({"png": {"format": "heic"}})
+
+
+def test_asset_transforms_require_pillow(monkeypatch, tmp_path):
+    monkeypatch.setattr(asset_transforms, '_available_formats', lambda: None)
+    with pytest.raises(ValueError, match="requires Pillow"):
+        AssetTransforms({"png": {"max_width": 800}}, str(tmp_path))
+
+
+def test_formats_without_an_encoder_are_kept(encoder, tmp_path, capsys):
+    transforms = AssetTransforms({"png": {"format": "avif"}}, str(tmp_path))
+    assert transforms.output_name("a" * 64, ".PNG").endswith(".PNG")
+    output = capsys.readouterr()
+    assert "Warning: No avif encoder is available" in output.err
+    assert output.out == ""
+
+
+@pytest.mark.parametrize("export_assets", ["all", "referenced"])
+def test_variants_are_linked_and_only_encoded_once(photo_site, encoder, export_assets, read_post):
+    vault, posts, config, asset_output = photo_site
+    config["build"]["export_assets"] = export_assets
+    process_vault(config)
+
+    post = read_post(posts, "2021-08-21-note.md")
+    variant_name = post.split("![photo.png]({{ site.assets_location }}/")[1].split(")")[0]
+    assert variant_name.endswith(".webp")
+    assert (asset_output / variant_name).read_bytes().endswith(b"png")
+    assert "![notes.txt]({{ site.assets_location }}/" in post
+    # photo.png and other.png have the same content and so the same variant
+    assert len(encoder) == 1
+
+    stats = BuildStats()
+    process_vault(config, full=True, stats=stats)
+    assert len(encoder) == 1
+    assert stats.counters["asset_variants_encoded"] == 0
+
+    # Variants are cached apart from the exported assets
+    os.remove(asset_output / variant_name)
+    process_vault(config, full=True)
+    assert len(encoder) == 1
+    assert (asset_output / variant_name).exists()
+
+
+def test_changed_parameters_produce_new_variants(photo_site, encoder, tmp_path, read_post):
+    vault, posts, config, asset_output = photo_site
+    process_vault(config)
+    first = read_post(posts, "2021-08-21-note.md")
+    config["build"]["asset_transforms"]["png"]["max_width"] = 400
+    process_vault(config)
+
+    assert read_post(posts, "2021-08-21-note.md") != first
+    assert len(encoder) == 2
+    # The unused variant is dropped from the cache
+    assert len(os.listdir(tmp_path / "cache" / "variants")) == 1
+
+
+def test_encoding_processes_are_started_from_the_main_thread(encoder, photo_site, monkeypatch):
+    vault, posts, config, asset_output = photo_site
+    started = []
+
+    class Executor(object):
+        def __init__(self, max_workers, mp_context):
+            started.append((threading.current_thread(), mp_context.get_start_method()))
+
+        def submit(self, fn, *args):
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        def shutdown(self):
+            pass
+
+    monkeypatch.setattr(asset_transforms, "ProcessPoolExecutor", Executor)
+    process_vault(config, jobs=2)
+    assert started == [(threading.main_thread(), "spawn")]
+    assert len(encoder) == 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_images_are_resized_with_pillow(site, tmp_path, jobs, write_note):
+    Image = pytest.importorskip("PIL.Image")
+    vault, posts, config = site
+    Image.new("RGB", (40, 20), "red").save(vault / "attachments" / "photo.png")
+    write_note(vault, "Note", "![[photo.png]]")
+    config["build"]["asset_transforms"] = {"png": {"max_width": 10, "format": "jpeg", "quality": 90}}
+    process_vault(config, jobs=jobs)
+
+    [variant] = os.listdir(tmp_path / "site" / "assets")
+    assert variant.endswith(".jpg")
+    with Image.open(tmp_path / "site" / "assets" / variant) as image:
+        assert (image.format, image.size) == ("JPEG", (10, 5))
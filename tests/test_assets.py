@@ -0,0 +1,69 @@
+import os
+from hashlib import sha256
+
+import pytest
+from obyde import assets
+from obyde.assets import AssetDigestCache, hash_file, write_asset_files
+
+
+@pytest.fixture
+def asset_files(tmp_path):
+    source = tmp_path / "attachments"
+    source.mkdir()
+    files = {
+        "small.txt": b"small",
+        "large.bin": os.urandom(assets.CHUNK_SIZE * 2 + 123),
+        "duplicate.txt": b"small",
+    }
+    for name, data in files.items():
+        (source / name).write_bytes(data)
+    return {name: str(source / name) for name in files}, files
+
+
+def test_hash_file_streams_in_chunks(asset_files):
+    paths, files = asset_files
+    assert hash_file(paths["large.bin"]) == sha256(files["large.bin"]).hexdigest()
+
+
+@pytest.mark.parametrize("copy_mode", assets.ASSET_COPY_MODES)
+def test_write_asset_files_copies_content_addressed_files(asset_files, tmp_path, copy_mode):
+    paths, files = asset_files
+    output = tmp_path / "output"
+    output.mkdir()
+
+    written = write_asset_files(paths, str(output), copy_mode=copy_mode)
+
+    for name, data in files.items():
+        path, hashed_fname = written[name]
+        assert path == paths[name]
+        assert hashed_fname == sha256(data).hexdigest() + os.path.splitext(name)[1]
+        assert (output / hashed_fname).read_bytes() == data
+    assert sorted(os.listdir(output)) == sorted({h for _, h in written.values()})
+
+
+def test_digest_cache_skips_unchanged_files(asset_files, tmp_path, monkeypatch):
+    paths, _ = asset_files
+    cache_path = str(tmp_path / "cache" / "assets.json")
+    output = tmp_path / "output"
+    output.mkdir()
+    cache = AssetDigestCache.load(cache_path)
+    first = write_asset_files(paths, str(output), digest_cache=cache)
+    cache.save(cache_path)
+
+    hashed = []
+    original_hash_file = assets.hash_file
+    monkeypatch.setattr(assets, "hash_file", lambda path: hashed.append(path) or original_hash_file(path))
+    with open(paths["small.txt"], "ab") as fs:
+        fs.write(b" but changed")
+
+    cache = AssetDigestCache.load(cache_path)
+    second = write_asset_files(paths, str(output), digest_cache=cache)
+    assert hashed == [paths["small.txt"]]
+    assert second["large.bin"] == first["large.bin"]
+    assert second["small.txt"] != first["small.txt"]
+
+
+def test_unknown_copy_mode_raises(asset_files, tmp_path):
+    paths, _ = asset_files
+    with pytest.raises(ValueError):
+        write_asset_files(paths, str(tmp_path), copy_mode="teleport")
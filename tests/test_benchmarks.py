@@ -0,0 +1,26 @@
+import os
+
+from benchmarks.run import run_suite
+from benchmarks.synthetic_vault import VaultSpec, generate_vault
+
+
+def test_generate_vault_is_deterministic(tmp_path):
+    spec = VaultSpec(notes=5, attachments=3, attachment_size=64)
+    first = generate_vault(str(tmp_path / "first"), spec)
+    second = generate_vault(str(tmp_path / "second"), spec)
+    first_notes = sorted(os.listdir(first["vault"]["path"]))
+    assert first_notes == sorted(os.listdir(second["vault"]["path"]))
+    assert len([name for name in first_notes if name.endswith(".md")]) == 5
+    assert len(os.listdir(first["vault"]["asset_path"])) == 3
+    for name in first_notes:
+        path = os.path.join(first["vault"]["path"], name)
+        if os.path.isfile(path):
+            with open(path, "rb") as a, open(os.path.join(second["vault"]["path"], name), "rb") as b:
+                assert a.read() == b.read()
+
+
+def test_benchmark_suite_smoke(tmp_path):
+    results = run_suite(str(tmp_path), VaultSpec(notes=5, attachments=3, attachment_size=64), repeat=1)
+    names = [result["name"] for result in results]
+    assert "process_vault_full" in names
+    assert all(result["min_s"] >= 0 for result in results)
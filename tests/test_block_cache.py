@@ -0,0 +1,156 @@
+import os
+import pickle
+
+import pytest
+from obyde import process_vault
+from obyde.block_cache import BLOCK_CACHE_FILENAME, BlockCache
+from obyde.stats import BuildStats
+
+
+calls = []
+
+
+def upper(block):
+    calls.append(block)
+    return block.upper() if "x" in block else None
+
+
+@pytest.fixture(autouse=True)
+def reset_calls():
+    calls.clear()
+
+
+def test_blocks_are_transformed_once_per_run(tmp_path):
+    cache = BlockCache(str(tmp_path / "blocks.sqlite"))
+    transform = cache.cached(upper, "normal", "pipeline")
+
+    assert [transform(block) for block in ["x", "y", "x", "y"]] == ["X", None, "X", None]
+    assert calls == ["x", "y"]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_blocks_are_reused_across_runs_by_pipeline(tmp_path):
+    path = str(tmp_path / "blocks.sqlite")
+    cache = BlockCache(path)
+    cache.cached(upper, "normal", "pipeline")("x")
+    cache.save()
+
+    cache = BlockCache(path)
+    assert cache.cached(upper, "normal", "pipeline")("x") == "X"
+    assert cache.cached(upper, "preformatted", "pipeline")("x") == "X"
+    assert cache.cached(upper, "normal", "other pipeline")("x") == "X"
+    assert calls == ["x", "x", "x"]
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_blocks_are_evicted(tmp_path):
+    path = str(tmp_path / "blocks.sqlite")
+    for block in ["x1", "x2", "x3"]:
+        cache = BlockCache(path, max_bytes=8)
+        transform = cache.cached(upper, "normal", "pipeline")
+        # Using the first block keeps it in the cache
+        transform("x1")
+        transform(block)
+        cache.save()
+
+    cache = BlockCache(path, max_bytes=8)
+    transform = cache.cached(upper, "normal", "pipeline")
+    calls.clear()
+    for block in ["x1", "x2", "x3"]:
+        transform(block)
+    assert calls == ["x2"]
+
+
+def test_blocks_reused_from_memory_are_kept_in_the_file(tmp_path):
+    path = str(tmp_path / "blocks.sqlite")
+    # Room for two blocks of 4 bytes each in the file
+    cache = BlockCache(path, max_bytes=8)
+    transform = cache.cached(upper, "normal", "pipeline")
+    transform("x1")
+    cache.save()
+    transform("x2")
+    cache.save()
+    # Reused from memory, as a later watch build would
+    transform("x1")
+    cache.save()
+    transform("x3")
+    cache.save()
+
+    calls.clear()
+    transform = BlockCache(path, max_bytes=8).cached(upper, "normal", "pipeline")
+    for block in ["x1", "x2", "x3"]:
+        transform(block)
+    assert calls == ["x2"]
+
+
+def test_blocks_kept_in_memory_are_bounded(tmp_path):
+    cache = BlockCache(str(tmp_path / "blocks.sqlite"), max_bytes=8)
+    transform = cache.cached(upper, "normal", "pipeline")
+    for block in ["x1", "x2", "x1", "x3", "x1", "x2"]:
+        transform(block)
+    # Blocks take 4 bytes each, so only the two most recently used are remembered
+    assert calls == ["x1", "x2", "x3", "x2"]
+    assert len(cache._memory) == 2
+
+
+def test_corrupted_cache_is_replaced(tmp_path):
+    path = tmp_path / "blocks.sqlite"
+    path.write_bytes(b"not a database" * 100)
+    cache = BlockCache(str(path))
+    assert cache.cached(upper, "normal", "pipeline")("x") == "X"
+    cache.save()
+    assert BlockCache(str(path)).cached(upper, "normal", "pipeline")("x") == "X"
+    assert calls == ["x"]
+
+
+def test_cache_can_be_handed_to_workers(tmp_path):
+    path = str(tmp_path / "blocks.sqlite")
+    cache = BlockCache(path)
+    cache.cached(upper, "normal", "pipeline")("x")
+    cache.save()
+    cache.cached(upper, "normal", "pipeline")("x")
+
+    worker_cache = pickle.loads(pickle.dumps(cache))
+    worker_cache.cached(upper, "normal", "pipeline")("x")
+    worker_cache.cached(upper, "normal", "pipeline")("xy")
+    cache.merge(worker_cache.take_updates())
+    cache.save()
+
+    assert calls == ["x", "xy"]
+    assert (cache.hits, cache.misses) == (2, 2)
+    assert BlockCache(path).cached(upper, "normal", "pipeline")("xy") == "XY"
+    assert calls == ["x", "xy"]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_process_vault_reuses_cached_blocks(site, jobs, write_note, read_post):
+    vault, posts, config = site
+    config["build"]["block_cache"] = True
+    for i in range(4):
+        write_note(vault, f"Note {i}", "Shared ==template== block.\n\n`code` and ==mark " + str(i) + "==")
+
+    stats = BuildStats()
+    process_vault(config, jobs=jobs, stats=stats)
+    # Each worker transforms the shared block once
+    assert stats.counters["block_cache_misses"] == 4 + min(jobs, 2)
+    assert stats.counters["block_cache_hits"] + stats.counters["block_cache_misses"] == 8
+    assert read_post(posts, "2021-08-21-note-0.md").endswith(
+        "Shared <mark>template</mark> block.\n\n`code` and <mark>mark 0</mark>")
+
+    stats = BuildStats()
+    process_vault(config, full=True, jobs=jobs, stats=stats)
+    assert stats.counters["block_cache_misses"] == 0
+    assert stats.counters["block_cache_hits"] == 8
+    assert os.path.exists(os.path.join(config["build"]["cache_dir"], BLOCK_CACHE_FILENAME))
+
+
+def test_blocks_cached_without_stats_are_reused_with_stats(site, write_note):
+    vault, posts, config = site
+    config["build"]["block_cache"] = True
+    write_note(vault, "Note", "Some ==marked== text.\n\n`code`")
+    process_vault(config)
+
+    stats = BuildStats()
+    process_vault(config, full=True, stats=stats)
+    assert stats.counters["block_cache_misses"] == 0
+    assert stats.counters["block_cache_hits"] == 1
@@ -0,0 +1,61 @@
+import os
+
+import pytest
+import yaml
+from obyde import main
+from obyde.check import check_vault
+
+
+@pytest.fixture
+def vault(tmp_path):
+    vault = tmp_path / "vault"
+    (vault / "attachments").mkdir(parents=True)
+    (tmp_path / "posts").mkdir()
+    (tmp_path / "assets").mkdir()
+    return vault
+
+
+@pytest.fixture
+def config(vault, tmp_path):
+    return {
+        "vault": {"path": str(vault), "asset_path": str(vault / "attachments")},
+        "output": {"post_output_path": str(tmp_path / "posts"), "asset_output_path": str(tmp_path / "assets")},
+    }
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_check_reports_every_problem(vault, config, jobs, write_note):
+    (vault / "attachments" / "image.png").write_bytes(b"png")
+    write_note(vault, "Good", "Links to [[Other#Heading]] and [[image.png]].")
+    write_note(vault, "Other", "Links to [[Missing]] and [[Good#Nowhere]].\n\n# Heading")
+    (vault / "Undated.md").write_text("No frontmatter.", encoding="utf-8")
+    write_note(vault, "Bad Date", "Fine.", date="August")
+    write_note(vault, "Unterminated", "```\ncode")
+    (vault / "nested").mkdir()
+    write_note(vault / "nested", "Good", "Duplicate.")
+
+    problems = check_vault(config, jobs=jobs)
+
+    messages = [(os.path.basename(path), problem) for path, problem in problems]
+    assert len(messages) == 6, messages
+    assert any("Filename collision detected" in problem for _, problem in messages)
+    assert ("Other.md", "Link [[Missing]] does not resolve to a note or an asset.") in messages
+    assert ("Other.md", "Link [[Good#Nowhere]] points to a heading or block which does not exist in good.") in messages
+    assert any(path == "Undated.md" and "does not have a date" in problem for path, problem in messages)
+    assert ("Bad Date.md", "Invalid frontmatter date format! Expected format is YYYY-MM-DD") in messages
+    assert ("Unterminated.md", "Unterminated preformatted content block.") in messages
+
+
+def test_check_writes_nothing_and_exits_with_an_error(vault, config, tmp_path, monkeypatch, capsys, write_note):
+    write_note(vault, "Note", "[[Nowhere]]")
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    monkeypatch.setattr("sys.argv", ["obyde", "-c", str(config_path), "--check"])
+
+    with pytest.raises(SystemExit) as e:
+        main()
+
+    assert e.value.code == 1
+    assert "Link [[Nowhere]] does not resolve" in capsys.readouterr().err
+    assert os.listdir(config["output"]["post_output_path"]) == []
+    assert not os.path.exists(vault / ".obyde")
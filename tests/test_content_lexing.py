@@ -0,0 +1,164 @@
+import random
+from io import StringIO
+
+import pytest
+from obyde.parsing import (NORMAL_SPAN, PREFORMATTED_SPAN, BlockSpan,
+                           ContentBlock, LinkSpan, PreformattedContentBlock,
+                           lex_content, parse_content_blocks)
+from obyde.util import parse_obsidian_links
+
+
+def _substr_cond(s, idx, cond):
+    res = ''
+    count = 0
+    while (idx + count) < len(s):
+        c = s[idx + count]
+        if cond(count, c):
+            res += c
+        else:
+            break
+        count += 1
+    return res
+
+
+def reference_parse_content_blocks(content):
+    # The character by character parser which lex_content replaced. The only deviation is that
+    # tick runs shorter than the opening run inside a preformatted block are kept whole, the
+    # original implementation dropped all but the first tick of such a run.
+    blocks = []
+    state = 'open'
+    quotemult = 0
+    idx = 0
+    buffer = StringIO()
+
+    while idx < len(content):
+        c = content[idx]
+        incr = 1
+        if c == '`':
+            if state == 'open':
+                quotemult = len(_substr_cond(content, idx, lambda _, y: y == '`'))
+                state = 'codestart'
+                incr = quotemult
+                if buffer.tell() > 0:
+                    blocks.append(ContentBlock(content=buffer.getvalue()))
+                    buffer = StringIO()
+            elif state == 'code':
+                tick_mult = _substr_cond(content, idx, lambda _, y: y == '`')
+                ltick = len(tick_mult)
+                incr = ltick if ltick < quotemult else quotemult
+                if incr >= quotemult:
+                    state = 'open'
+                    blocks.append(PreformattedContentBlock(
+                        content=buffer.getvalue(), wrapping_tick_count=quotemult))
+                    buffer = StringIO()
+                    quotemult = 0
+                else:
+                    buffer.write(tick_mult)
+        else:
+            if state == 'codestart':
+                state = 'code'
+            buffer.write(c)
+        idx += incr
+
+    if state == 'code' or state == 'codestart':
+        raise ValueError('Unterminated preformatted content block.')
+
+    final_block = buffer.getvalue()
+    if final_block:
+        blocks.append(ContentBlock(content=final_block))
+    return blocks
+
+
+def reference_parse_obsidian_links(content):
+    # The original link extractor, only used on content without preformatted blocks since it
+    # used to disagree with the block parser on where those start and end.
+    links = []
+    idx = 0
+    while idx < len(content):
+        incr = 1
+        if content[idx] == '[':
+            start_url = _substr_cond(content, idx, (lambda _, y: y == '['))
+            if len(start_url) >= 2:
+                urltext = _substr_cond(
+                    content, idx + len(start_url), lambda _, y: y != ']')
+                if not urltext:
+                    raise ValueError(
+                        f'Hit EOF while parsing obsidian URL at index {idx}')
+                end_url = _substr_cond(
+                    content, idx + len(start_url) + len(urltext), lambda _, y: y == ']')
+                if not end_url:
+                    raise ValueError(
+                        f'Hit EOF while parsing obsidian URL at index {idx}')
+                incr = len(start_url) + len(urltext) + len(end_url)
+                if len(end_url) >= 2:
+                    links.append(start_url + urltext + end_url)
+        idx += incr
+    return links
+
+
+def _outcome(function, content):
+    try:
+        return function(content)
+    except ValueError:
+        return ValueError
+
+
+def _random_documents(alphabet, count=3000, max_length=40, seed=1337):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield ''.join(rng.choice(alphabet) for _ in range(rng.randint(0, max_length)))
+
+
+def test_lexed_blocks_match_reference_parser():
+    for content in _random_documents(['a', ' ', '\n', '`', '`', '[', ']', '=']):
+        assert _outcome(parse_content_blocks, content) == _outcome(
+            reference_parse_content_blocks, content), repr(content)
+
+
+def test_lexed_links_match_reference_extractor():
+    for content in _random_documents(['a', ' ', '|', '!', '[', '[', ']', ']']):
+        assert _outcome(parse_obsidian_links, content) == _outcome(
+            reference_parse_obsidian_links, content), repr(content)
+
+
+def test_lex_spans():
+    content = "A [[link]] then `code with [[no link]]` and ```x``y``` ok [[b|c]]"
+    lexed = lex_content(content)
+    assert lexed.blocks == [
+        BlockSpan(NORMAL_SPAN, 0, 16, 0),
+        BlockSpan(PREFORMATTED_SPAN, 17, 38, 1),
+        BlockSpan(NORMAL_SPAN, 39, 44, 0),
+        BlockSpan(PREFORMATTED_SPAN, 47, 51, 3),
+        BlockSpan(NORMAL_SPAN, 54, len(content), 0),
+    ]
+    assert lexed.links == [LinkSpan(2, 10), LinkSpan(58, 65)]
+    assert [content[link.start:link.end]
+            for link in lexed.links] == ["[[link]]", "[[b|c]]"]
+
+
+def test_links_are_not_extracted_from_preformatted_blocks():
+    content = "```[[one]]``` [[two]] ``x`[[three]]`` [[four]]"
+    assert parse_obsidian_links(content) == ["[[two]]", "[[four]]"]
+
+
+def test_link_running_into_preformatted_block_is_ignored():
+    assert parse_obsidian_links("[[never closed `code` here]]") == []
+
+
+@pytest.mark.parametrize("content", ["text [[", "text [[unterminated", "[[]]"])
+def test_malformed_links_raise(content):
+    with pytest.raises(ValueError):
+        parse_obsidian_links(content)
+
+
+@pytest.mark.parametrize("content", ["`", "text ```", "```code``", "`a` ``b"])
+def test_unterminated_preformatted_block_raises(content):
+    with pytest.raises(ValueError, match="Unterminated preformatted content block"):
+        parse_content_blocks(content)
+
+
+def test_lexing_is_linear_on_long_tick_runs():
+    content = "``" * 50000 + "x" + "`" * 100000
+    blocks = parse_content_blocks(content)
+    assert len(blocks) == 1
+    assert blocks[0].wrapping_tick_count == 100000
@@ -0,0 +1,84 @@
+import os
+import pickle
+
+import pytest
+from obyde.discovery import find_files, scan_vault
+
+
+def touch(path, content="x"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content, encoding="utf-8")
+    return path
+
+
+@pytest.fixture
+def vault(tmp_path):
+    root = tmp_path / "vault"
+    touch(root / "Top.md")
+    touch(root / "nested" / "Nested.md")
+    touch(root / "attachments" / "image.png")
+    touch(root / "attachments" / "sub" / "diagram.svg")
+    touch(root / ".trash" / "Deleted.md")
+    touch(root / "archive" / "2019" / "Old.md")
+    touch(root / "archive" / "keep.txt")
+    return root
+
+
+def test_scan_classifies_notes_and_assets_in_one_walk(vault):
+    scan = scan_vault(str(vault), str(vault / "attachments"), exclusions=[".trash", "archive/*"])
+    assert scan.notes == {"Top.md": str(vault / "Top.md"), "Nested.md": str(vault / "nested" / "Nested.md")}
+    assert scan.assets == {"image.png": str(vault / "attachments" / "image.png"),
+                           "diagram.svg": str(vault / "attachments" / "sub" / "diagram.svg")}
+    assert scan.stat(scan.assets["image.png"]).st_size == 1
+
+
+def test_excluded_directories_are_not_read(vault, monkeypatch):
+    scanned = []
+    original_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scanned.append(path) or original_scandir(path))
+    scan_vault(str(vault), str(vault / "attachments"), exclusions=[".trash", "arch*"])
+    assert str(vault / ".trash") not in scanned
+    assert not any(path.startswith(str(vault / "archive")) for path in scanned)
+
+
+def test_asset_directory_inside_an_excluded_directory_is_still_scanned(vault):
+    touch(vault / "private" / "attachments" / "photo.jpg")
+    touch(vault / "private" / "Secret.md")
+    scan = scan_vault(str(vault), str(vault / "private" / "attachments"), exclusions=["private"])
+    assert "Secret.md" not in scan.notes
+    assert list(scan.assets) == ["photo.jpg"]
+
+
+def test_asset_directory_outside_the_vault(vault, tmp_path):
+    touch(tmp_path / "shared" / "Readme.md")
+    scan = scan_vault(str(vault), str(tmp_path / "shared"))
+    assert scan.assets == {"Readme.md": str(tmp_path / "shared" / "Readme.md")}
+    assert "Readme.md" not in scan.notes
+
+
+def test_ignored_directories_are_not_scanned_for_assets(vault):
+    touch(vault / ".obyde" / "manifest.json")
+    touch(vault / ".obyde" / "variants" / "variant.png")
+    scan = scan_vault(str(vault), str(vault), exclusions=[".trash", "archive/*"], ignored_dirs=[str(vault / ".obyde")])
+    assert "manifest.json" not in scan.assets and "variant.png" not in scan.assets
+    assert "image.png" in scan.assets
+    assert str(vault / ".obyde") not in scan.directories
+
+
+def test_all_collisions_are_reported(vault):
+    touch(vault / "other" / "Top.md")
+    touch(vault / "other" / "Nested.md")
+    with pytest.raises(ValueError) as e:
+        scan_vault(str(vault), str(vault / "attachments"))
+    assert "Top.md" in str(e.value) and "Nested.md" in str(e.value)
+
+
+def test_scan_pickles_without_directory_entries(vault):
+    scan = scan_vault(str(vault), str(vault / "attachments"))
+    restored = pickle.loads(pickle.dumps(scan))
+    assert restored.notes == scan.notes and restored.entries == {}
+    assert restored.stat(restored.assets["image.png"]).st_size == 1
+
+
+def test_find_files_keeps_prefix_exclusions(vault):
+    assert set(find_files(str(vault), ext=".md", exclusions=[".trash", "archive/2019/"])) == {"Top.md", "Nested.md"}
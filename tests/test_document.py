@@ -0,0 +1,39 @@
+import hashlib
+
+import pytest
+from obyde.document import NoteDocument, read_note_index
+
+def test_metadata_text_is_emitted_once(monkeypatch):
+    document = NoteDocument.loads("---\ndate: 2021-08-21\n---\nbody")
+    exports = []
+    original_export = document.handler.export
+    monkeypatch.setattr(document.handler, "export",
+                        lambda metadata: exports.append(metadata) or original_export(metadata))
+    document.metadata_section()
+    document.dumps()
+    assert document.dumps() == "---\ndate: 2021-08-21\n---\n\nbody"
+    assert len(exports) == 1
+
+
+def assert_note_index_matches_full_parse(path, text):
+    path.write_bytes(text.encode("utf-8"))
+    metadata, digest, body = read_note_index(str(path))
+    document = NoteDocument.load(str(path))
+    assert metadata == document.metadata
+    assert digest == hashlib.sha256(text.encode("utf-8")).hexdigest()
+    assert body.strip() == document.content.strip()
+
+
+def test_note_index_matches_full_parse(tmp_path, note_text):
+    assert_note_index_matches_full_parse(tmp_path / "note.md", note_text)
+
+
+@pytest.mark.parametrize("text", [
+    "---\ndate: 2021-08-21\nno closing boundary\n",
+    "   \n  ---\ndate: 2021-08-21\n---\nIndented opening boundary\n",
+    "{\n\"date\": \"2021-08-21\"\n}\nJSON frontmatter\n",
+    "---\n- a list\n---\nNot a mapping\n",
+    "\n# Heading without frontmatter\n",
+])
+def test_note_index_matches_full_parse_of_edge_cases(tmp_path, text):
+    assert_note_index_matches_full_parse(tmp_path / "note.md", text)
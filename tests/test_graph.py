@@ -0,0 +1,51 @@
+import json
+
+from obyde import process_vault
+from obyde.graph import link_graph
+from obyde.manifest import BuildManifest
+from obyde.stats import BuildStats
+
+
+def test_link_graph_from_manifest_records():
+    manifest = BuildManifest('fingerprint', {
+        'a': {'links': {'B': ['note', 'b', 'url'], 'B#Part': ['note', 'b', 'url#part', None],
+                        '#Own': ['note', 'a', '#own', None], 'image.png': ['asset', 'image.png', '/x'],
+                        'Missing': None}},
+        'b': {'links': {'A': ['note', 'a', 'url']}},
+        'c': {'links': {'B': ['note', 'b', 'url']}},
+    })
+    dated_files = {slug: (f'2021-08-21-{slug}', None, None) for slug in 'abc'}
+
+    graph = link_graph(manifest, dated_files, {'image.png': ('/vault/image.png', 'aaaa.png')})
+
+    assert graph == {
+        'posts': {'a': '2021-08-21-a', 'b': '2021-08-21-b', 'c': '2021-08-21-c'},
+        'links': {'a': ['b'], 'b': ['a'], 'c': ['b']},
+        'backlinks': {'a': ['b'], 'b': ['a', 'c']},
+        'assets': {'a': ['aaaa.png']},
+        'unresolved': {'a': ['Missing']},
+    }
+
+
+def test_link_graph_is_written_for_every_build(site, tmp_path, write_note):
+    vault, posts, config = site
+    graph_path = tmp_path / "site" / "_data" / "links.json"
+    write_note(vault, "First Note", "Links to [[Second Note]] and [[Nowhere]].")
+    second = write_note(vault, "Second Note", "Nothing here.", date="2021-08-22")
+    process_vault(config)
+    manifest = (tmp_path / "cache" / "manifest.json").read_bytes()
+
+    # Adding the graph does not render anything again
+    config["output"]["link_graph_path"] = str(graph_path)
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+    assert stats.counters["notes_rendered"] == 0
+    graph = json.loads(graph_path.read_text(encoding="utf-8"))
+    assert graph["backlinks"] == {"second-note": ["first-note"]}
+    assert graph["unresolved"] == {"first-note": ["Nowhere"]}
+    assert (tmp_path / "cache" / "manifest.json").read_bytes() == manifest
+
+    second.write_text("---\ndate: 2021-08-22\n---\nBack to [[First Note]].", encoding="utf-8")
+    process_vault(config)
+    graph = json.loads(graph_path.read_text(encoding="utf-8"))
+    assert graph["backlinks"] == {"first-note": ["second-note"], "second-note": ["first-note"]}
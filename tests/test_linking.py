@@ -0,0 +1,86 @@
+import pytest
+from obyde.linking import Resolution, rewrite_links, split_fragment
+
+
+@pytest.mark.parametrize("target,expected", [
+    ('image.png', Resolution('asset', 'image.png', '/assets/aaaa.png')),
+    ('drawings/diagram.svg', Resolution('asset', 'diagram.svg', '/assets/bbbb.svg')),
+    ('diagram', Resolution('asset', 'diagram.svg', '/assets/bbbb.svg')),
+    ('First Note', Resolution('note', 'first-note', '{% post_url 2021-08-21-first-note %}')),
+    ('folder/Nested', Resolution('note', 'nested', '{% post_url 2021-08-22-nested %}')),
+    ('other/diagram.svg', None),
+    ('Missing', None),
+])
+def test_indexed_resolution(target, expected, make_resolver):
+    assert make_resolver().resolve(target) == expected
+
+
+def test_substring_resolution_keeps_original_semantics(make_resolver):
+    resolver = make_resolver(mode='substring')
+    # The note link matches an asset that contains its name
+    assert resolver.resolve('first note') == Resolution(
+        'asset', 'image of first note.png', '/assets/cccc.png')
+    assert make_resolver().resolve('first note') == Resolution(
+        'note', 'first-note', '{% post_url 2021-08-21-first-note %}')
+
+
+def test_unknown_resolution_mode_raises(make_resolver):
+    with pytest.raises(ValueError):
+        make_resolver(mode='fuzzy')
+
+
+def test_rewrite_links_replaces_each_link_span_once(make_resolver):
+    content = "[[First Note|first]] and `[[First Note]]` and ![[image.png]] but not [[Missing]]."
+    resolved = {}
+    rewritten = rewrite_links(content, make_resolver(), resolved_links=resolved)
+    assert rewritten == ("[first]({% post_url 2021-08-21-first-note %}) and `[[First Note]]` "
+                         "and ![image.png](/assets/aaaa.png) but not [[Missing]].")
+    assert resolved == {
+        'First Note': Resolution('note', 'first-note', '{% post_url 2021-08-21-first-note %}'),
+        'image.png': Resolution('asset', 'image.png', '/assets/aaaa.png'),
+        'Missing': None,
+    }
+
+
+@pytest.mark.parametrize("target,expected", [
+    ('First Note', ('First Note', None)),
+    ('First Note#Setup', ('First Note', 'Setup')),
+    ('First Note#^summary', ('First Note', '^summary')),
+    ('First Note^summary', ('First Note', '^summary')),
+    ('#Setup', ('', 'Setup')),
+    ('First Note#', ('First Note', None)),
+])
+def test_split_fragment(target, expected):
+    assert split_fragment(target) == expected
+
+
+@pytest.mark.parametrize("target,url", [
+    ('First Note#setup', '{% post_url 2021-08-21-first-note %}#setup'),
+    ('First Note#Step 1 Install', '{% post_url 2021-08-21-first-note %}#step-1-install'),
+    ('First Note#Setup#Step 1: Install', '{% post_url 2021-08-21-first-note %}#step-1-install'),
+    ('First Note#^summary', '{% post_url 2021-08-21-first-note %}#summary'),
+    ('image.png#right', '/assets/aaaa.png#right'),
+])
+def test_fragments_resolve_to_anchors(target, url, make_resolver):
+    assert make_resolver().resolve(target).url == url
+
+
+def test_hugo_fragments_are_part_of_the_relref(make_resolver):
+    assert make_resolver(post_link_mode='hugo').resolve('First Note#Setup').url == \
+        '{{< relref "2021-08-21-first-note#setup" >}}'
+
+
+def test_missing_fragments_link_to_the_note(make_resolver):
+    resolver = make_resolver()
+    assert resolver.resolve('First Note#Nowhere') == Resolution(
+        'note', 'first-note', '{% post_url 2021-08-21-first-note %}', 'Nowhere')
+    assert resolver.resolve('Nested#^summary').missing_fragment == '^summary'
+
+
+def test_same_note_fragments_depend_on_the_linking_note(make_resolver):
+    resolver = make_resolver()
+    assert resolver.resolve('#Setup', 'first-note') == Resolution('note', 'first-note', '#setup')
+    assert resolver.resolve('#Setup', 'nested') == Resolution('note', 'nested', '', 'Setup')
+    assert resolver.resolve('#Setup') is None
+    content = "[[#Setup|setup]] and [[#Nowhere]]"
+    assert rewrite_links(content, resolver, source='first-note') == "[setup](#setup) and [[#Nowhere]]"
@@ -0,0 +1,268 @@
+import json
+import os
+from hashlib import sha256
+
+import obyde
+import pytest
+import yaml
+from obyde import main, process_vault
+from obyde.stats import BuildStats
+
+
+def test_process_vault_renders_posts_and_links(site, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "First Note", "Links to [[Second Note|the second]] and ==marks== it.")
+    write_note(vault, "Second Note", "Nothing here.", date="2021-08-22")
+
+    process_vault(config)
+
+    assert read_post(posts, "2021-08-21-first-note.md") == (
+        "---\ndate: 2021-08-21\n---\n\n"
+        "Links to [the second]({% post_url 2021-08-22-second-note %}) and <mark>marks</mark> it.")
+    assert read_post(posts, "2021-08-22-second-note.md") == "---\ndate: 2021-08-22\n---\n\nNothing here."
+
+
+def test_incremental_build_skips_unchanged_notes(site, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "First Note", "Unchanged.")
+    write_note(vault, "Second Note", "Before.")
+    process_vault(config)
+
+    # A sentinel proves that the unchanged note is not written again
+    (posts / "2021-08-21-first-note.md").write_text("sentinel", encoding="utf-8")
+    write_note(vault, "Second Note", "After.")
+    process_vault(config)
+
+    assert read_post(posts, "2021-08-21-first-note.md") == "sentinel"
+    assert read_post(posts, "2021-08-21-second-note.md").endswith("After.")
+
+
+def test_incremental_build_rerenders_notes_with_changed_link_targets(site, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "Linking", "See [[Target]].")
+    process_vault(config)
+    assert read_post(posts, "2021-08-21-linking.md").endswith("See [[Target]].")
+
+    write_note(vault, "Target", "Now exists.", date="2021-09-01")
+    process_vault(config)
+    assert read_post(posts, "2021-08-21-linking.md").endswith(
+        "See [Target]({% post_url 2021-09-01-target %}).")
+
+    os.remove(vault / "Target.md")
+    write_note(vault, "Target", "Moved.", date="2021-10-01")
+    process_vault(config)
+    assert read_post(posts, "2021-08-21-linking.md").endswith(
+        "See [Target]({% post_url 2021-10-01-target %}).")
+
+
+def test_full_build_ignores_manifest(site, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "Note", "Body.")
+    process_vault(config)
+
+    (posts / "2021-08-21-note.md").write_text("sentinel", encoding="utf-8")
+    process_vault(config, full=True)
+    assert read_post(posts, "2021-08-21-note.md").endswith("Body.")
+
+
+def test_parallel_rendering_matches_serial_rendering(site, tmp_path, write_note):
+    vault, posts, config = site
+    for i in range(12):
+        write_note(vault, f"Note {i}", f"Links to [[Note {(i + 1) % 12}]] with ==mark {i}==.")
+    process_vault(config, full=True)
+    serial = {p.name: p.read_bytes() for p in posts.iterdir()}
+
+    for p in posts.iterdir():
+        p.unlink()
+    process_vault(config, full=True, jobs=3)
+    assert {p.name: p.read_bytes() for p in posts.iterdir()} == serial
+
+
+def test_render_errors_are_reported_per_note(site, write_note):
+    vault, posts, config = site
+    write_note(vault, "Good", "Fine.")
+    write_note(vault, "Bad One", "Broken `code.")
+    write_note(vault, "Bad Two", "Broken [[link.")
+
+    with pytest.raises(ValueError) as e:
+        process_vault(config, jobs=2)
+    message = str(e.value)
+    assert "Failed to render 2 note(s)" in message
+    assert str(vault / "Bad One.md") in message
+    assert str(vault / "Bad Two.md") in message
+    assert (posts / "2021-08-21-good.md").exists()
+
+
+def test_referenced_asset_export_and_garbage_collection(site, write_note, read_post):
+    vault, posts, config = site
+    attachments = vault / "attachments"
+    (attachments / "used.png").write_bytes(b"used")
+    (attachments / "unused.png").write_bytes(b"unused")
+    asset_output = config["output"]["asset_output_path"]
+    stale = os.path.join(asset_output, "0" * 64 + ".png")
+    unrelated = os.path.join(asset_output, "style.css")
+    for path in (stale, unrelated):
+        with open(path, "w") as fs:
+            fs.write("old")
+    config["build"].update({"export_assets": "referenced", "gc_assets": True})
+    write_note(vault, "Note", "![[used.png]]")
+
+    stats = BuildStats()
+    summary = process_vault(config, stats=stats)
+
+    used_fname = sha256(b"used").hexdigest() + ".png"
+    assert sorted(os.listdir(asset_output)) == sorted([used_fname, "style.css"])
+    assert read_post(posts, "2021-08-21-note.md").endswith(
+        f"![used.png]({{{{ site.assets_location }}}}/{used_fname})")
+    assert summary == ["Exported 1 of 2 assets, skipped 6 bytes of unreferenced assets.",
+                       f"Deleted 1 unreferenced assets (3 bytes) from {asset_output}."]
+    assert (stats.counters["assets_skipped"], stats.counters["bytes_skipped"]) == (1, 6)
+    assert (stats.counters["assets_deleted"], stats.counters["bytes_deleted"]) == (1, 3)
+
+
+def test_build_stats_count_stages_links_and_transformed_blocks(site, write_note):
+    vault, posts, config = site
+    (vault / "attachments" / "image.png").write_bytes(b"png")
+    write_note(vault, "First Note", "==marked== [[Second Note]] [[image.png]] [[Missing]]")
+    write_note(vault, "Second Note", "Plain.")
+
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+
+    assert {"discover", "read", "plan", "render", "render.transform", "render.rewrite_links"} <= set(stats.stages)
+    assert stats.counters["notes_scanned"] == 2
+    assert stats.counters["assets_scanned"] == 1
+    assert stats.counters["links_resolved"] == 2
+    assert stats.counters["links_unresolved"] == 1
+    assert stats.counters["transformed_blocks.ObsidianHighlightRewritingTransformer"] == 1
+    assert stats.counters["bytes_hashed"] >= 3
+    assert [path for path, _ in stats.slowest_notes()] and len(stats.slowest_notes()) == 2
+
+
+def test_parallel_build_stats_are_merged_from_workers(site, tmp_path, write_note):
+    vault, posts, config = site
+    for i in range(4):
+        write_note(vault, f"Note {i}", f"Links to [[Note {(i + 1) % 4}]].")
+
+    stats = BuildStats()
+    process_vault(config, jobs=2, stats=stats)
+    stats.save_json(str(tmp_path / "stats.json"))
+
+    report = json.loads((tmp_path / "stats.json").read_text())
+    assert report["counters"]["links_resolved"] == 4
+    assert report["stages"]["render.write"]["calls"] == 4
+    assert len(report["slowest_notes"]) == 4
+    assert "Slowest notes:" in stats.format_report()
+
+
+def test_unchanged_notes_are_not_read_again(site, monkeypatch, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "First Note", "Unchanged.")
+    touched = write_note(vault, "Second Note", "Touched.")
+    process_vault(config)
+
+    headers_read = []
+    original_read_note_index = obyde.read_note_index
+    monkeypatch.setattr(obyde, "read_note_index",
+                        lambda path: headers_read.append(path) or original_read_note_index(path))
+    stat = touched.stat()
+    os.utime(touched, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    (posts / "2021-08-21-second-note.md").write_text("sentinel", encoding="utf-8")
+    process_vault(config)
+
+    # The touched note is hashed again, but its content did not change so it is not rendered
+    assert headers_read == [str(touched)]
+    assert read_post(posts, "2021-08-21-second-note.md") == "sentinel"
+    process_vault(config)
+    assert headers_read == [str(touched)]
+
+
+def test_identical_outputs_are_not_rewritten(site, write_note):
+    vault, posts, config = site
+    write_note(vault, "Note", "Body.")
+    process_vault(config)
+    post = posts / "2021-08-21-note.md"
+    os.utime(post, ns=(0, 0))
+
+    stats = BuildStats()
+    process_vault(config, full=True, stats=stats)
+
+    assert post.stat().st_mtime_ns == 0
+    assert stats.counters["posts_unchanged"] == 1
+    assert not [name for name in os.listdir(posts) if name.endswith(".tmp")]
+
+
+def test_stale_posts_are_pruned(site, write_note):
+    vault, posts, config = site
+    config["build"]["prune_posts"] = True
+    write_note(vault, "Kept", "Body.")
+    write_note(vault, "Redated", "Body.")
+    removed = write_note(vault, "Removed", "Body.")
+    (posts / "hand-written.md").write_text("Not from obyde.", encoding="utf-8")
+    process_vault(config)
+
+    os.remove(removed)
+    write_note(vault, "Redated", "Body.", date="2021-09-01")
+    summary = process_vault(config, full=True)
+
+    assert sorted(os.listdir(posts)) == [
+        "2021-08-21-kept.md", "2021-09-01-redated.md", "hand-written.md"]
+    assert summary == [f"Pruned 2 stale posts from {posts}."]
+
+
+def test_main_prints_the_build_summary(site, tmp_path, monkeypatch, capsys, write_note):
+    vault, posts, config = site
+    config["build"]["gc_assets"] = True
+    write_note(vault, "Note", "Body.")
+    config_path = tmp_path / "config.yaml"
+    config_path.write_text(yaml.safe_dump(config))
+    monkeypatch.setattr("sys.argv", ["obyde", "-c", str(config_path)])
+
+    process_vault(config)
+    assert capsys.readouterr().out == ""
+    main()
+    asset_output = config["output"]["asset_output_path"]
+    assert capsys.readouterr().out == f"Deleted 0 unreferenced assets (0 bytes) from {asset_output}.\n"
+
+
+def test_links_to_headings_and_blocks(site, capsys, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "First Note", "See [[Second Note#Part Two|part two]], [[Second Note#^key]], [[#Own]] "
+                                    "and [[Second Note#Missing]].\n\n# Own")
+    second = write_note(vault, "Second Note", "# Part Two\nA key point. ^key", date="2021-08-22")
+
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+
+    assert read_post(posts, "2021-08-21-first-note.md").endswith(
+        "See [part two]({% post_url 2021-08-22-second-note %}#part-two), "
+        "[Second Note#^key]({% post_url 2021-08-22-second-note %}#key), [#Own](#own) "
+        "and [Second Note#Missing]({% post_url 2021-08-22-second-note %}).\n\n# Own")
+    assert stats.counters["link_fragments_missing"] == 1
+    assert "Link [[Second Note#Missing]] points to a heading or block which does not exist in second-note." \
+        in capsys.readouterr().err
+
+    # The linking note did not change, but the heading it links to now exists
+    second.write_text("---\ndate: 2021-08-22\n---\n# Part Two\nA key point. ^key\n# Missing\n", encoding="utf-8")
+    process_vault(config)
+    assert read_post(posts, "2021-08-21-first-note.md").endswith(
+        "and [Second Note#Missing]({% post_url 2021-08-22-second-note %}#missing).\n\n# Own")
+    assert "Warning" not in capsys.readouterr().err
+
+
+def test_cache_files_are_not_exported_from_an_asset_path_at_the_vault_root(site, write_note):
+    vault, posts, config = site
+    config["vault"]["asset_path"] = str(vault)
+    # The cache goes to the default .obyde directory in the vault
+    del config["build"]["cache_dir"]
+    (vault / "image.png").write_bytes(b"png")
+    write_note(vault, "Note", "![[image.png]]")
+    asset_output = config["output"]["asset_output_path"]
+
+    process_vault(config)
+    assert os.path.exists(vault / ".obyde" / "manifest.json")
+    exported = sorted(os.listdir(asset_output))
+    process_vault(config)
+    process_vault(config, full=True)
+    assert sorted(os.listdir(asset_output)) == exported
+    assert sorted(os.path.splitext(name)[1] for name in exported) == [".md", ".png"]
@@ -0,0 +1,114 @@
+import os
+import re
+
+import frontmatter
+import obyde.rendering as rendering
+import pytest
+from obyde.document import NoteDocument
+from obyde.linking import rewrite_links
+from obyde.parsing import parse_content_blocks
+from obyde.rendering import PostWriter, document_transformer, stream_posts
+from obyde.rewriting import RewritingEngine, RewritingPipeline
+from obyde.rewriting.highlight import ObsidianHighlightRewritingTransformer
+
+LINK_NOTES = [
+    "---\ndate: 2021-08-21\n---\n[[First Note]] ==x== `[[image.png]]` [[Missing]]\n\n![[image.png]]  \n",
+    "---\ndate: 2021-08-21\nfind:\n  - Note\nreplace:\n  - Nope\n---\n[[First Note]] and [[Missing`code`",
+    "---\ndate: 2021-08-21\n---\n" + "A ==long== line with [[First Note]] and `code`.\n" * 200,
+]
+
+
+def find_replace(content, metadata):
+    find_list = metadata.get("find")
+    replace_list = metadata.get("replace")
+    if not (find_list and replace_list):
+        return content
+    for find, replace in zip(find_list, replace_list):
+        content = re.sub(re.compile(find), replace, content)
+    return content
+
+
+def legacy_render(text, resolver):
+    # The frontmatter round trips which NoteDocument and streaming replace
+    post = frontmatter.loads(text)
+    post = frontmatter.loads(find_replace(frontmatter.dumps(post), post.metadata))
+    post_content = post.content
+    post.content = ""
+    engine = RewritingEngine(RewritingPipeline([ObsidianHighlightRewritingTransformer()]))
+    post_metadata, post_content = engine.rewrite(
+        frontmatter.dumps(post), parse_content_blocks(post_content))
+    post = frontmatter.loads("\n".join([post_metadata, post_content]))
+    post.content = rewrite_links(post.content, resolver)
+    return frontmatter.dumps(post)
+
+
+def render_streamed(text, resolver):
+    document = NoteDocument.loads(text.encode("utf-8"))
+    transformer = document_transformer(
+        RewritingPipeline([ObsidianHighlightRewritingTransformer()]), document)
+    pieces = []
+    stream_posts(RewritingEngine(transformer), document, [(pieces.append, resolver, None)])
+    return pieces
+
+
+@pytest.mark.parametrize("chunk_size", [64 * 1024, 16])
+def test_streamed_post_matches_frontmatter_round_trips(note_text, chunk_size, monkeypatch, make_resolver):
+    monkeypatch.setattr(rendering, "STREAM_CHUNK_SIZE", chunk_size)
+    assert "".join(render_streamed(note_text, make_resolver())) == legacy_render(note_text, make_resolver())
+
+
+@pytest.mark.parametrize("chunk_size", [64 * 1024, 16])
+@pytest.mark.parametrize("text", LINK_NOTES)
+def test_streamed_links_match_frontmatter_round_trips(text, chunk_size, monkeypatch, make_resolver):
+    monkeypatch.setattr(rendering, "STREAM_CHUNK_SIZE", chunk_size)
+    assert "".join(render_streamed(text, make_resolver())) == legacy_render(text, make_resolver())
+
+
+def test_streamed_post_is_written_in_pieces(monkeypatch, make_resolver):
+    monkeypatch.setattr(rendering, "STREAM_CHUNK_SIZE", 1024)
+    pieces = render_streamed(LINK_NOTES[-1], make_resolver())
+    assert len(pieces) > 5
+    assert max(len(piece) for piece in pieces) < 2048
+
+
+def test_unterminated_link_at_the_end_still_fails(make_resolver):
+    with pytest.raises(ValueError):
+        render_streamed("---\ndate: 2021-08-21\n---\nText ==x== `code` and [[First", make_resolver())
+
+
+def write_post(path, pieces):
+    with PostWriter(str(path)) as writer:
+        for piece in pieces:
+            writer.write(piece)
+        return writer.close()
+
+
+@pytest.mark.parametrize("existing,pieces,written", [
+    (None, ["new ", "post"], True),
+    ("same post", ["same ", "post"], False),
+    ("same post", ["same ", "pots"], True),
+    ("same post", ["same"], True),
+    ("same", ["same ", "post"], True),
+])
+def test_post_writer_only_replaces_changed_posts(tmp_path, existing, pieces, written):
+    path = tmp_path / "post.md"
+    if existing is not None:
+        path.write_text(existing)
+        os.utime(path, ns=(0, 0))
+
+    assert write_post(path, pieces) == written
+
+    assert path.read_text() == "".join(pieces)
+    assert (path.stat().st_mtime_ns != 0) == written
+    assert os.listdir(tmp_path) == ["post.md"]
+
+
+def test_post_writer_keeps_the_existing_post_on_failure(tmp_path):
+    path = tmp_path / "post.md"
+    path.write_text("old post")
+    with pytest.raises(RuntimeError):
+        with PostWriter(str(path)) as writer:
+            writer.write("new post")
+            raise RuntimeError()
+    assert path.read_text() == "old post"
+    assert os.listdir(tmp_path) == ["post.md"]
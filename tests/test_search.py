@@ -0,0 +1,109 @@
+import json
+
+import pytest
+from obyde import process_vault
+from obyde.document import NoteDocument
+from obyde.search import SearchTokenizer, build_search_index
+from obyde.stats import BuildStats
+
+
+def test_tokenizer_skips_preformatted_blocks_links_and_stopwords():
+    tokenizer = SearchTokenizer()
+    content = ("The Quick fox, the quick [dog](https://example.com/page) and `inline code`.\n"
+               "```\nfenced block\n```\nSee https://example.org too. A x.")
+    assert tokenizer.note_terms("Fox notes", content) == {
+        "fox": 2, "notes": 1, "quick": 2, "dog": 1, "see": 1}
+
+
+def test_tokenizer_keeps_only_the_shown_text_of_wiki_links():
+    tokenizer = SearchTokenizer()
+    content = "See [[Secret Target Name|alias]], [[Plain Note]] and ![[diagram.png]]. `[[Code Link]]`"
+    assert tokenizer.note_terms("", content) == {"see": 1, "alias": 1, "plain": 1, "note": 1, "diagram": 1, "png": 1}
+
+
+def test_tokenizer_options():
+    tokenizer = SearchTokenizer({"stopwords": ["fox"], "min_term_length": 1})
+    assert tokenizer.note_terms("", "The fox and a x") == {"the": 1, "and": 1, "a": 1, "x": 1}
+    assert SearchTokenizer({"stopwords": None}).note_terms("", "the fox") == {"the": 1, "fox": 1}
+    with pytest.raises(ValueError, match='Unknown search option "stem"'):
+        SearchTokenizer({"stem": "english"})
+
+
+def test_tokenizer_title_defaults_to_the_filename():
+    document = NoteDocument({"date": "2021-08-21"}, "Body text")
+    assert SearchTokenizer().document_terms(document, "/vault/Field Note.md") == (
+        "Field Note", {"field": 1, "note": 1, "body": 1, "text": 1})
+
+
+def test_stemming():
+    pytest.importorskip("snowballstemmer")
+    tokenizer = SearchTokenizer({"stemming": "english"})
+    assert tokenizer.note_terms("", "running runs") == {"run": 2}
+
+
+def test_search_index_prunes_rare_terms_to_fit_the_budget():
+    documents = [
+        ("a", "2021-08-21-a", "A", {"common": 3, "rare": 1}),
+        ("b", "2021-08-21-b", "B", {"common": 1, "other": 2}),
+    ]
+    index, pruned = build_search_index(documents)
+    assert index == {
+        "docs": [["a", "2021-08-21-a", "A"], ["b", "2021-08-21-b", "B"]],
+        "terms": {"common": [0, 3, 1, 1], "rare": [0, 1], "other": [1, 2]},
+    }
+    assert pruned == 0
+    budget = len(json.dumps(index, separators=(",", ":"))) - 1
+    index, pruned = build_search_index(documents, budget)
+    assert list(index["terms"]) == ["common", "other"]
+    assert pruned == 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_search_index_is_built_from_rendered_notes_and_the_term_cache(site, tmp_path, jobs, write_note):
+    vault, posts, config = site
+    index_path = tmp_path / "site" / "assets" / "search.json"
+    write_note(vault, "First Note", "Foxes jump over [[Second Note]].")
+    second = write_note(vault, "Second Note", "Dogs sleep.", date="2021-08-22")
+    process_vault(config, jobs=jobs)
+
+    # Search does not affect posts, so configuring it only tokenises the notes
+    config["output"]["search_index_path"] = str(index_path)
+    stats = BuildStats()
+    process_vault(config, jobs=jobs, stats=stats)
+    assert stats.counters["notes_rendered"] == 0
+    assert stats.counters["search_notes_read"] == 2
+    index = json.loads(index_path.read_text(encoding="utf-8"))
+    assert index["docs"] == [["first-note", "2021-08-21-first-note", "First Note"],
+                             ["second-note", "2021-08-22-second-note", "Second Note"]]
+    assert index["terms"]["foxes"] == [0, 1]
+    assert index["terms"]["second"] == [0, 1, 1, 1]
+
+    second.write_text("---\ndate: 2021-08-22\ntitle: Hounds\n---\nDogs and foxes sleep.", encoding="utf-8")
+    stats = BuildStats()
+    process_vault(config, jobs=jobs, stats=stats)
+    assert "search_notes_read" not in stats.counters
+    index = json.loads(index_path.read_text(encoding="utf-8"))
+    assert index["docs"][1] == ["second-note", "2021-08-22-second-note", "Hounds"]
+    assert index["terms"]["foxes"] == [0, 1, 1, 1]
+    assert index["terms"]["second"] == [0, 1]
+
+
+def test_unchanged_search_index_is_not_rebuilt(site, tmp_path, write_note):
+    vault, posts, config = site
+    index_path = tmp_path / "site" / "search.json"
+    config["output"]["search_index_path"] = str(index_path)
+    write_note(vault, "First Note", "Foxes jump.")
+    process_vault(config)
+    index = index_path.read_text(encoding="utf-8")
+
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+    assert "search_terms" not in stats.counters
+    assert index_path.read_text(encoding="utf-8") == index
+
+    index_path.unlink()
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+    assert stats.counters["search_terms"] == 4
+    assert "search_notes_read" not in stats.counters
+    assert index_path.read_text(encoding="utf-8") == index
@@ -0,0 +1,87 @@
+import os
+
+import pytest
+from obyde import process_vault
+from obyde.check import check_vault
+from obyde.stats import BuildStats
+
+
+@pytest.fixture
+def targets(site, tmp_path, write_note):
+    vault, posts, config = site
+    (vault / "attachments" / "image.png").write_bytes(b"png")
+    hugo_posts = tmp_path / "hugo" / "content"
+    hugo_assets = tmp_path / "hugo" / "static"
+    for d in (hugo_posts, hugo_assets):
+        d.mkdir(parents=True)
+    config["output"] = [
+        dict(config["output"], relative_asset_path_prefix="/assets"),
+        {"post_output_path": str(hugo_posts), "asset_output_path": str(hugo_assets),
+         "relative_asset_path_prefix": "/static", "post_link_mode": "hugo"},
+    ]
+    write_note(vault, "First Note", "Links to [[Second Note]] and ==marks== ![[image.png]].")
+    write_note(vault, "Second Note", "Nothing here.", date="2021-08-22")
+    return vault, posts, hugo_posts, config
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_notes_are_rendered_once_for_every_target(targets, jobs, read_post):
+    vault, posts, hugo_posts, config = targets
+    stats = BuildStats()
+    process_vault(config, jobs=jobs, stats=stats)
+
+    jekyll_post = read_post(posts, "2021-08-21-first-note.md")
+    hugo_post = read_post(hugo_posts, "2021-08-21-first-note.md")
+    assert "[Second Note]({% post_url 2021-08-22-second-note %})" in jekyll_post
+    assert "[Second Note]({{< relref \"2021-08-22-second-note\" >}})" in hugo_post
+    assert "<mark>marks</mark> ![image.png](/assets/" in jekyll_post
+    assert "<mark>marks</mark> ![image.png](/static/" in hugo_post
+    assert os.listdir(config["output"][0]["asset_output_path"]) == os.listdir(
+        config["output"][1]["asset_output_path"])
+    assert stats.counters["notes_rendered"] == 2
+    assert stats.counters["posts_written"] == 4
+    assert stats.counters["transformed_blocks.ObsidianHighlightRewritingTransformer"] == 1
+
+
+def test_added_target_is_built_without_rebuilding_the_others(targets, read_post):
+    vault, posts, hugo_posts, config = targets
+    outputs = config["output"]
+    config["output"] = outputs[:1]
+    process_vault(config)
+    (posts / "2021-08-21-first-note.md").write_text("sentinel", encoding="utf-8")
+
+    config["output"] = outputs
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+
+    assert read_post(posts, "2021-08-21-first-note.md") == "sentinel"
+    assert sorted(os.listdir(hugo_posts)) == ["2021-08-21-first-note.md", "2021-08-22-second-note.md"]
+    assert stats.counters["posts_written"] == 2
+
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+    assert stats.counters["notes_rendered"] == 0
+
+
+def test_single_target_keeps_its_manifest(site, write_note):
+    vault, posts, config = site
+    write_note(vault, "First Note", "Body.")
+    process_vault(config)
+    manifests = [name for name in os.listdir(config["build"]["cache_dir"]) if name.startswith("manifest")]
+    assert manifests == ["manifest.json"]
+
+
+def test_targets_must_not_share_a_post_output_path(targets):
+    vault, posts, hugo_posts, config = targets
+    config["output"][1]["post_output_path"] = str(posts)
+    with pytest.raises(ValueError):
+        process_vault(config)
+
+
+def test_check_validates_every_target(targets):
+    vault, posts, hugo_posts, config = targets
+    config["output"][1]["post_link_mode"] = "pelican"
+    config["output"][1]["asset_output_path"] = str(hugo_posts / "missing")
+    messages = [message for _, message in check_vault(config)]
+    assert any("pelican" in message for message in messages)
+    assert any("asset output path" in message for message in messages)
@@ -0,0 +1,90 @@
+import pytest
+from obyde import process_vault
+from obyde.stats import BuildStats
+from obyde.transclusion import Transcluder, block_section, heading_section
+
+SNIPPET = "Intro ==marked==.\n\n# Usage\nRun [[First Note]].\n```\n# not a heading\n```\n## Details\nMore.\n\n# Other\nRest."
+
+
+def test_heading_section_stops_at_the_next_heading_of_the_same_level():
+    assert heading_section(SNIPPET, "usage") == "# Usage\nRun [[First Note]].\n```\n# not a heading\n```\n## Details\nMore."
+    assert heading_section(SNIPPET, "Details") == "## Details\nMore."
+    assert heading_section(SNIPPET, "not a heading") is None
+
+
+def test_block_section_is_the_block_marked_with_the_id():
+    content = ("First.\n\n# Title\nSecond line\nof the block ^para\n\n- a\n- b ^item\n\n^list\n\n"
+               "```\nnot ^code\n```")
+    assert block_section(content, "para") == "Second line\nof the block"
+    assert block_section(content, "item") == "- b"
+    assert block_section(content, "list") == "- a\n- b ^item"
+    assert block_section(content, "code") is None
+
+
+def test_embedded_notes_are_inlined(site, write_note, read_post):
+    vault, posts, config = site
+    (vault / "attachments" / "image.png").write_bytes(b"png")
+    write_note(vault, "First Note", "Before\n\n![[Snippet]]\n\nAfter ![[image.png]]")
+    write_note(vault, "Second Note", "Only ![[Snippet#Usage]]\n\n![[Snippet#^end]]")
+    write_note(vault, "Snippet", SNIPPET + " ^end")
+
+    process_vault(config)
+
+    first = read_post(posts, "2021-08-21-first-note.md")
+    assert first.startswith("---\ndate: 2021-08-21\n---\n\nBefore\n\nIntro <mark>marked</mark>.\n\n# Usage\n"
+                            "Run [First Note]({% post_url 2021-08-21-first-note %}).")
+    assert "# Other\nRest. ^end\n\nAfter ![image.png](" in first
+    assert read_post(posts, "2021-08-21-second-note.md").endswith(
+        "Only # Usage\nRun [First Note]({% post_url 2021-08-21-first-note %}).\n```\n# not a heading\n```\n"
+        "## Details\nMore.\n\nRest.")
+
+
+def test_embedded_notes_are_rendered_once_per_run(site, monkeypatch, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "Snippet", "Shared ==snippet==")
+    for i in range(5):
+        write_note(vault, f"Note {i}", "![[Snippet]] twice ![[Snippet]]")
+    renders = []
+    original_render = Transcluder._render
+    monkeypatch.setattr(Transcluder, "_render",
+                        lambda self, slug_name, *args: renders.append(slug_name) or original_render(self, slug_name, *args))
+
+    process_vault(config)
+
+    assert renders == ["snippet"]
+    assert read_post(posts, "2021-08-21-note-3.md").endswith("Shared <mark>snippet</mark> twice Shared <mark>snippet</mark>")
+
+
+def test_embed_cycles_and_deep_nesting_fail_the_note(site, write_note):
+    vault, posts, config = site
+    config["build"]["max_embed_depth"] = 2
+    write_note(vault, "A", "![[B]]")
+    write_note(vault, "B", "![[A]]")
+    write_note(vault, "C", "![[D]]")
+    write_note(vault, "D", "![[E]]")
+    write_note(vault, "E", "![[F]]")
+    write_note(vault, "F", "Deep.")
+
+    with pytest.raises(ValueError) as error:
+        process_vault(config)
+
+    message = str(error.value)
+    assert "Embed cycle detected: b -> a -> b" in message
+    assert "nested more than 2 levels deep in" in message
+    # D embeds E which embeds F, which is exactly two levels deep
+    assert "Failed to render 3 note(s)" in message
+    assert str(vault / "C.md") in message
+
+
+def test_embedding_notes_are_rendered_again_when_the_embedded_note_changes(site, write_note, read_post):
+    vault, posts, config = site
+    write_note(vault, "First Note", "![[Snippet]]")
+    write_note(vault, "Snippet", "Old.")
+    process_vault(config)
+
+    write_note(vault, "Snippet", "New.")
+    stats = BuildStats()
+    process_vault(config, stats=stats)
+
+    assert stats.counters["notes_rendered"] == 2
+    assert read_post(posts, "2021-08-21-first-note.md").endswith("\n\nNew.")
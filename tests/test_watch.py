@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+from obyde import BuildState, process_vault
+from obyde.watch import watch_vault
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+@pytest.fixture(params=[False, True], ids=["inotify", "polling"])
+def watching(request, site, write_note):
+    vault, posts, config = site
+    state = BuildState()
+    builds = []
+    stop = threading.Event()
+
+    def build(scan, initial):
+        state.scan = scan
+        process_vault(config, state=state)
+        builds.append(initial)
+
+    thread = threading.Thread(target=watch_vault, args=(config, build),
+                              kwargs={"polling": request.param, "poll_interval": 0.05,
+                                      "debounce": 0.05, "should_stop": stop.is_set})
+    write_note(vault, "Target", "Target.")
+    write_note(vault, "Linking", "See [[Target]].")
+    thread.start()
+    assert wait_for(lambda: builds)
+    yield vault, posts, builds
+    stop.set()
+    thread.join()
+
+
+def test_watch_rebuilds_changed_notes_and_their_backlinks(watching, write_note, read_post):
+    vault, posts, builds = watching
+    assert read_post(posts, "2021-08-21-linking.md").endswith("({% post_url 2021-08-21-target %}).")
+
+    write_note(vault, "Target", "Edited.")
+    assert wait_for(lambda: read_post(posts, "2021-08-21-target.md").endswith("Edited."))
+
+    write_note(vault, "Target", "Redated.", date="2021-09-01")
+    assert wait_for(lambda: read_post(posts, "2021-08-21-linking.md").endswith(
+        "({% post_url 2021-09-01-target %})."))
+
+    write_note(vault, "New", "Added.")
+    assert wait_for(lambda: (posts / "2021-08-21-new.md").exists())
+    assert builds[0] and not any(builds[1:])